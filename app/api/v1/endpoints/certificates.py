@@ -1,62 +1,277 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Query, Request
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse, Response
+from fastapi.concurrency import run_in_threadpool
 import logging
 import io
+import time
 from datetime import datetime
+from typing import Literal, Optional
 
 
+from app.config import get_settings
 from app.services.certificate_service import CertificateService
 from app.schemas.certificate import (
     GenerateRequest,
     GenerateResponse,
+    CertificatePreviewRequest,
     PreviewResponse,
     CertificateMetadata
 )
+from app.utils.exceptions import NotFoundError, OverloadedError, PDFGenerationError, ValidationError
 
 import zipfile
 import io
 logger = logging.getLogger(__name__)
+settings = get_settings()
 router = APIRouter(prefix="/certificates")
+
+DownloadMode = Literal["stream", "presigned", "redirect", "accel"]
+
+
+def _object_download_response(minio, object_key: str, filename: str, mode: str, media_type: str):
+    """Hand an object to the client without passing its bytes through the API.
+
+    - presigned: JSON with a time-limited MinIO URL
+    - redirect: 307 to the presigned URL
+    - accel: empty response with X-Accel-Redirect, nginx streams the object from MinIO
+    """
+    if mode == "accel":
+        from app.storage.minio_storage import content_disposition
+        return Response(
+            media_type=media_type,
+            headers={
+                "X-Accel-Redirect": minio.accel_redirect_path(object_key, filename),
+                "Content-Disposition": content_disposition(filename),
+            }
+        )
+
+    url = minio.presigned_get_url(object_key, filename)
+    if mode == "redirect":
+        return RedirectResponse(url, status_code=307)
+    return {
+        "url": url,
+        "filename": filename,
+        "expires_in": settings.PRESIGNED_URL_EXPIRATION,
+    }
+
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """Parse a single `bytes=start-end` Range header into an inclusive (start, end)."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_s, _, end_s = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            if end_s and int(end_s) < start:
+                # Not a valid range spec: ignored, the whole object is sent
+                return None
+            end = int(end_s) if end_s else size - 1
+        else:
+            # Suffix range: last N bytes
+            start = max(size - int(end_s), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+async def _ranged_object_response(minio, object_key: str, filename: str, media_type: str, range_header: Optional[str]):
+    """Stream one MinIO object to the client, honouring HTTP Range for resumable downloads.
+
+    Raises:
+        NotFoundError: if the object is not in the bucket
+    """
+    from minio.error import S3Error
+    from app.storage.minio_storage import content_disposition
+
+    try:
+        stat = await run_in_threadpool(minio.client.stat_object, minio.bucket, object_key)
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+            raise NotFoundError(f"Object {object_key} not found")
+        raise
+    byte_range = _parse_range(range_header, stat.size)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(filename),
+        "ETag": f'"{stat.etag}"',
+    }
+
+    if byte_range:
+        start, end = byte_range
+        response = await run_in_threadpool(
+            minio.client.get_object, minio.bucket, object_key, offset=start, length=end - start + 1
+        )
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        status_code = 206
+    else:
+        response = await run_in_threadpool(minio.client.get_object, minio.bucket, object_key)
+        headers["Content-Length"] = str(stat.size)
+        status_code = 200
+
+    def _iter_object():
+        try:
+            yield from response.stream(64 * 1024)
+        finally:
+            response.close()
+            response.release_conn()
+
+    return StreamingResponse(_iter_object(), status_code=status_code, media_type=media_type, headers=headers)
+
+
+async def _serve_object(
+    minio,
+    object_key: str,
+    filename: str,
+    media_type: str,
+    request: Request,
+    mode: Optional[str],
+    check_exists: bool = False,
+):
+    """Serve one MinIO object in the requested download mode (DOWNLOAD_MODE by default).
+
+    Raises:
+        NotFoundError: if the object is not in the bucket (checked for non-stream
+            modes only with `check_exists`, since signing a URL does not check it)
+    """
+    mode = mode or settings.DOWNLOAD_MODE
+    if mode == "stream":
+        return await _ranged_object_response(minio, object_key, filename, media_type, request.headers.get("range"))
+    if check_exists and not await run_in_threadpool(minio.object_exists, object_key):
+        raise NotFoundError(f"Object {object_key} not found")
+    return await run_in_threadpool(_object_download_response, minio, object_key, filename, mode, media_type)
+
+
 # Then add this NEW route:
 @router.get("/download/{batch_id}")
-async def download_certificates(batch_id: str):
-    """Download certificates as ZIP file."""
+async def download_certificates(
+    batch_id: str,
+    request: Request,
+    mode: Optional[DownloadMode] = Query(None, description="stream | presigned | redirect | accel")
+):
+    """Download certificates as ZIP file.
+    
+    Serves the batch archive prebuilt during generation (built on first
+    request for batches without one). `stream` sends it through the API with
+    Range support; the other modes let the client or nginx fetch it from MinIO.
+    """
     try:
-        logger.info(f"📦 Download requested for batch: {batch_id}")
+        mode = mode or settings.DOWNLOAD_MODE
+        logger.info(f"📦 Download requested for batch: {batch_id} (mode={mode})")
         
         from app.storage.minio_storage import MinIOStorage
         minio = MinIOStorage()
-        
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            objects = minio.client.list_objects(
-                'certificates',
-                prefix=f'{batch_id}/',
-                recursive=True
-            )
-            
-            for obj in objects:
-                response = minio.client.get_object('certificates', obj.object_name)
-                file_data = response.read()
-                filename = obj.object_name.split('/')[-1]
-                zf.writestr(filename, file_data)
-        
-        zip_buffer.seek(0)
-        logger.info(f"✅ ZIP ready: {zip_buffer.getbuffer().nbytes} bytes")
-        
-        return StreamingResponse(
-    iter([zip_buffer.getvalue()]),
-    media_type="application/zip",
-    headers={"Content-Disposition": f"attachment; filename=certificates_{batch_id}.zip"}
-)
 
-        
+        service = CertificateService()
+        key = await service.get_batch_archive_key(batch_id)
+        return await _serve_object(minio, key, f"certificates_{batch_id}.zip", "application/zip", request, mode)
+
+    except HTTPException:
+        raise
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"❌ Download error: {e}", exc_info=True)
         raise
 
 
+@router.get("/download/{batch_id}/{filename}")
+async def download_certificate(
+    batch_id: str,
+    filename: str,
+    request: Request,
+    mode: Optional[DownloadMode] = Query(None, description="stream | presigned | redirect | accel")
+):
+    """Download a single certificate of a batch (with Range support in `stream` mode)."""
+    try:
+        from app.storage.minio_storage import MinIOStorage
+        minio = MinIOStorage()
+        object_key = f"{batch_id}/{filename}"
+        return await _serve_object(minio, object_key, filename, "application/pdf", request, mode, check_exists=True)
+    except HTTPException:
+        raise
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Error downloading certificate: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to download certificate")
+
+
+@router.get("/download/{batch_id}/participants/{participant_id}")
+async def download_participant_certificate(
+    batch_id: str,
+    participant_id: str,
+    request: Request,
+    mode: Optional[DownloadMode] = Query(None, description="stream | presigned | redirect | accel")
+):
+    """Download one participant's certificate, resolved through the batch manifest."""
+    try:
+        from app.storage.minio_storage import MinIOStorage
+
+        service = CertificateService()
+        entry = await service.get_participant_certificate(batch_id, participant_id)
+        object_key = entry['key']
+        filename = object_key.split('/')[-1]
+        minio = MinIOStorage()
+        return await _serve_object(minio, object_key, filename, "application/pdf", request, mode)
+    except HTTPException:
+        raise
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Error downloading certificate: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to download certificate")
+
+
+@router.get("/links/{batch_id}", summary="Presigned download links for a batch")
+async def get_download_links(batch_id: str):
+    """Return presigned MinIO URLs for every certificate and the batch ZIP.
+    
+    A batch without a ZIP yet gets it built by an archive worker: `archive`
+    is null and `archive_status` is "pending" until it is ready.
+    """
+    try:
+        from app.storage.minio_storage import MinIOStorage
+        minio = MinIOStorage()
+        service = CertificateService()
+
+        object_keys = await service.get_batch_object_keys(batch_id)
+        if not object_keys:
+            raise NotFoundError(f"No certificates found in batch {batch_id}")
+        archive = await service.request_batch_archive(batch_id)
+
+        def _build_links():
+            certificates = []
+            for object_key in object_keys:
+                filename = object_key.split('/')[-1]
+                certificates.append({
+                    "filename": filename,
+                    "url": minio.presigned_get_url(object_key, filename),
+                })
+            return {
+                "batch_id": batch_id,
+                "expires_in": settings.PRESIGNED_URL_EXPIRATION,
+                "archive": minio.presigned_get_url(archive, f"certificates_{batch_id}.zip") if archive else None,
+                "archive_status": "ready" if archive else "pending",
+                "certificates": certificates,
+            }
+
+        return await run_in_threadpool(_build_links)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Error building download links: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to build download links")
+
+
 
 
 
@@ -78,6 +293,10 @@ async def generate_certificates(
     """
     Generate PDF certificates for all participants using template.
     
+    Large batches are subject to admission control: when the service is at
+    capacity the request is refused with 429 and a Retry-After estimate
+    (see GET /certificates/capacity).
+    
     Args:
         request: Certificate generation request with:
             - template_id: Template to use
@@ -85,33 +304,83 @@ async def generate_certificates(
             - event_location: Event location
             - issue_date: Certificate issue date
             - send_email: Whether to email certificates
+            - background: Queue the batch for a render worker instead of waiting
+            - email_delivery: queued (workers email stored certificates) or fused
+              (emailed as they are rendered)
+            - template_variants: Optional template per role/place
     """
     try:
         logger.info(f"📨 Certificate generation request received: {request.dict()}")
         
+        ticket = await service.admit_generation(background=request.background)
+        fused_email = request.send_email and (request.email_delivery or settings.EMAIL_DELIVERY_MODE) == 'fused'
+
+        if request.background:
+            try:
+                task_id = await service.enqueue_generation(
+                    template_id=request.template_id,
+                    event_name=request.event_name,
+                    event_location=request.event_location,
+                    issue_date=request.issue_date,
+                    build_archive=request.build_archive,
+                    template_variants=request.template_variants,
+                    send_email=request.send_email,
+                    fused_email=fused_email,
+                    admission_ticket=ticket
+                )
+            except Exception:
+                await service.release_generation(ticket)
+                raise
+            return GenerateResponse(
+                status="queued",
+                count=0,
+                message="Generation queued",
+                task_id=task_id
+            )
+
         # Generate certificates for all participants
-        result = await service.generate_certificates(
-            template_id=request.template_id,
-            event_name=request.event_name,
-            event_location=request.event_location,
-            issue_date=request.issue_date
-        )
+        started = time.perf_counter()
+        rendered = 0
+        try:
+            result = await service.generate_certificates(
+                template_id=request.template_id,
+                event_name=request.event_name,
+                event_location=request.event_location,
+                issue_date=request.issue_date,
+                build_archive=request.build_archive,
+                template_variants=request.template_variants,
+                fused_email=fused_email
+            )
+            rendered = result.get('count', 0)
+        finally:
+            await service.release_generation(ticket, rendered, time.perf_counter() - started)
         
-        # TODO: If send_email is True, queue Celery tasks for each participant
-        if request.send_email:
-            logger.info("Email sending queued for certificates")
+        emails_queued = result.get('emails_queued')
+        if request.send_email and not fused_email and result.get('batch_id'):
+            emails_queued = await service.queue_certificate_emails(result['batch_id'])
+            logger.info(f"📧 Email sending queued for {emails_queued} certificates")
         
         return GenerateResponse(
     status="success",
     count=result.get('count', 0),
     batch_id=result.get('batch_id'),  # ✅ ADD THIS LINE
     message=result.get('message'),
-    errors=result.get('errors')
+    errors=result.get('errors'),
+    emails_queued=emails_queued,
+    emails_sent=result.get('emails_sent')
 )
 
-    except ValueError as e:
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except (ValueError, ValidationError) as e:
         logger.warning(f"Validation error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating certificates: {e}", exc_info=True)
         raise HTTPException(
@@ -121,11 +390,105 @@ async def generate_certificates(
 
 
 
+@router.post(
+    "/preview",
+    summary="Render a low-resolution preview for one participant"
+)
+async def preview_certificate(request: CertificatePreviewRequest):
+    """
+    Render a single certificate at preview DPI without starting a batch.
+    
+    Previews run on their own small process pool and are cached by template
+    hash and variables, so re-checking an unchanged template is instant.
+    Returns the PDF/PNG bytes, or a PreviewResponse for format=html. A PNG
+    preview is the first page; for HTML templates it is rasterised from the
+    preview PDF, which needs pypdfium2 (400 without it).
+    """
+    from app.services.preview_service import PreviewService
+
+    try:
+        result = await PreviewService().render_preview(
+            template_id=request.template_id,
+            event_name=request.event_name,
+            event_location=request.event_location,
+            issue_date=request.issue_date,
+            participant_id=request.participant_id,
+            output_format=request.format,
+            dpi=request.dpi
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except PDFGenerationError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error rendering preview: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to render preview")
+
+    if request.format == "html":
+        return PreviewResponse(
+            html_content=result['content'],
+            participant_id=result['participant_id'],
+            template_id=result['template_id']
+        )
+
+    return Response(
+        content=result['content'],
+        media_type=result['media_type'],
+        headers={
+            "Content-Disposition": f'inline; filename="preview.{request.format}"',
+            "Cache-Control": "private, no-cache",
+            "X-Preview-Cache": "hit" if result['cached'] else "miss",
+        }
+    )
+
+
+@router.get(
+    "/capacity",
+    summary="Generation capacity and current load"
+)
+async def get_capacity(
+    service: CertificateService = Depends(get_certificate_service)
+):
+    """Backlog, queue depth, active batches and throughput used for admission control."""
+    try:
+        return await service.get_capacity()
+    except Exception as e:
+        logger.error(f"Error reading capacity: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Capacity status unavailable"
+        )
+
+
+@router.get(
+    "/tasks/{task_id}",
+    summary="Status of a background generation"
+)
+async def get_generation_status(
+    task_id: str,
+    service: CertificateService = Depends(get_certificate_service)
+):
+    """State of a generation queued with background=true (PENDING, STARTED, SUCCESS, FAILURE...)."""
+    try:
+        return await service.get_generation_status(task_id)
+    except Exception as e:
+        logger.error(f"Error reading generation task {task_id}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to read generation status"
+        )
+
+
 @router.get(
     "/download",
     summary="Download all certificates as ZIP"
 )
 async def download_certificates(
+    request: Request,
     service: CertificateService = Depends(get_certificate_service)
 ):
     """
@@ -134,16 +497,17 @@ async def download_certificates(
     Returns a ZIP file containing all PDFs from the last generation.
     """
     try:
-        # Get ZIP of all certificates
-        zip_bytes = await service.get_certificates_zip()
-        
-        # Return as downloadable ZIP
-        return StreamingResponse(
-            io.BytesIO(zip_bytes),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=certificates.zip"}
+        from app.storage.minio_storage import MinIOStorage
+
+        key = await service.get_batch_archive_key()
+        return await _ranged_object_response(
+            MinIOStorage(), key, "certificates.zip", "application/zip", request.headers.get("range")
         )
     
+    except HTTPException:
+        raise
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.error(f"Error downloading certificates: {e}")
         raise HTTPException(
@@ -162,11 +526,14 @@ async def cleanup_certificates(
 ):
     """Delete all generated certificate files."""
     try:
-        count = await service.cleanup_certificates()
+        report = await service.cleanup_certificates()
+        count = report['objects']
         
         return {
             "success": True,
             "deleted_count": count,
+            "deleted_batches": report['batches'],
+            "reclaimed_bytes": report['bytes'],
             "message": f"Deleted {count} certificate files"
         }
     except Exception as e:
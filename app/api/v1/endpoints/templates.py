@@ -1,6 +1,5 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
 import logging
-import os
 
 from app.services.template_service import TemplateService
 from app.schemas.template import TemplateCreate, TemplateResponse
@@ -22,8 +21,8 @@ async def upload_template_zip(
 ):
     try:
         logger.info(f"Uploading ZIP: {file.filename}")
-        zip_content = await file.read()
-        template = await service.upload_template_zip(zip_content, name)
+        # Pass the spooled upload through; the service streams it from disk
+        template = await service.upload_template_zip(file.file, name)
         return TemplateResponse(**template)
     except Exception as e:
         logger.error(f"Error uploading ZIP: {e}", exc_info=True)
@@ -89,41 +88,15 @@ async def update_template(
 ):
     try:
         logger.info(f"Updating template: {template_id}")
-        
-        # Get existing template
-        template = await service.get_template(template_id)
-        if not template:
+
+        updated_metadata = await service.update_template(
+            template_id,
+            name=request.name,
+            content=request.content,
+            template_type=request.type
+        )
+        if not updated_metadata:
             raise HTTPException(status_code=404, detail="Template not found")
-        
-        # Update the file content (keep same ID and path)
-        template_path = template.get('content_path')
-        # Update the file content. content_path may be a MinIO key or local path.
-        # If it's a MinIO key (starts with 'templates/'), upload the new content to MinIO
-        updated_content_path = template_path
-        if service and getattr(service, 'minio', None) and isinstance(template_path, str) and template_path.startswith('templates/'):
-            # upload to MinIO under same key
-            service.minio.upload_template(template_id, request.content.encode('utf-8'), object_name=template_path.split('/', 2)[-1])
-            updated_content_path = template_path
-        else:
-            # write local file
-            with open(template_path, 'w', encoding='utf-8') as f:
-                f.write(request.content)
-            updated_content_path = template_path
-
-        logger.info(f"Updated template file: {updated_content_path}")
-
-        # Update metadata in Redis (keep same template_id!)
-        updated_metadata = {
-            'id': template_id,
-            'name': request.name,
-            'type': request.type,
-            'content_path': updated_content_path,
-            'variables': template.get('variables', []),
-            'created_at': template.get('created_at'),
-            'updated_at': str(os.path.getctime(template_path)) if os.path.exists(template_path) else None,
-        }
-
-        await service.storage.save_template(template_id, updated_metadata)
 
         logger.info(f"✅ Template updated: {template_id}")
         return TemplateResponse(**updated_metadata)
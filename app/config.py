@@ -20,11 +20,19 @@ class Settings(BaseSettings):
     CELERY_TASK_SERIALIZER: str = "json"
     CELERY_RESULT_SERIALIZER: str = "json"
     CELERY_ACCEPT_CONTENT: list = ["json"]
+    CELERY_RESULT_EXPIRES: int = 3600  # seconds results stay in the backend (tasks that keep one)
+    CELERY_RENDER_QUEUE: str = "render"  # batch generation (CPU)
+    CELERY_EMAIL_QUEUE: str = "email"  # SMTP delivery (network I/O)
+    CELERY_ARCHIVE_QUEUE: str = "archive"  # batch ZIP assembly (MinIO I/O)
     
     
     MAX_FILE_SIZE: int = 50 * 1024 * 1024
+    TEMPLATE_ZIP_MAX_FILES: int = 200
+    TEMPLATE_ZIP_MAX_UNCOMPRESSED: int = 200 * 1024 * 1024
+    TEMPLATE_ZIP_MAX_RATIO: int = 100  # per-member uncompressed/compressed limit (zip bombs)
     UPLOAD_TEMP_DIR: str = "./temp/uploads"
     TEMPLATES_DIR: str = "./data/templates"
+    TEMPLATE_CACHE_REVALIDATE: int = 30  # seconds between ETag checks of a cached template
     CERTIFICATES_DIR: str = "./temp/certificates"
     ALLOWED_EXTENSIONS: list = [".csv", ".xlsx"]
     
@@ -35,11 +43,48 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: Optional[str] = None
     SMTP_FROM_EMAIL: str = "noreply@sirius-certs.ru"
     SMTP_USE_TLS: bool = True
-    EMAIL_RATE_LIMIT: int = 100  # emails per minute
+    SMTP_POOL_SIZE: int = 4  # SMTP sessions kept open per worker process
+    SMTP_MAX_SENDS_PER_CONNECTION: int = 100  # recycle a session after this many messages
+    SMTP_IDLE_TIMEOUT: int = 60  # seconds before an unused session is closed
+    EMAIL_RATE_LIMIT: int = 100  # emails per minute, shared by all workers
+    EMAIL_RATE_BURST: int = 10  # emails that may go out back-to-back
+    EMAIL_RATE_LIMIT_TIMEOUT: int = 300  # max seconds a send waits for a token before retrying
+    EMAIL_ENQUEUE_CHUNK: int = 500  # tasks published per broker round
+    EMAIL_BULK_ENABLED: bool = False  # send batches through the async bulk mailer instead of one task per email
+    EMAIL_BULK_TASK_SIZE: int = 1000  # emails per bulk-send task
+    EMAIL_BULK_CONCURRENCY: int = 20  # SMTP sessions one bulk mailer drives concurrently
+    EMAIL_BULK_PER_DOMAIN: int = 5  # concurrent sends to one recipient domain
+    EMAIL_DELIVERY_MODE: str = "queued"  # "fused": email rendered certificates during generation
+    EMAIL_FUSED_BUFFER: int = 200  # rendered certificates kept in memory for the fused mail stage
     
     # PDF Generation
-    PDF_TIMEOUT: int = 30  # seconds
+    PDF_TIMEOUT: int = 30  # seconds one render may take before its process is killed
+    RENDER_MEMORY_LIMIT_MB: int = 2048  # address space per render process, 0 = unlimited
+    RENDER_MAX_TASKS_PER_WORKER: int = 500  # recycle a render process after this many certificates
+    RENDER_POOL_SIZE: int = 0  # render processes per API/worker process, 0 = one per CPU
+    RENDER_POOL_START_TIMEOUT: int = 120  # seconds startup waits for render processes to warm up
+    RENDER_INTERACTIVE_MAX: int = 50  # batches up to this size jump ahead of bulk ones
+    UPLOAD_CONCURRENCY: int = 4  # concurrent certificate uploads per process (starting point when autotuned)
+    AUTOTUNE_ENABLED: bool = True  # adjust render/upload concurrency from measured latency (AIMD)
+    AUTOTUNE_SAMPLE_SIZE: int = 20  # operations per autotuner decision
+    AUTOTUNE_RENDER_MAX_PER_PROCESS: int = 4  # most renders queued per render process
+    AUTOTUNE_UPLOAD_MIN: int = 1
+    AUTOTUNE_UPLOAD_MAX: int = 16
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_BACKLOG: int = 50000  # certificates admitted and not yet rendered, all processes
+    ADMISSION_MAX_ACTIVE_BATCHES: int = 4  # batches generating at once in one API process
+    ADMISSION_MAX_QUEUED_BATCHES: int = 20  # generation tasks waiting in the render queue
+    ADMISSION_DEFAULT_RATE: float = 10.0  # certificates/s assumed until a batch has been measured
+    WARMUP_ENABLED: bool = True  # start and warm the render pool at API/worker startup
     PDF_DPI: int = 300
+    PDF_PAGE_SIZE: str = "A4"  # A3 | A4 | A5 | LETTER, used to size template images
+    IMAGE_JPEG_QUALITY: int = 85  # recompression quality for template images
+    ASSET_CACHE_MAX_BYTES: int = 256 * 1024 * 1024  # per-process renderer asset cache
+
+    # Previews
+    PREVIEW_DPI: int = 72  # image resolution used for previews
+    PREVIEW_POOL_SIZE: int = 2  # dedicated render processes, separate from batch generation
+    PREVIEW_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -48,13 +93,25 @@ class Settings(BaseSettings):
     # Data Retention
     SESSION_EXPIRATION: int = 3600  # 1 hour in seconds
     TEMP_FILES_RETENTION: int = 86400  # 24 hours in seconds
+    RETENTION_SWEEP_ENABLED: bool = True
+    RETENTION_SWEEP_INTERVAL: int = 600  # seconds between sweeps
 
     # MinIO / S3
     MINIO_URL: str = "http://minio:9000"
     MINIO_ACCESS_KEY: str = "minioadmin"
     MINIO_SECRET_KEY: str = "minioadmin"
     MINIO_BUCKET: str = "certificates"
-    
+    MINIO_REGION: str = "us-east-1"
+    MINIO_PUBLIC_URL: Optional[str] = None  # externally reachable MinIO URL used to sign links
+    MINIO_FETCH_CONCURRENCY: int = 16  # parallel GETs when assembling ZIPs
+
+    # Downloads
+    DOWNLOAD_MODE: str = "stream"  # stream | presigned | redirect | accel
+    PRESIGNED_URL_EXPIRATION: int = 3600  # seconds
+    ACCEL_REDIRECT_LOCATION: str = "/_minio"  # internal nginx location proxying to MinIO
+    BUILD_ARCHIVE: bool = True  # prebuild the batch ZIP while certificates are generated
+    ARCHIVE_PART_SIZE: int = 16 * 1024 * 1024  # multipart part size for archive uploads
+
     class Config:
         env_file = ".env"
         case_sensitive = True
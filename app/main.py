@@ -1,8 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import logging
 
 from app.config import get_settings
@@ -17,15 +18,43 @@ logging.basicConfig(level=settings.LOG_LEVEL, format=settings.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 
+def _start_renderers():
+    """Start and warm the render pool, then report ready (renders only happen in its processes)."""
+    from app.services.render_pool import start_render_pool
+    from app.utils.warmup import mark_ready
+    mark_ready(render_pool=start_render_pool())
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifespan - startup and shutdown."""
     # Startup
     logger.info("Starting Certificate Generation Service")
     await init_redis()
+    from app.utils.warmup import mark_ready
+    warmup_task = None
+    if settings.WARMUP_ENABLED:
+        # Serve /health immediately; /ready flips once the render processes are warm
+        warmup_task = asyncio.create_task(asyncio.to_thread(_start_renderers))
+    else:
+        mark_ready()
+    retention_task = None
+    if settings.RETENTION_SWEEP_ENABLED:
+        from app.services.retention_service import run_retention_loop
+        retention_task = asyncio.create_task(run_retention_loop())
     yield
     # Shutdown
     logger.info("Shutting down Certificate Generation Service")
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    if retention_task:
+        retention_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await retention_task
+    from app.services.preview_service import shutdown_preview_pool
+    from app.services.render_pool import shutdown_render_pool
+    shutdown_preview_pool()
+    shutdown_render_pool()
     await close_redis()
 
 
@@ -74,6 +103,23 @@ async def health_check():
     return {"status": "ok", "service": settings.APP_NAME}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 503 until renderer warm-up has finished."""
+    from app.utils.warmup import is_ready, warmup_status
+    status = warmup_status()
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up", "warmup": status})
+    return {"status": "ready", "warmup": status}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Process metrics in Prometheus text format."""
+    from app.utils.metrics import render_metrics
+    return render_metrics()
+
+
 @app.get("/")
 async def root():
     """Root endpoint."""
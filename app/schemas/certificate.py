@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Dict, Literal, Optional, List
 from datetime import datetime
 
 
@@ -10,6 +10,16 @@ class CertificateGenerateRequest(BaseModel):
     event_location: str = Field(..., description="Event location")
     issue_date: str = Field(..., description="Certificate issue date")
     send_email: bool = Field(default=False, description="Send certificates via email")
+    background: bool = Field(default=False, description="Generate in a render worker; the response carries a task_id to poll")
+    email_delivery: Optional[Literal['queued', 'fused']] = Field(
+        None,
+        description="queued: workers email stored certificates; fused: email them as they are rendered (defaults to EMAIL_DELIVERY_MODE)"
+    )
+    build_archive: Optional[bool] = Field(None, description="Prebuild the batch ZIP during generation (defaults to BUILD_ARCHIVE)")
+    template_variants: Optional[Dict[str, str]] = Field(
+        None,
+        description="Template per role/place, e.g. {'place:1': id, 'role:speaker': id}; place wins over role, others use template_id"
+    )
 
     class Config:
         json_schema_extra = {
@@ -18,7 +28,12 @@ class CertificateGenerateRequest(BaseModel):
                 "event_name": "Annual Science Conference 2024",
                 "event_location": "Sirius Federal Territory",
                 "issue_date": "2024-11-28",
-                "send_email": False
+                "send_email": False,
+                "build_archive": True,
+                "template_variants": {
+                    "place:1": "6fa36b55-8ec9-40b5-883e-d7486ba48766",
+                    "role:speaker": "a5ee29ff-4e39-4065-b8f6-58757981a74d"
+                }
             }
         }
 
@@ -52,6 +67,9 @@ class CertificateGenerateResponse(BaseModel):
     batch_id: Optional[str] = None
     message: Optional[str] = Field(None, description="Status message")
     errors: Optional[List[str]] = Field(default_factory=list, description="List of errors if any")
+    emails_queued: Optional[int] = Field(None, description="Certificates queued for email delivery (send_email=true)")
+    emails_sent: Optional[int] = Field(None, description="Certificates emailed during generation (email_delivery=fused)")
+    task_id: Optional[str] = Field(None, description="Generation task to poll (background=true)")
 
     class Config:
         json_schema_extra = {
@@ -64,6 +82,29 @@ class CertificateGenerateResponse(BaseModel):
         }
 
 
+class CertificatePreviewRequest(BaseModel):
+    """Request to preview a certificate for one participant."""
+    template_id: str = Field(..., description="Template ID to use")
+    participant_id: Optional[str] = Field(None, description="Participant to render (defaults to the first one)")
+    event_name: str = Field(..., description="Event name")
+    event_location: str = Field(..., description="Event location")
+    issue_date: str = Field(..., description="Certificate issue date")
+    format: Literal['pdf', 'png', 'html'] = Field('pdf', description="Output format (png is the first page)")
+    dpi: Optional[int] = Field(None, ge=36, le=300, description="Preview resolution (defaults to PREVIEW_DPI)")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "template_id": "550e8400-e29b-41d4-a716-446655440000",
+                "participant_id": "550e8400-e29b-41d4-a716-446655440001",
+                "event_name": "Annual Science Conference 2024",
+                "event_location": "Sirius Federal Territory",
+                "issue_date": "2024-11-28",
+                "format": "pdf"
+            }
+        }
+
+
 class PreviewResponse(BaseModel):
     """Certificate preview response."""
     html_content: str = Field(..., description="Rendered HTML preview")
@@ -109,6 +150,7 @@ __all__ = [
     'CertificateGenerateRequest',
     'CertificateResponse',
     'CertificateGenerateResponse',
+    'CertificatePreviewRequest',
     'PreviewResponse',
     'CertificateMetadata',
     'GenerateRequest',
@@ -0,0 +1,210 @@
+import logging
+import math
+import threading
+import uuid
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+from app.services.render_pool import is_interactive_batch, render_load
+from app.utils import metrics
+from app.utils.exceptions import OverloadedError
+from app.utils.rate_limiter import get_sync_redis
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+TICKETS_KEY = "admission:tickets"
+RATE_KEY = "admission:render_rate"
+# A ticket outlives a crashed process by at most this long (queue wait plus the
+# generation time limit), so leaked backlog clears itself
+TICKET_TTL = 2 * 60 * 60
+# Redis priority lists of a queue are named <queue>, <queue>:1 ... <queue>:9
+PRIORITY_STEPS = range(10)
+
+_rejected = metrics.counter("admission_rejected_total", "Generation requests rejected by admission control")
+_backlog = metrics.gauge("admission_backlog_certificates", "Certificates admitted and not yet finished")
+
+# Members are "<ticket id>:<certificates>"; expired tickets are dropped first.
+# Returns {admitted (0/1), backlog after the decision}.
+_ADMIT_LUA = """
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local backlog = 0
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    backlog = backlog + tonumber(string.match(member, ':(%d+)$'))
+end
+local size = tonumber(ARGV[1])
+if ARGV[4] ~= '1' and backlog > 0 and backlog + size > tonumber(ARGV[2]) then
+    return {0, backlog}
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[5])
+return {1, backlog + size}
+"""
+
+_broker_client = None
+_broker_lock = threading.Lock()
+
+
+def _get_broker_redis():
+    """Client for the Celery broker database (queue lengths)."""
+    global _broker_client
+    if _broker_client is None:
+        with _broker_lock:
+            if _broker_client is None:
+                import redis
+                _broker_client = redis.Redis.from_url(settings.CELERY_BROKER_URL, decode_responses=True)
+    return _broker_client
+
+
+def render_queue_depth() -> int:
+    """Generation tasks waiting in the render queue, over all priorities."""
+    queue = settings.CELERY_RENDER_QUEUE
+    pipe = _get_broker_redis().pipeline()
+    for step in PRIORITY_STEPS:
+        pipe.llen(queue if step == 0 else f"{queue}:{step}")
+    return sum(pipe.execute())
+
+
+def render_rate() -> float:
+    """Recent certificates/s of finished batches (ADMISSION_DEFAULT_RATE until measured)."""
+    value = get_sync_redis().get(RATE_KEY)
+    return float(value) if value else settings.ADMISSION_DEFAULT_RATE
+
+
+def backlog() -> int:
+    """Certificates in live admission tickets."""
+    client = get_sync_redis()
+    now = client.time()[0]
+    members = client.zrangebyscore(TICKETS_KEY, now, '+inf')
+    return sum(int(member.rsplit(':', 1)[1]) for member in members)
+
+
+def _retry_after(certificates: float, rate: float) -> int:
+    """Seconds until `certificates` more have been rendered, between 1s and an hour."""
+    return int(min(3600, max(1, math.ceil(certificates / max(rate, 0.1)))))
+
+
+def capacity() -> Dict[str, Any]:
+    """
+    Current generation capacity, as used by admit().
+
+    Returns:
+        Dict with backlog, limits, queue depth, this process's render load,
+        measured throughput and the estimated wait for new work
+    """
+    load = render_load()
+    current = backlog()
+    rate = render_rate()
+    _backlog.set(current)
+    return {
+        'enabled': settings.ADMISSION_ENABLED,
+        'backlog_certificates': current,
+        'max_backlog_certificates': settings.ADMISSION_MAX_BACKLOG,
+        'available_certificates': max(0, settings.ADMISSION_MAX_BACKLOG - current),
+        'queued_batches': render_queue_depth(),
+        'max_queued_batches': settings.ADMISSION_MAX_QUEUED_BATCHES,
+        'active_batches': load['active_batches'],
+        'max_active_batches': settings.ADMISSION_MAX_ACTIVE_BATCHES,
+        'renders_in_flight': load['in_flight'],
+        'render_processes': load['pool_size'],
+        'certificates_per_second': round(rate, 2),
+        'estimated_wait_seconds': _retry_after(current, rate) if current else 0,
+    }
+
+
+def admit(size: int, background: bool = False) -> Dict[str, Any]:
+    """
+    Reserve capacity for a batch of `size` certificates.
+
+    Interactive batches (RENDER_INTERACTIVE_MAX) are always admitted. Larger
+    ones are refused while ADMISSION_MAX_ACTIVE_BATCHES are generating in this
+    process (synchronous requests), while ADMISSION_MAX_QUEUED_BATCHES wait in
+    the render queue (background requests), or when they would take the
+    shared backlog over ADMISSION_MAX_BACKLOG. A batch larger than the limit
+    is still admitted once the backlog is empty. If Redis cannot be reached
+    the batch is admitted.
+
+    Args:
+        size: Certificates in the batch
+        background: The batch goes to the render queue rather than this process
+
+    Returns:
+        Ticket to hand to release() when the batch is finished
+
+    Raises:
+        OverloadedError: with the estimated seconds until there is room
+    """
+    ticket = {'id': None, 'size': size}
+    if not settings.ADMISSION_ENABLED:
+        return ticket
+
+    interactive = is_interactive_batch(size)
+    try:
+        rate = render_rate()
+        if not interactive:
+            if background:
+                depth = render_queue_depth()
+                if depth >= settings.ADMISSION_MAX_QUEUED_BATCHES:
+                    _rejected.inc(reason='queue')
+                    raise OverloadedError(
+                        f"{depth} batches are already waiting to be generated",
+                        _retry_after(backlog(), rate),
+                    )
+            else:
+                active = render_load()['active_batches']
+                if active >= settings.ADMISSION_MAX_ACTIVE_BATCHES:
+                    _rejected.inc(reason='active')
+                    raise OverloadedError(
+                        f"{active} batches are already being generated",
+                        _retry_after(backlog() / active, rate),
+                    )
+
+        ticket_id = uuid.uuid4().hex
+        client = get_sync_redis()
+        admitted, current = client.eval(
+            _ADMIT_LUA, 1, TICKETS_KEY,
+            size, settings.ADMISSION_MAX_BACKLOG, TICKET_TTL, '1' if interactive else '0', f"{ticket_id}:{size}",
+        )
+        _backlog.set(current)
+        if not admitted:
+            _rejected.inc(reason='backlog')
+            excess = current + size - settings.ADMISSION_MAX_BACKLOG
+            raise OverloadedError(
+                f"{current} certificates are already waiting to be generated",
+                _retry_after(excess, rate),
+            )
+    except OverloadedError as e:
+        logger.warning(f"🚦 Rejected batch of {size}: {e} (retry after {e.retry_after}s)")
+        raise
+    except Exception as e:
+        logger.error(f"❌ Admission control unavailable, admitting batch of {size}: {e}")
+        return ticket
+
+    ticket['id'] = ticket_id
+    logger.info(f"🚦 Admitted batch of {size} certificates (backlog {current})")
+    return ticket
+
+
+def release(ticket: Optional[Dict[str, Any]], rendered: int = 0, elapsed: float = 0.0):
+    """
+    Return a batch's capacity and feed its throughput into the Retry-After estimate.
+
+    Args:
+        ticket: Ticket from admit()
+        rendered: Certificates the batch produced
+        elapsed: Seconds the batch took to render
+    """
+    if not ticket or not ticket.get('id'):
+        return
+    try:
+        client = get_sync_redis()
+        client.zrem(TICKETS_KEY, f"{ticket['id']}:{ticket['size']}")
+        if rendered and elapsed > 0:
+            # Exponential moving average over recent batches
+            rate = rendered / elapsed
+            previous = client.get(RATE_KEY)
+            if previous:
+                rate = 0.7 * float(previous) + 0.3 * rate
+            client.set(RATE_KEY, rate)
+    except Exception as e:
+        logger.error(f"❌ Failed to release admission ticket {ticket['id']}: {e}")
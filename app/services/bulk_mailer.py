@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.config import get_settings
+from app.services.email_service import (
+    CERTIFICATE_EMAIL_BODY,
+    CERTIFICATE_EMAIL_SUBJECT,
+    EmailService,
+    build_certificate_message,
+)
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# (recipient email, MinIO object key, attachment filename, sha256 of the object or None)
+EmailJob = Tuple[str, str, str, Optional[str]]
+
+
+def recipient_domain(email: str) -> str:
+    return email.rsplit('@', 1)[-1].strip().lower()
+
+
+class BulkMailer:
+    """
+    Sends many certificate emails from one event loop.
+
+    `concurrency` coroutines each own one aiosmtplib session, reused for up
+    to SMTP_MAX_SENDS_PER_CONNECTION messages, so a single process keeps
+    dozens of SMTP conversations in flight while mostly waiting on the
+    network. Sends to one recipient domain are capped at `per_domain` at a
+    time, since large providers throttle or defer clients that open many
+    parallel connections. The shared Redis token bucket still applies.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        per_domain: Optional[int] = None,
+        max_sends: Optional[int] = None,
+        rate_limited: bool = True,
+        email_service: Optional[EmailService] = None,
+    ):
+        self.concurrency = concurrency or settings.EMAIL_BULK_CONCURRENCY
+        self.per_domain = per_domain or settings.EMAIL_BULK_PER_DOMAIN
+        self.max_sends = max_sends or settings.SMTP_MAX_SENDS_PER_CONNECTION
+        self.rate_limited = rate_limited
+        self.email_service = email_service or EmailService()
+        self._domain_slots: Dict[str, asyncio.Semaphore] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._sent: List[EmailJob] = []
+        self._failed: List[EmailJob] = []
+        self._started = 0.0
+
+    async def _connect(self):
+        import aiosmtplib
+
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            start_tls=settings.SMTP_USE_TLS,
+            timeout=30,
+        )
+        await smtp.connect()
+        try:
+            if settings.SMTP_USER and settings.SMTP_PASSWORD:
+                await smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    @staticmethod
+    async def _close(smtp):
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _domain_slot(self, email: str) -> asyncio.Semaphore:
+        domain = recipient_domain(email)
+        if domain not in self._domain_slots:
+            self._domain_slots[domain] = asyncio.Semaphore(self.per_domain)
+        return self._domain_slots[domain]
+
+    async def _worker(self):
+        import aiosmtplib
+
+        sent, failed = self._sent, self._failed
+        smtp = None
+        sends = 0
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                job, file_data = item
+                email, key, filename, sha256 = job
+
+                if file_data is None:
+                    file_data = await asyncio.to_thread(self.email_service.fetch_certificate, key, sha256)
+                if not file_data:
+                    logger.error(f"Cannot send email to {email}: file not found in MinIO: {key}")
+                    failed.append(job)
+                    continue
+                # The attachment wraps the caller's buffer as is; no copy is made here
+                msg = build_certificate_message(
+                    email, CERTIFICATE_EMAIL_SUBJECT, CERTIFICATE_EMAIL_BODY, file_data, filename
+                )
+
+                async with self._domain_slot(email):
+                    if self.rate_limited:
+                        from app.utils.rate_limiter import email_rate_limiter
+                        try:
+                            granted = await email_rate_limiter().acquire_async(timeout=settings.EMAIL_RATE_LIMIT_TIMEOUT)
+                        except Exception as e:
+                            logger.error(f"Email rate limiter unavailable: {e}")
+                            granted = False
+                        if not granted:
+                            logger.warning(f"Email rate limit: no token within {settings.EMAIL_RATE_LIMIT_TIMEOUT}s for {email}")
+                            failed.append(job)
+                            continue
+
+                    for attempt in range(2):
+                        reused = smtp is not None
+                        try:
+                            if smtp is None:
+                                smtp = await self._connect()
+                                sends = 0
+                            await smtp.send_message(msg)
+                        except Exception as e:
+                            if smtp is not None:
+                                await self._close(smtp)
+                                smtp = None
+                            # A reused session may have been dropped while idle
+                            if attempt == 0 and reused and isinstance(e, aiosmtplib.SMTPServerDisconnected):
+                                continue
+                            logger.error(f"Failed to send email to {email}: {e}")
+                            failed.append(job)
+                            break
+
+                        sent.append(job)
+                        sends += 1
+                        if sends >= self.max_sends:
+                            await self._close(smtp)
+                            smtp = None
+                        break
+        finally:
+            if smtp is not None:
+                await self._close(smtp)
+
+    def start(self, workers: Optional[int] = None):
+        """
+        Start the sending coroutines; feed them with submit() and end with finish().
+
+        The queue holds at most two messages per session, so a producer that
+        renders faster than mail goes out is slowed down instead of piling
+        up attachments in memory.
+        """
+        workers = workers or self.concurrency
+        self._queue = asyncio.Queue(maxsize=workers * 2)
+        self._sent, self._failed = [], []
+        self._started = time.perf_counter()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def submit(
+        self,
+        email: str,
+        key: str,
+        filename: str,
+        file_data: Optional[bytes] = None,
+        sha256: Optional[str] = None,
+    ):
+        """
+        Queue one email.
+
+        Args:
+            email: Recipient
+            key: MinIO object key of the certificate
+            filename: Attachment filename
+            file_data: Certificate bytes already in memory; fetched from MinIO by key if None
+            sha256: Expected hash of the fetched object
+        """
+        await self._queue.put(((email, key, filename, sha256), file_data))
+
+    async def finish(self) -> Dict[str, Any]:
+        """
+        Wait for every submitted email.
+
+        Returns:
+            Dict with sent and failed counts, the failed jobs and elapsed seconds
+        """
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers)
+        elapsed = time.perf_counter() - self._started
+
+        logger.info(
+            f"📧 Bulk send: {len(self._sent)} sent, {len(self._failed)} failed in {elapsed:.2f}s "
+            f"({len(self._workers)} sessions, {len(self._domain_slots)} domains)"
+        )
+        self._workers = []
+        return {
+            'sent': len(self._sent),
+            'failed': len(self._failed),
+            'failed_jobs': self._failed,
+            'elapsed': elapsed,
+        }
+
+    def cancel(self):
+        """Stop the sending coroutines without waiting for queued emails."""
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    async def send_all(self, jobs: Sequence[EmailJob]) -> Dict[str, Any]:
+        """
+        Send one certificate email per job, fetching each certificate from MinIO.
+
+        Args:
+            jobs: (recipient email, MinIO object key, attachment filename[, sha256]) tuples
+
+        Returns:
+            Dict with sent and failed counts, the failed jobs and elapsed seconds
+        """
+        self.start(max(1, min(self.concurrency, len(jobs))))
+        for job in jobs:
+            email, key, filename = job[:3]
+            await self.submit(email, key, filename, sha256=job[3] if len(job) > 3 else None)
+        return await self.finish()
+
+
+async def send_batch(batch_id: str, **mailer_options) -> Dict[str, Any]:
+    """Email every certificate of a batch through a BulkMailer."""
+    from app.services.certificate_service import CertificateService
+
+    jobs = await CertificateService().batch_email_jobs(batch_id)
+    return await BulkMailer(**mailer_options).send_all(jobs)
+
+
+def main():
+    """Standalone mailer: python -m app.services.bulk_mailer BATCH_ID [...]"""
+    parser = argparse.ArgumentParser(description="Email the certificates of generated batches")
+    parser.add_argument('batch_ids', nargs='+')
+    parser.add_argument('--concurrency', type=int, default=None)
+    parser.add_argument('--per-domain', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    async def _run():
+        from app.storage.redis_storage import redis_session
+
+        failed = 0
+        async with redis_session():
+            for batch_id in args.batch_ids:
+                result = await send_batch(batch_id, concurrency=args.concurrency, per_domain=args.per_domain)
+                failed += result['failed']
+        return failed
+
+    if asyncio.run(_run()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
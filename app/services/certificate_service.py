@@ -1,21 +1,26 @@
+import asyncio
+import contextlib
+import hashlib
+import json
 import os
+import threading
+import time
 import uuid
-from typing import Optional, List
+from collections import deque
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime, timedelta
 import logging
-import zipfile
 import io
 
-from minio import Minio
-from minio.error import S3Error
-import redis.asyncio as aioredis
-
+from app.config import get_settings
 from app.schemas.certificate import CertificateGenerateRequest, CertificateResponse
 from app.storage.redis_storage import RedisStorage
-from app.utils.exceptions import NotFoundError, PDFGenerationError
-from app.utils.pdf_generator import generate_pdf_from_html
+from app.storage.template_store import get_template_store, is_template_key
+from app.utils.exceptions import NotFoundError, PDFGenerationError, StorageError, ValidationError
+from app.utils.template_compiler import preflight_render
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 # MinIO configuration
 MINIO_URL = os.getenv('MINIO_URL', 'http://minio:9000')
@@ -26,22 +31,86 @@ MINIO_BUCKET = os.getenv('MINIO_BUCKET', 'certificates')
 # Redis key for storing current batch ID
 REDIS_BATCH_KEY = "certificate:current_batch_id"
 
+# Prebuilt batch archives live outside the batch prefix so they never end up inside themselves
+ARCHIVE_PREFIX = "archives"
+
+
+# Batch manifests (participant -> object key, size, hash), mirrored from Redis for durability
+MANIFEST_PREFIX = "manifests"
+
+
+def archive_key(batch_id: str) -> str:
+    """MinIO object key of the prebuilt ZIP for a batch."""
+    return f"{ARCHIVE_PREFIX}/{batch_id}.zip"
+
+
+def manifest_key(batch_id: str) -> str:
+    """MinIO object key of the manifest for a batch."""
+    return f"{MANIFEST_PREFIX}/{batch_id}.json"
+
+
+# Template variant selectors in GenerateRequest.template_variants
+VARIANT_SELECTOR_PREFIXES = ('place:', 'role:')
+
+
+def select_variant(participant: Dict[str, Any], default_template_id: str, variants: Dict[str, str]) -> str:
+    """
+    Template for a participant: a place match wins over a role match, then the default.
+    
+    Args:
+        participant: Participant record
+        default_template_id: Template for participants no selector matches
+        variants: {"place:1": template_id, "role:speaker": template_id, ...}
+    """
+    place = participant.get('place')
+    try:
+        # Places parsed from spreadsheets may arrive as "1" or 1.0
+        place = int(float(place))
+    except (TypeError, ValueError):
+        place = None
+    if place is not None and f"place:{place}" in variants:
+        return variants[f"place:{place}"]
+    role = participant.get('role')
+    if role and f"role:{role}" in variants:
+        return variants[f"role:{role}"]
+    return default_template_id
+
+
+def participant_variables(participant: Dict[str, Any], event_name: str, event_location: str, issue_date: str) -> Dict[str, Any]:
+    """Template context for one participant's certificate."""
+    return {
+        'participant_name': participant.get('full_name', 'Unknown'),
+        'email': participant.get('email', ''),
+        'role': participant.get('role', 'participant'),
+        'place': participant.get('place'),
+        'event_name': event_name,
+        'event_location': event_location,
+        'issue_date': issue_date,
+    }
+
 
 class CertificateService:
     """Service for certificate generation with MinIO storage."""
 
     def __init__(self):
+        # minio (and urllib3) load on first service use, not when the API module is imported
+        from minio import Minio
+        from app.storage.minio_storage import make_http_client
+
         self.storage = RedisStorage()
         self.minio_client = Minio(
             MINIO_URL.replace('http://', '').replace('https://', ''),
             access_key=MINIO_ACCESS_KEY,
             secret_key=MINIO_SECRET_KEY,
-            secure=False
+            secure=False,
+            http_client=make_http_client()
         )
         self._ensure_bucket()
 
     def _ensure_bucket(self):
         """Create bucket if it doesn't exist."""
+        from minio.error import S3Error
+
         try:
             if not self.minio_client.bucket_exists(MINIO_BUCKET):
                 self.minio_client.make_bucket(MINIO_BUCKET)
@@ -57,7 +126,7 @@ class CertificateService:
     async def _store_batch_id(self, batch_id: str):
         """Store batch ID in Redis."""
         redis = await self._get_redis()
-        await redis.set(REDIS_BATCH_KEY, batch_id, ex=3600)  # Expires in 1 hour
+        await redis.set(REDIS_BATCH_KEY, batch_id, ex=settings.SESSION_EXPIRATION)
         logger.info(f"✅ Stored batch ID in Redis: {batch_id}")
 
     async def _get_batch_id(self) -> Optional[str]:
@@ -162,73 +231,102 @@ class CertificateService:
             logger.exception(f"Error while searching for template {template_id}: {e}")
             return None
 
-    async def generate_certificates(self, template_id: str, event_name: str, event_location: str, issue_date: str) -> dict:
+    async def _load_template(self, template_id: str) -> Dict[str, Any]:
+        """
+        Find a template and read its body from the local cache.
+        
+        Returns:
+            Template metadata with the body added under 'content'
+        """
+        # ✅ Step 2: Get template by ID (with intelligent fallback)
+        template = await self._find_template(template_id)
+        logger.info(f"🔍 Template lookup result: {template}")
+        
+        if not template:
+            all_templates = await self.storage.get_all_templates()
+            template_ids = [t.get('id') for t in all_templates] if all_templates else []
+            logger.error(f"❌ Template not found in storage: {template_id}")
+            logger.error(f"   Available template IDs: {template_ids}")
+            raise NotFoundError(f"Template '{template_id}' not found. Available: {template_ids[:3]}...")
+        
+        # ✅ Step 3: Load template content from file
+        template_path = template.get('content_path')
+        logger.info(f"📁 Template path: {template_path}")
+        
+        if not template_path:
+            logger.error(f"❌ Template has no content_path: {template}")
+            raise NotFoundError(f"Template has no content_path")
+
+        # Templates in MinIO (blob keys or 'templates/{id}/...') render from the local cache
+        if is_template_key(template_path):
+            try:
+                template_path = await asyncio.to_thread(get_template_store().fetch_template, template)
+                logger.info(f"✅ Template cached locally: {template_path}")
+            except NotFoundError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Failed to read template from MinIO {template.get('content_path')}: {e}")
+                raise NotFoundError(f"Template file not found in MinIO: {template.get('content_path')}")
+
+        if not os.path.exists(template_path):
+            logger.error(f"❌ Template file not found at: {template_path}")
+            logger.error(f"   Current working directory: {os.getcwd()}")
+            logger.error(f"   Directory exists: {os.path.exists(os.path.dirname(template_path))}")
+            raise NotFoundError(f"Template file not found: {template_path}")
+
+        with open(template_path, 'r', encoding='utf-8') as f:
+            template_content = f.read()
+        
+        logger.info(f"✅ Loaded template: {template.get('id')} ({len(template_content)} bytes)")
+        return {**template, 'content': template_content}
+
+    async def generate_certificates(
+        self,
+        template_id: str,
+        event_name: str,
+        event_location: str,
+        issue_date: str,
+        build_archive: Optional[bool] = None,
+        template_variants: Optional[Dict[str, str]] = None,
+        fused_email: bool = False,
+    ) -> dict:
         """
         Generate certificates for all participants using template.
         
         Stores PDFs in MinIO bucket, organized by batch ID.
         Batch ID is stored in Redis for access across requests.
         
+        Participants are grouped by template variant; every group renders
+        through the shared render pool in one pass over the participants.
+        
         Args:
             template_id: Template ID to use (UUID or timestamp)
             event_name: Name of event
             event_location: Location of event
             issue_date: Date to issue certificates
+            build_archive: Also write the batch ZIP to MinIO as certificates are
+                produced (defaults to BUILD_ARCHIVE)
+            template_variants: Optional {"place:1": template_id, "role:speaker": template_id, ...};
+                participants matching no selector get `template_id`
+            fused_email: Email each certificate straight from the rendered bytes while
+                the MinIO upload runs alongside, instead of the workers downloading it
+                again later; emails that fail are queued as usual
             
         Returns:
             Dict with generation result
         """
+        archive = None
+        mailer = None
+        mail_feeder = None
+        stack = contextlib.ExitStack()
         try:
             logger.info(f"📋 Starting certificate generation with template: {template_id}")
+            template_variants = template_variants or {}
+            for selector in template_variants:
+                if not selector.startswith(VARIANT_SELECTOR_PREFIXES):
+                    raise ValidationError(f"Unknown template variant selector '{selector}', expected role:<role> or place:<n>")
             
-            # ✅ Step 1: Get all available templates (for debugging)
-            all_templates = await self.storage.get_all_templates()
-            logger.info(f"📚 Available templates in storage: {len(all_templates)} total")
-            
-            # ✅ Step 2: Get template by ID (with intelligent fallback)
-            template = await self._find_template(template_id)
-            logger.info(f"🔍 Template lookup result: {template}")
-            
-            if not template:
-                template_ids = [t.get('id') for t in all_templates] if all_templates else []
-                logger.error(f"❌ Template not found in storage: {template_id}")
-                logger.error(f"   Available template IDs: {template_ids}")
-                raise NotFoundError(f"Template '{template_id}' not found. Available: {template_ids[:3]}...")
-            
-            # ✅ Step 3: Load template content from file
-            template_path = template.get('content_path')
-            logger.info(f"📁 Template path: {template_path}")
-            
-            if not template_path:
-                logger.error(f"❌ Template has no content_path: {template}")
-                raise NotFoundError(f"Template has no content_path")
-            
-            template_content = None
-
-            # If template is stored in MinIO (key like 'templates/{id}/template.html'), fetch it
-            if isinstance(template_path, str) and template_path.startswith('templates/'):
-                try:
-                    logger.info(f"Fetching template from MinIO: {template_path}")
-                    response = self.minio_client.get_object(MINIO_BUCKET, template_path)
-                    template_content = response.read().decode('utf-8')
-                    logger.info(f"✅ Loaded template from MinIO: {template.get('id')} ({len(template_content)} bytes)")
-                except Exception as e:
-                    logger.error(f"❌ Failed to read template from MinIO {template_path}: {e}")
-                    raise NotFoundError(f"Template file not found in MinIO: {template_path}")
-            else:
-                # Local filesystem path
-                if not os.path.exists(template_path):
-                    logger.error(f"❌ Template file not found at: {template_path}")
-                    logger.error(f"   Current working directory: {os.getcwd()}")
-                    logger.error(f"   Directory exists: {os.path.exists(os.path.dirname(template_path))}")
-                    raise NotFoundError(f"Template file not found: {template_path}")
-
-                with open(template_path, 'r', encoding='utf-8') as f:
-                    template_content = f.read()
-            
-            logger.info(f"✅ Loaded template: {template.get('id')} ({len(template_content)} bytes)")
-            
-            # ✅ Step 4: Get all participants
+            # ✅ Step 4: Get all participants (one scan for every variant)
             participants = await self.storage.get_all_participants()
             logger.info(f"👥 Found {len(participants)} participants")
             
@@ -240,58 +338,258 @@ class CertificateService:
                     "count": 0,
                     "errors": []
                 }
+
+            groups: Dict[str, List[Dict[str, Any]]] = {}
+            for participant in participants:
+                groups.setdefault(select_variant(participant, template_id, template_variants), []).append(participant)
+            logger.info(f"🧩 Variant groups: { {tid: len(group) for tid, group in groups.items()} }")
+            
+            # ✅ Step 4.1: Load each variant once and preflight it with one strict render,
+            # so a bad template fails before the batch. The preflight runs in the
+            # render pool, under its PDF_TIMEOUT, so a runaway template cannot hang this process.
+            from app.services.render_pool import get_render_pool, render_share, render_tuner, upload_tuner
+
+            loop = asyncio.get_running_loop()
+            templates: Dict[str, Dict[str, Any]] = {}
+            for variant_id, group in groups.items():
+                variant = await self._load_template(variant_id)
+                sample_variables = participant_variables(group[0], event_name, event_location, issue_date)
+                try:
+                    await loop.run_in_executor(
+                        get_render_pool(), preflight_render, variant['content'], sample_variables
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Template preflight failed for {variant_id}: {e}")
+                    raise ValidationError(f"Template '{variant_id}' cannot be rendered: {e}")
+                templates[variant_id] = variant
             
             # ✅ Step 5: Create unique batch ID for this generation
             batch_id = str(uuid.uuid4())[:8]
             logger.info(f"🎯 Created batch ID: {batch_id}")
             
-            # ✅ Step 6: Generate PDFs and upload to MinIO
+            # ✅ Step 6: Render all groups through the shared pool, upload to MinIO as they finish
             uploaded_count = 0
             errors = []
-            
-            for participant in participants:
+            # Participants whose render failed, timed out or killed its process
+            failed: List[Dict[str, Any]] = []
+            manifest: Dict[str, Dict[str, Any]] = {}
+
+            if build_archive is None:
+                build_archive = settings.BUILD_ARCHIVE
+            from app.storage.minio_storage import StreamingZipUpload
+            from app.utils.pdf_generator import generate_pdf_from_html
+
+            if build_archive:
+                archive = StreamingZipUpload(self.minio_client, MINIO_BUCKET, archive_key(batch_id))
+
+            archive_lock = threading.Lock()
+
+            def _object_name(participant: Dict[str, Any]) -> str:
+                safe_name = participant.get('full_name', 'certificate').replace(' ', '_')
+                return f"{batch_id}/{safe_name}_{participant['id'][:8]}.pdf"
+
+            def _store(participant: Dict[str, Any], variant_id: str, pdf_content: bytes):
+                nonlocal archive
+                object_name = _object_name(participant)
+                
+                # Upload to MinIO
+                self.minio_client.put_object(
+                    MINIO_BUCKET,
+                    object_name,
+                    io.BytesIO(pdf_content),
+                    length=len(pdf_content),
+                    content_type='application/pdf'
+                )
+                manifest[participant['id']] = {
+                    'key': object_name,
+                    'size': len(pdf_content),
+                    'sha256': hashlib.sha256(pdf_content).hexdigest(),
+                    'name': participant.get('full_name'),
+                    'email': participant.get('email', ''),
+                    'template_id': variant_id,
+                }
+                logger.info(f"✅ Uploaded certificate to MinIO: {object_name}")
+
+                # Fused mode stores from several threads; the ZIP is written sequentially
+                with archive_lock:
+                    if archive is not None:
+                        try:
+                            archive.add(object_name.split('/')[-1], pdf_content)
+                        except Exception as e:
+                            # The batch itself is fine; the ZIP gets built on first download instead
+                            logger.warning(f"⚠️  Archive stage failed, continuing without it: {e}")
+                            archive.abort()
+                            archive = None
+
+            pool = get_render_pool()
+            jobs = (
+                (participant, variant_id)
+                for variant_id, group in groups.items()
+                for participant in group
+            )
+            # Bounded windows: enough renders queued to keep every process busy
+            # and enough uploads to hide MinIO latency, without holding a whole
+            # large batch of PDFs in memory. Both are sized by AIMD tuners from
+            # the latencies recorded below; concurrent batches split the render
+            # window fairly (see RenderShare). The render window is pool-wide, so
+            # renders are reported with the pool's in-flight count, not this
+            # batch's share of it
+            renders = render_tuner()
+            uploads = upload_tuner()
+            share = stack.enter_context(render_share(batch_id, len(participants)))
+            in_flight: Dict[asyncio.Future, tuple] = {}
+            # Uploads run alongside rendering (and the mail stage in fused mode)
+            storing: Dict[asyncio.Future, Dict[str, Any]] = {}
+
+            def _timed_store(participant: Dict[str, Any], variant_id: str, pdf_content: bytes):
+                started = time.perf_counter()
                 try:
-                    # Prepare variables for template rendering
-                    variables = {
-                        'participant_name': participant.get('full_name', 'Unknown'),
-                        'email': participant.get('email', ''),
-                        'role': participant.get('role', 'participant'),
-                        'place': participant.get('place'),
-                        'event_name': event_name,
-                        'event_location': event_location,
-                        'issue_date': issue_date,
-                    }
-                    
-                    # Generate PDF in memory
-                    pdf_content = generate_pdf_from_html(template_content, variables)
-                    
-                    # Create object name in MinIO
-                    safe_name = participant.get('full_name', 'certificate').replace(' ', '_')
-                    object_name = f"{batch_id}/{safe_name}_{participant['id'][:8]}.pdf"
-                    
-                    # Upload to MinIO
-                    self.minio_client.put_object(
-                        MINIO_BUCKET,
-                        object_name,
-                        io.BytesIO(pdf_content),
-                        length=len(pdf_content),
-                        content_type='application/pdf'
+                    _store(participant, variant_id, pdf_content)
+                except Exception:
+                    uploads.record(time.perf_counter() - started, error=True, in_use=len(storing))
+                    raise
+                uploads.record(time.perf_counter() - started, in_use=len(storing))
+
+            # Fused mode: rendered certificates wait here for the mail stage, which
+            # a separate task feeds to the mailer, so a slow SMTP server never holds
+            # up rendering. Past EMAIL_FUSED_BUFFER waiting jobs, a job drops its
+            # PDF and the mailer fetches it back from MinIO once it is stored
+            mail_jobs: deque = deque()
+            mail_waiting = asyncio.Event()
+            buffered_mail = 0
+            rendering_done = False
+
+            async def _feed_mailer():
+                nonlocal buffered_mail
+                while mail_jobs or not rendering_done:
+                    if not mail_jobs:
+                        mail_waiting.clear()
+                        await mail_waiting.wait()
+                        continue
+                    participant, object_name, upload, pdf_content = mail_jobs.popleft()
+                    sha256 = None
+                    if pdf_content is not None:
+                        buffered_mail -= 1
+                    else:
+                        await asyncio.wait([upload])
+                        if upload.exception() is not None:
+                            # Nothing stored to send; the upload error is already recorded
+                            continue
+                        sha256 = manifest[participant['id']]['sha256']
+                    await mailer.submit(
+                        participant['email'], object_name, object_name.rsplit('/', 1)[-1], pdf_content, sha256
                     )
-                    
+
+            if fused_email:
+                from app.services.bulk_mailer import BulkMailer
+                mailer = BulkMailer()
+                mailer.start()
+                mail_feeder = asyncio.ensure_future(_feed_mailer())
+
+            def _stored(task: asyncio.Future):
+                nonlocal uploaded_count
+                participant = storing.pop(task)
+                try:
+                    task.result()
                     uploaded_count += 1
-                    logger.info(f"✅ Uploaded certificate to MinIO: {object_name}")
-                    
                 except Exception as e:
-                    logger.error(f"❌ Error generating certificate for {participant.get('full_name')}: {e}")
+                    logger.error(f"❌ Error storing certificate for {participant.get('full_name')}: {e}")
                     errors.append(f"{participant.get('full_name')}: {str(e)}")
-                    continue
+            
+            while True:
+                for participant, variant_id in (jobs if len(in_flight) < share.limit(len(in_flight)) else ()):
+                    variant = templates[variant_id]
+                    variables = participant_variables(participant, event_name, event_location, issue_date)
+                    future = loop.run_in_executor(
+                        pool, generate_pdf_from_html, variant['content'], variables, variant.get('compiled_path')
+                    )
+                    in_flight[future] = (participant, variant_id, time.perf_counter())
+                    if len(in_flight) >= share.limit(len(in_flight)):
+                        break
+                if not in_flight:
+                    break
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    participant, variant_id, submitted = in_flight.pop(future)
+                    try:
+                        pdf_content = future.result()
+                        renders.record(time.perf_counter() - submitted, in_use=pool.in_flight + 1)
+                    except Exception as e:
+                        renders.record(time.perf_counter() - submitted, error=True, in_use=pool.in_flight + 1)
+                        logger.error(f"❌ Error generating certificate for {participant.get('full_name')}: {e}")
+                        errors.append(f"{participant.get('full_name')}: {str(e)}")
+                        failed.append({
+                            'participant_id': participant.get('id'),
+                            'name': participant.get('full_name'),
+                            'error': f"{type(e).__name__}: {e}",
+                        })
+                        continue
+                    # The same buffer goes to the upload and, in fused mode, to the mail stage
+                    task = asyncio.ensure_future(asyncio.to_thread(_timed_store, participant, variant_id, pdf_content))
+                    storing[task] = participant
+                    task.add_done_callback(_stored)
+                    if mailer is not None and participant.get('email'):
+                        if buffered_mail < settings.EMAIL_FUSED_BUFFER:
+                            buffered_mail += 1
+                            mail_jobs.append((participant, _object_name(participant), task, pdf_content))
+                        else:
+                            mail_jobs.append((participant, _object_name(participant), task, None))
+                        mail_waiting.set()
+                    while len(storing) >= uploads.limit:
+                        await asyncio.wait(list(storing), return_when=asyncio.FIRST_COMPLETED)
+
+            if storing:
+                await asyncio.wait(list(storing))
+            mail_result = None
+            if mailer is not None:
+                rendering_done = True
+                mail_waiting.set()
+                await mail_feeder
+                mail_feeder = None
+                mail_result = await mailer.finish()
+                mailer = None
             
             if uploaded_count == 0:
+                if archive is not None:
+                    archive.abort()
                 logger.error(f"❌ Failed to generate any certificates. Errors: {errors}")
                 raise PDFGenerationError(f"Failed to generate any certificates. Errors: {errors}")
+
+            # ✅ Step 7: Finish the prebuilt archive
+            archive_size = None
+            if archive is not None:
+                try:
+                    archive_size = await asyncio.to_thread(archive.complete)
+                except Exception as e:
+                    logger.warning(f"⚠️  Archive upload failed, it will be built on download: {e}")
             
-            # ✅ Step 7: Store batch ID in Redis
+            # ✅ Step 8: Store batch ID, metadata and manifest
+            await self._save_manifest(batch_id, manifest)
+            await self.storage.index_batch(batch_id, time.time())
             await self._store_batch_id(batch_id)
+
+            emails_queued = None
+            if mail_result is not None:
+                # Hand failed sends to the workers, which fetch the stored copy
+                stored = {entry['key']: entry['sha256'] for entry in manifest.values()}
+                retry_jobs = [
+                    (email, key, filename, stored[key])
+                    for email, key, filename, _ in mail_result['failed_jobs'] if key in stored
+                ]
+                if retry_jobs:
+                    await asyncio.to_thread(self._publish_email_jobs, retry_jobs, batch_id)
+                emails_queued = len(retry_jobs)
+            await self.storage.save_batch(batch_id, {
+                'id': batch_id,
+                'template_id': template_id,
+                'template_variants': template_variants,
+                'count': uploaded_count,
+                'archive_key': archive_key(batch_id) if archive_size is not None else None,
+                'archive_size': archive_size,
+                'failed': failed,
+                'created_at': datetime.utcnow().isoformat(),
+            }, ttl=settings.TEMP_FILES_RETENTION)
             logger.info(f"✅ Successfully generated {uploaded_count} certificates in batch {batch_id}")
             
             return {
@@ -299,79 +597,385 @@ class CertificateService:
                 "count": uploaded_count,
                 "message": f"Generated {uploaded_count} certificates",
                 "batch_id": batch_id,
-                "errors": errors if errors else None
+                "errors": errors if errors else None,
+                "emails_sent": mail_result['sent'] if mail_result else None,
+                "emails_queued": emails_queued,
             }
             
         except Exception as e:
+            if mail_feeder is not None:
+                mail_feeder.cancel()
+            if mailer is not None:
+                mailer.cancel()
+            if archive is not None:
+                archive.abort()
             logger.error(f"❌ Error generating certificates: {e}", exc_info=True)
             raise
+        finally:
+            stack.close()
 
-    async def get_certificates_zip(self) -> bytes:
+    async def get_batch_archive_key(self, batch_id: Optional[str] = None) -> str:
         """
-        Get all generated certificates from current batch as ZIP file.
-        
-        Downloads PDFs from MinIO using batch ID from Redis,
-        creates ZIP in memory, then deletes from MinIO.
+        Resolve the archive object of a batch, building it if it is missing.
         
+        Args:
+            batch_id: Batch to look up; defaults to the current batch from Redis
+            
         Returns:
-            ZIP file content as bytes
+            Object key of the batch ZIP in MinIO
         """
-        try:
-            # ✅ Retrieve batch ID from Redis
+        if not batch_id:
             batch_id = await self._get_batch_id()
-            
             if not batch_id:
-                logger.error("❌ No batch ID found in Redis")
                 raise NotFoundError("No certificates generated in current session")
+
+        batch = await self.storage.get_batch(batch_id)
+        if batch and batch.get('archive_key'):
+            return batch['archive_key']
+
+        object_names = await self.get_batch_object_keys(batch_id)
+        return await asyncio.to_thread(self.ensure_batch_archive, batch_id, object_names)
+
+    async def request_batch_archive(self, batch_id: str) -> Optional[str]:
+        """
+        Resolve the archive object of a batch without building it here.
+        
+        A missing archive is queued for the archive workers (build_batch_archive),
+        at most once per task time limit, so callers that only report
+        links never hold a request open for a whole ZIP build.
+        
+        Args:
+            batch_id: Batch to look up
             
-            logger.info(f"📦 Creating ZIP for batch: {batch_id}")
-            
-            # Create ZIP in memory
-            zip_buffer = io.BytesIO()
-            files_added = 0
-            
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                # List all objects in batch
-                objects = self.minio_client.list_objects(
-                    MINIO_BUCKET,
-                    prefix=f"{batch_id}/",
-                    recursive=True
-                )
-                
-                for obj in objects:
-                    try:
-                        # Download PDF from MinIO
-                        response = self.minio_client.get_object(MINIO_BUCKET, obj.object_name)
-                        pdf_content = response.read()
-                        
-                        # Add to ZIP with just filename (not full path)
-                        filename = obj.object_name.split('/')[-1]
-                        zip_file.writestr(filename, pdf_content)
-                        
-                        files_added += 1
-                        logger.debug(f"✅ Added to ZIP: {filename}")
-                        
-                    except S3Error as e:
-                        logger.error(f"❌ Error downloading {obj.object_name}: {e}")
-                        continue
-            
-            if files_added == 0:
-                logger.error(f"❌ No certificates found in batch {batch_id}")
-                raise NotFoundError("No certificates found in batch")
+        Returns:
+            Object key of the batch ZIP, or None while it is being built
+        """
+        from minio.error import S3Error
+        from app.tasks.celery_app import ARCHIVE_TASK_TIME_LIMIT, build_batch_archive_task
+
+        batch = await self.storage.get_batch(batch_id)
+        if batch and batch.get('archive_key'):
+            return batch['archive_key']
+
+        key = archive_key(batch_id)
+        try:
+            await asyncio.to_thread(self.minio_client.stat_object, MINIO_BUCKET, key)
+            return key
+        except S3Error as e:
+            if e.code not in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+                raise
+
+        if await self.storage.claim_archive_build(batch_id, ARCHIVE_TASK_TIME_LIMIT):
+            task_id = await asyncio.to_thread(lambda: build_batch_archive_task.apply_async(args=(batch_id,)).id)
+            logger.info(f"📋 Queued archive build of batch {batch_id} as task {task_id}")
+        return None
+
+    async def _save_manifest(self, batch_id: str, manifest: Dict[str, Dict[str, Any]]):
+        """Write the batch manifest to Redis (fast lookups) and MinIO (outlives Redis TTLs)."""
+        body = json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        await asyncio.to_thread(
+            self.minio_client.put_object,
+            MINIO_BUCKET,
+            manifest_key(batch_id),
+            io.BytesIO(body),
+            length=len(body),
+            content_type='application/json'
+        )
+        await self.storage.save_batch_manifest(batch_id, manifest, ttl=settings.TEMP_FILES_RETENTION)
+
+    async def admit_generation(self, background: bool = False) -> Dict[str, Any]:
+        """
+        Reserve capacity for generating the current participants.
+        
+        Returns:
+            Admission ticket to pass to release_generation (or enqueue_generation)
             
-            zip_buffer.seek(0)
-            zip_bytes = zip_buffer.getvalue()
-            logger.info(f"✅ ZIP created with {files_added} files: {len(zip_bytes)} bytes")
+        Raises:
+            OverloadedError: no capacity now; carries a retry_after estimate
+        """
+        from app.services import admission
+
+        size = await self.storage.count_participants()
+        return await asyncio.to_thread(admission.admit, size, background)
+
+    async def release_generation(self, ticket: Optional[Dict[str, Any]], rendered: int = 0, elapsed: float = 0.0):
+        """Give back the capacity reserved by admit_generation."""
+        from app.services import admission
+
+        await asyncio.to_thread(admission.release, ticket, rendered, elapsed)
+
+    async def get_capacity(self) -> Dict[str, Any]:
+        """Generation capacity and load (see admission.capacity)."""
+        from app.services import admission
+
+        return await asyncio.to_thread(admission.capacity)
+
+    async def enqueue_generation(
+        self,
+        template_id: str,
+        event_name: str,
+        event_location: str,
+        issue_date: str,
+        build_archive: Optional[bool] = None,
+        template_variants: Optional[Dict[str, str]] = None,
+        send_email: bool = False,
+        admission_ticket: Optional[Dict[str, Any]] = None,
+        fused_email: bool = False,
+    ) -> str:
+        """
+        Queue a batch for generation by a render worker.
+        
+        Smaller batches get a higher Celery priority, so a 50-person batch
+        is picked up before a 30k one queued earlier. The worker releases
+        `admission_ticket` when the batch is done. With `send_email` and
+        `fused_email` the worker emails certificates as they render (see
+        generate_certificates) instead of queuing the emails afterwards.
+        
+        Returns:
+            Celery task id
+        """
+        from app.services.render_pool import batch_priority
+
+        if admission_ticket:
+            size = admission_ticket['size']
+        else:
+            size = await self.storage.count_participants()
+        priority = batch_priority(size)
+
+        def _publish() -> str:
+            from app.tasks.celery_app import generate_certificates_task
+
+            return generate_certificates_task.apply_async(priority=priority, kwargs={
+                'template_id': template_id,
+                'event_name': event_name,
+                'event_location': event_location,
+                'issue_date': issue_date,
+                'build_archive': build_archive,
+                'template_variants': template_variants,
+                'send_email': send_email,
+                'admission_ticket': admission_ticket,
+                'fused_email': fused_email,
+            }).id
+
+        task_id = await asyncio.to_thread(_publish)
+        logger.info(f"📋 Queued generation of template {template_id} ({size} participants, priority {priority}) as task {task_id}")
+        return task_id
+
+    async def get_generation_status(self, task_id: str) -> Dict[str, Any]:
+        """State of a queued generation, with its summary once finished."""
+        def _status() -> Dict[str, Any]:
+            from app.tasks.celery_app import celery_app
+
+            result = celery_app.AsyncResult(task_id)
+            status = {'task_id': task_id, 'state': result.state}
+            if result.successful():
+                status['result'] = result.result
+            elif result.failed():
+                status['error'] = str(result.result)
+            return status
+
+        return await asyncio.to_thread(_status)
+
+    async def batch_email_jobs(self, batch_id: str) -> List[Tuple[str, str, str, Optional[str]]]:
+        """
+        Email claim checks for every certificate of a batch that has an address.
+        
+        Returns:
+            (email, object key, filename, sha256) tuples; workers fetch the PDF by key
+        
+        Raises:
+            NotFoundError: the batch has no manifest
+        """
+        manifest = await self.get_batch_manifest(batch_id)
+        if not manifest:
+            raise NotFoundError(f"No certificates found for batch {batch_id}")
+
+        jobs = [
+            (entry['email'], entry['key'], entry['key'].rsplit('/', 1)[-1], entry.get('sha256'))
+            for entry in manifest.values() if entry.get('email')
+        ]
+        skipped = len(manifest) - len(jobs)
+        if skipped:
+            logger.warning(f"⚠️  {skipped} certificates in batch {batch_id} have no email address")
+        return jobs
+
+    async def queue_certificate_emails(self, batch_id: str) -> int:
+        """
+        Enqueue email tasks for every certificate in a batch.
+        
+        By default one send_certificate_email_from_minio task is published per
+        certificate, in EMAIL_ENQUEUE_CHUNK-sized rounds over a single broker
+        connection. With EMAIL_BULK_ENABLED, one send_certificate_emails_bulk
+        task per EMAIL_BULK_TASK_SIZE certificates is published instead and
+        the async bulk mailer sends them. Sending speed is governed by the
+        shared rate limiter in the workers, not here.
+        
+        Args:
+            batch_id: Batch to email
             
-            # ✅ Cleanup: Delete batch from MinIO after creating ZIP
-            await self._cleanup_batch(batch_id)
+        Returns:
+            Number of emails queued
+        """
+        jobs = await self.batch_email_jobs(batch_id)
+        await asyncio.to_thread(self._publish_email_jobs, jobs, batch_id)
+        return len(jobs)
+
+    def _publish_email_jobs(self, jobs: List[Tuple[str, str, str, Optional[str]]], batch_id: str):
+        """Publish email tasks for (email, object key, filename, sha256) jobs (blocking)."""
+        if not jobs:
+            return
+
+        from app.tasks.celery_app import (
+            celery_app,
+            send_certificate_email_from_minio,
+            send_certificate_emails_bulk,
+        )
+
+        if settings.EMAIL_BULK_ENABLED:
+            size = settings.EMAIL_BULK_TASK_SIZE
+            with celery_app.producer_or_acquire() as producer:
+                for start in range(0, len(jobs), size):
+                    send_certificate_emails_bulk.apply_async(
+                        args=(jobs[start:start + size],), producer=producer
+                    )
+            logger.info(f"📧 Queued {len(jobs)} emails for batch {batch_id} as bulk-send tasks of {size}")
+            return
+
+        chunk_size = settings.EMAIL_ENQUEUE_CHUNK
+        with celery_app.producer_or_acquire() as producer:
+            for start in range(0, len(jobs), chunk_size):
+                chunk = jobs[start:start + chunk_size]
+                for email, key, filename, sha256 in chunk:
+                    send_certificate_email_from_minio.apply_async(
+                        args=(email, key, filename, sha256), producer=producer
+                    )
+                logger.info(f"📧 Queued emails {start + 1}-{start + len(chunk)} of {len(jobs)} for batch {batch_id}")
+
+    async def get_batch_manifest(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Get the manifest of a batch: participant_id -> {key, size, sha256, name, email}.
+        
+        Reads Redis first and falls back to the MinIO copy, re-populating Redis.
+        Returns None for batches generated before manifests existed.
+        """
+        manifest = await self.storage.get_batch_manifest(batch_id)
+        if manifest:
+            return manifest
+
+        def _read_manifest_object():
+            from minio.error import S3Error
+
+            try:
+                response = self.minio_client.get_object(MINIO_BUCKET, manifest_key(batch_id))
+            except S3Error as e:
+                if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+                    return None
+                raise
+            try:
+                return json.loads(response.read())
+            finally:
+                response.close()
+                response.release_conn()
+
+        manifest = await asyncio.to_thread(_read_manifest_object)
+        if manifest:
+            await self.storage.save_batch_manifest(batch_id, manifest, ttl=settings.TEMP_FILES_RETENTION)
+        return manifest
+
+    async def get_participant_certificate(self, batch_id: str, participant_id: str) -> Dict[str, Any]:
+        """Look up one participant's certificate object in the batch manifest."""
+        entry = await self.storage.get_manifest_entry(batch_id, participant_id)
+        if entry is None:
+            manifest = await self.get_batch_manifest(batch_id)
+            entry = manifest.get(participant_id) if manifest else None
+        if entry is None:
+            raise NotFoundError(f"No certificate for participant {participant_id} in batch {batch_id}")
+        return entry
+
+    async def get_batch_object_keys(self, batch_id: str) -> List[str]:
+        """Certificate object keys of a batch, from the manifest when there is one."""
+        manifest = await self.get_batch_manifest(batch_id)
+        if manifest:
+            return sorted(entry['key'] for entry in manifest.values())
+        return await asyncio.to_thread(self.list_batch_objects, batch_id)
+
+    def list_batch_objects(self, batch_id: str) -> List[str]:
+        """List certificate object keys of a batch (slow path for batches without a manifest)."""
+        objects = self.minio_client.list_objects(
+            MINIO_BUCKET,
+            prefix=f"{batch_id}/",
+            recursive=True
+        )
+        return [obj.object_name for obj in objects]
+
+    def ensure_batch_archive(self, batch_id: str, object_names: Optional[List[str]] = None) -> str:
+        """
+        Make sure a ZIP of the batch exists in MinIO and return its object key.
+        
+        The archive is built once and reused, so presigned and X-Accel-Redirect
+        downloads can hand the single object straight to the client. It is
+        only kept if it holds every certificate: a missing or unreadable
+        one aborts the build instead of leaving an incomplete ZIP behind.
+        
+        Args:
+            batch_id: Batch to archive
+            object_names: Certificate keys to include (listed from MinIO if omitted)
             
-            return zip_bytes
+        Returns:
+            Object key of the archive
             
+        Raises:
+            S3Error: if a certificate could not be read
+            StorageError: if the archive would miss certificates
+        """
+        from minio.error import S3Error
+        from app.storage.minio_storage import StreamingZipUpload, fetch_objects
+
+        key = archive_key(batch_id)
+        try:
+            self.minio_client.stat_object(MINIO_BUCKET, key)
+            logger.info(f"📦 Reusing prebuilt archive: {key}")
+            return key
+        except S3Error as e:
+            if e.code not in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+                raise
+
+        if object_names is None:
+            object_names = self.list_batch_objects(batch_id)
+        if not object_names:
+            raise NotFoundError(f"No certificates found in batch {batch_id}")
+
+        # Objects are prefetched in parallel and streamed into a multipart upload
+        archive = StreamingZipUpload(self.minio_client, MINIO_BUCKET, key)
+        try:
+            for object_name, pdf_content in fetch_objects(self.minio_client, MINIO_BUCKET, object_names):
+                archive.add(object_name.split('/')[-1], pdf_content)
+            if archive.count != len(object_names):
+                raise StorageError(
+                    f"Archive of batch {batch_id} has {archive.count} of {len(object_names)} certificates"
+                )
+            size = archive.complete()
         except Exception as e:
-            logger.error(f"❌ Error creating certificates ZIP: {e}", exc_info=True)
+            archive.abort()
+            logger.error(f"❌ Error building archive {key}: {e}")
             raise
 
+        logger.info(f"✅ Built archive {key}: {archive.count} files, {size} bytes")
+        return key
+
+    async def cleanup_certificates(self) -> dict:
+        """
+        Delete every generated batch now, regardless of retention.
+        
+        Returns:
+            Dict with deleted batch/object counts and reclaimed bytes
+        """
+        from app.services.retention_service import RetentionService
+
+        report = await RetentionService(self).expire_batches()
+        await self._clear_batch_id()
+        return report
+
     async def _cleanup_batch(self, batch_id: str):
         """Delete all PDFs in batch from MinIO."""
         try:
@@ -380,20 +984,22 @@ class CertificateService:
             
             logger.info(f"🗑️ Cleaning up batch {batch_id} from MinIO")
             
-            # List and delete all objects in batch
-            objects = self.minio_client.list_objects(
-                MINIO_BUCKET,
-                prefix=f"{batch_id}/",
-                recursive=True
-            )
-            
-            delete_object_list = [obj.object_name for obj in objects]
+            # Delete all objects in batch (plus its prebuilt archive and manifest)
+            delete_object_list = await self.get_batch_object_keys(batch_id)
+            delete_object_list += [archive_key(batch_id), manifest_key(batch_id)]
             
             if delete_object_list:
-                errors = self.minio_client.remove_objects(MINIO_BUCKET, delete_object_list)
+                from minio.deleteobjects import DeleteObject
+
+                errors = self.minio_client.remove_objects(
+                    MINIO_BUCKET,
+                    [DeleteObject(name) for name in delete_object_list]
+                )
                 for error in errors:
-                    logger.warning(f"⚠️  Error deleting {error.object_name}: {error}")
+                    logger.warning(f"⚠️  Error deleting {error.name}: {error.message}")
                 logger.info(f"✅ Deleted {len(delete_object_list)} objects from MinIO")
+
+            await self.storage.delete_batch(batch_id)
         except Exception as e:
             logger.warning(f"⚠️  Error during cleanup: {e}")
             # Continue anyway - cleanup failure shouldn't block
\ No newline at end of file
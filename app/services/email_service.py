@@ -1,10 +1,16 @@
+import hashlib
 import io
 import logging
+import os
 import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
-from typing import Optional
+from typing import Deque, Iterator, Optional
 
 from minio import Minio
 from minio.error import S3Error
@@ -14,6 +20,173 @@ from app.config import get_settings
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+CERTIFICATE_EMAIL_SUBJECT = "Your certificate"
+CERTIFICATE_EMAIL_BODY = "Hello,\n\nPlease find your certificate attached.\n\nBest regards"
+
+
+def build_certificate_message(
+    to_email: str,
+    subject: str,
+    body_text: str,
+    file_data: bytes,
+    filename_for_user: str = "certificate.pdf",
+) -> MIMEMultipart:
+    """Plain-text email with the certificate attached."""
+    msg = MIMEMultipart()
+    msg['From'] = settings.SMTP_FROM_EMAIL
+    msg['To'] = to_email
+    msg['Subject'] = subject
+
+    msg.attach(MIMEText(body_text, 'plain'))
+
+    attachment = MIMEApplication(file_data, Name=filename_for_user)
+    attachment['Content-Disposition'] = f'attachment; filename="{filename_for_user}"'
+    msg.attach(attachment)
+    return msg
+
+
+class _SMTPSession:
+    """An authenticated SMTP connection and how much it has been used."""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.sends = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """
+    Per-process pool of authenticated SMTP sessions.
+
+    Connecting, STARTTLS and LOGIN cost several round trips; a session is
+    reused across messages instead and recycled after `max_sends` messages,
+    after `idle_timeout` seconds unused (servers drop idle clients), or as
+    soon as it raises an error.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        use_tls: bool = True,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        size: int = 4,
+        max_sends: int = 100,
+        idle_timeout: float = 60,
+        timeout: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.user = user
+        self.password = password
+        self.max_sends = max_sends
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle: Deque[_SMTPSession] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> _SMTPSession:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.user and self.password:
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        logger.debug(f"Opened SMTP session to {self.host}:{self.port}")
+        return _SMTPSession(server)
+
+    def _checkout(self) -> Optional[_SMTPSession]:
+        """Most recently used idle session that is still fresh, closing stale ones."""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                session = self._idle.pop()
+                if now - session.last_used < self.idle_timeout:
+                    return session
+                session.close()
+        return None
+
+    @contextmanager
+    def session(self) -> Iterator[_SMTPSession]:
+        """Borrow a session; it goes back to the pool unless it failed or is used up."""
+        with self._slots:
+            session = self._checkout() or self._connect()
+            try:
+                yield session
+            except Exception:
+                session.close()
+                raise
+            session.sends += 1
+            session.last_used = time.monotonic()
+            if session.sends >= self.max_sends:
+                session.close()
+            else:
+                with self._lock:
+                    self._idle.append(session)
+
+    def send_message(self, msg) -> None:
+        """
+        Send a message over a pooled session.
+
+        A reused session may have been dropped by the server since its last
+        use; that case is retried once on a fresh connection.
+        """
+        session_reused = False
+        try:
+            with self.session() as session:
+                session_reused = session.sends > 0
+                session.server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+            if not session_reused:
+                raise
+            logger.info(f"SMTP session dropped ({e}), retrying on a new connection")
+            with self.session() as session:
+                session.server.send_message(msg)
+
+    def close(self):
+        """Close all idle sessions."""
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+
+_smtp_pool: Optional[SMTPConnectionPool] = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    """SMTP pool of this process (a forked worker child gets its own, never the parent's sockets)."""
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None or _smtp_pool.pid != os.getpid():
+            _smtp_pool = SMTPConnectionPool(
+                settings.SMTP_HOST,
+                settings.SMTP_PORT,
+                use_tls=settings.SMTP_USE_TLS,
+                user=settings.SMTP_USER,
+                password=settings.SMTP_PASSWORD,
+                size=settings.SMTP_POOL_SIZE,
+                max_sends=settings.SMTP_MAX_SENDS_PER_CONNECTION,
+                idle_timeout=settings.SMTP_IDLE_TIMEOUT,
+            )
+        return _smtp_pool
+
 
 class EmailService:
     """Service to fetch files from MinIO and send them via SMTP.
@@ -53,6 +226,19 @@ class EmailService:
             logger.exception(f"Unexpected error getting object {object_name} from MinIO: {e}")
             return None
 
+    def fetch_certificate(self, object_name: str, sha256: Optional[str] = None) -> Optional[bytes]:
+        """
+        Redeem a claim check: download a certificate and verify it against its manifest hash.
+
+        Returns:
+            The certificate bytes, or None if missing or not matching `sha256`
+        """
+        data = self._get_file_from_minio(object_name)
+        if data and sha256 and hashlib.sha256(data).hexdigest() != sha256:
+            logger.error(f"Certificate {object_name} does not match its sha256 {sha256}, not sending")
+            return None
+        return data
+
     def send_email_with_certificate(
         self,
         to_email: str,
@@ -60,39 +246,32 @@ class EmailService:
         body_text: str,
         minio_object_name: str,
         filename_for_user: str = "certificate.pdf",
+        sha256: Optional[str] = None,
     ) -> bool:
         """Fetch a file from MinIO and send it as an attachment via SMTP.
 
+        If `sha256` is given the file must match it (see fetch_certificate).
+
         Returns True on success, False on failure.
         """
-        file_data = self._get_file_from_minio(minio_object_name)
+        file_data = self.fetch_certificate(minio_object_name, sha256)
         if not file_data:
             logger.error(f"Cannot send email to {to_email}: file not found in MinIO: {minio_object_name}")
             return False
 
-        # Build MIME message
-        msg = MIMEMultipart()
-        msg['From'] = settings.SMTP_FROM_EMAIL
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body_text, 'plain'))
+        msg = build_certificate_message(to_email, subject, body_text, file_data, filename_for_user)
 
-        attachment = MIMEApplication(file_data, Name=filename_for_user)
-        attachment['Content-Disposition'] = f'attachment; filename="{filename_for_user}"'
-        msg.attach(attachment)
+        # One bucket in Redis keeps all workers together under the provider limit
+        from app.utils.rate_limiter import email_rate_limiter
+        if not email_rate_limiter().acquire(timeout=settings.EMAIL_RATE_LIMIT_TIMEOUT):
+            logger.warning(f"Email rate limit: no token within {settings.EMAIL_RATE_LIMIT_TIMEOUT}s for {to_email}")
+            return False
 
         try:
-            with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=30) as server:
-                if settings.SMTP_USE_TLS:
-                    server.starttls()
-
-                if settings.SMTP_USER and settings.SMTP_PASSWORD:
-                    server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-
-                server.send_message(msg)
-                logger.info(f"Email sent successfully to {to_email}")
-                return True
+            # Reuses an authenticated connection instead of a full handshake per message
+            get_smtp_pool().send_message(msg)
+            logger.info(f"Email sent successfully to {to_email}")
+            return True
         except Exception as e:
             logger.exception(f"Failed to send email to {to_email}: {e}")
             return False
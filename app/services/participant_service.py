@@ -4,6 +4,7 @@ from typing import Optional, List
 from datetime import datetime
 import logging
 
+from app.config import get_settings
 from app.schemas.participant import ParticipantCreate, ParticipantResponse
 from app.storage.redis_storage import RedisStorage
 from app.utils.exceptions import NotFoundError, ValidationError
@@ -11,6 +12,7 @@ from app.utils.validators import validate_email
 from app.utils.file_parser import parse_csv, parse_xlsx
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 UPLOADS_DIR = os.getenv('UPLOADS_DIR', './temp/uploads')
 
@@ -109,8 +111,10 @@ class ParticipantService:
                     'uploaded_at': datetime.utcnow().isoformat()
                 }
 
-                # Save to Redis with 1 hour TTL
-                await self.storage.save_participant(participant_id, normalized_participant, ttl=3600)
+                # Save to Redis for the session lifetime
+                await self.storage.save_participant(
+                    participant_id, normalized_participant, ttl=settings.SESSION_EXPIRATION
+                )
                 saved_ids.append(participant_id)
 
             logger.info(f"Saved {len(saved_ids)} participants to Redis")
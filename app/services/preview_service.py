@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+from app.services.certificate_service import participant_variables
+from app.storage.redis_storage import RedisStorage
+from app.storage.template_store import get_template_store, is_template_key
+from app.utils.asset_cache import LRUCache
+from app.utils.exceptions import NotFoundError, PDFGenerationError, ValidationError
+from app.utils.process_pool import IsolatedProcessPool
+from app.utils.template_compiler import template_hash
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MEDIA_TYPES = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'html': 'text/html',
+}
+
+# Rendered previews by (template hash, format, dpi, variables digest)
+_previews = LRUCache("previews", settings.PREVIEW_CACHE_MAX_BYTES)
+
+_pool: Optional[IsolatedProcessPool] = None
+_pool_lock = threading.Lock()
+
+
+def _init_preview_worker():
+    """Load renderers in each preview process before its first request."""
+    from app.utils.warmup import warm_up
+    warm_up()
+
+
+def get_preview_pool() -> IsolatedProcessPool:
+    """
+    Small process pool used only for previews.
+
+    Batch generation never submits here, so a preview does not queue behind
+    thousands of certificates. Processes are spawned (not forked from the
+    threaded API process) and warmed up once; a preview that hangs past
+    PDF_TIMEOUT has its process killed and replaced.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = IsolatedProcessPool(
+                    max_workers=settings.PREVIEW_POOL_SIZE,
+                    timeout=settings.PDF_TIMEOUT,
+                    memory_limit_mb=settings.RENDER_MEMORY_LIMIT_MB,
+                    initializer=_init_preview_worker,
+                    name="preview",
+                )
+                logger.info(f"🖼️ Started preview pool with {settings.PREVIEW_POOL_SIZE} processes")
+    return _pool
+
+
+def shutdown_preview_pool():
+    """Stop the preview processes (API shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def is_svg_template(template: Dict[str, Any], content: str) -> bool:
+    """SVG templates are filled with ${placeholders} and rendered by cairosvg."""
+    if template.get('type') == 'svg' or str(template.get('content_path', '')).lower().endswith('.svg'):
+        return True
+    head = content.lstrip()[:256].lower()
+    return head.startswith('<svg') or (head.startswith('<?xml') and '<svg' in head)
+
+
+class PreviewService:
+    """Low-resolution single-certificate previews."""
+
+    def __init__(self):
+        self.storage = RedisStorage()
+
+    async def _load_template_source(self, template: Dict[str, Any]) -> str:
+        content_path = template.get('content_path')
+        if not content_path:
+            raise NotFoundError("Template has no content_path")
+        if is_template_key(content_path):
+            content_path = await asyncio.to_thread(get_template_store().fetch_template, template)
+        if not os.path.exists(content_path):
+            raise NotFoundError(f"Template file not found: {content_path}")
+        with open(content_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    async def _load_participant(self, participant_id: Optional[str]) -> Dict[str, Any]:
+        if participant_id:
+            participant = await self.storage.get_participant(participant_id)
+            if not participant:
+                raise NotFoundError(f"Participant '{participant_id}' not found")
+            return participant
+        participants = await self.storage.get_all_participants()
+        if not participants:
+            raise NotFoundError("No participants to preview")
+        return participants[0]
+
+    async def render_preview(
+        self,
+        template_id: str,
+        event_name: str,
+        event_location: str,
+        issue_date: str,
+        participant_id: Optional[str] = None,
+        output_format: str = 'pdf',
+        dpi: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Render one participant's certificate at preview resolution.
+
+        Args:
+            template_id: Template to render
+            event_name: Event name
+            event_location: Event location
+            issue_date: Certificate issue date
+            participant_id: Participant to render (defaults to the first one)
+            output_format: 'pdf', 'png' (first page) or 'html'
+            dpi: Preview resolution (defaults to PREVIEW_DPI)
+
+        Returns:
+            Dict with content, media_type, participant_id, template_id and cached
+
+        Raises:
+            NotFoundError: template or participant does not exist
+            ValidationError: the format is not available in this deployment
+            PDFGenerationError: rendering failed
+            TimeoutError: the preview process took longer than PDF_TIMEOUT
+        """
+        dpi = dpi or settings.PREVIEW_DPI
+        template = await self.storage.get_template(template_id)
+        if not template:
+            raise NotFoundError(f"Template '{template_id}' not found")
+
+        source = await self._load_template_source(template)
+        participant = await self._load_participant(participant_id)
+        variables = participant_variables(participant, event_name, event_location, issue_date)
+        is_svg = is_svg_template(template, source)
+        if output_format == 'png' and not is_svg and importlib.util.find_spec('pypdfium2') is None:
+            # HTML templates are rendered to PDF and rasterised
+            raise ValidationError("PNG previews of HTML templates need pypdfium2 installed")
+
+        result = {
+            'media_type': MEDIA_TYPES[output_format],
+            'participant_id': participant.get('id'),
+            'template_id': template_id,
+        }
+
+        if output_format == 'html':
+            from app.utils.template_compiler import get_compiled_template
+            result['content'] = get_compiled_template(source).render(**variables)
+            result['cached'] = False
+            return result
+
+        variables_digest = hashlib.sha256(
+            json.dumps(variables, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        cache_key = (template_hash(source), output_format, dpi, variables_digest)
+        content = _previews.get(cache_key)
+        if content is not None:
+            result.update(content=content, cached=True)
+            return result
+
+        from app.utils.pdf_generator import render_preview
+
+        loop = asyncio.get_running_loop()
+        try:
+            # The preview pool kills a process still rendering after PDF_TIMEOUT
+            content = await loop.run_in_executor(
+                get_preview_pool(), render_preview, source, variables, output_format, dpi, is_svg
+            )
+        except TimeoutError:
+            logger.error(f"❌ Preview of {template_id} took longer than {settings.PDF_TIMEOUT}s")
+            raise TimeoutError(f"Preview took longer than {settings.PDF_TIMEOUT}s")
+        except Exception as e:
+            logger.error(f"❌ Preview rendering failed: {e}", exc_info=True)
+            raise PDFGenerationError(f"Preview rendering failed: {e}")
+
+        _previews.put(cache_key, content, len(content))
+        logger.info(f"🖼️ Rendered {output_format} preview of {template_id} at {dpi} DPI: {len(content)} bytes")
+        result.update(content=content, cached=False)
+        return result
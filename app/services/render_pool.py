@@ -0,0 +1,192 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from app.config import get_settings
+from app.utils.autotune import AIMDTuner, get_tuner
+from app.utils.process_pool import IsolatedProcessPool
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_pool: Optional[IsolatedProcessPool] = None
+_pool_lock = threading.Lock()
+
+_shares: Dict[int, "RenderShare"] = {}
+_shares_lock = threading.Lock()
+
+
+def _init_render_worker():
+    """Load renderers in each render process before its first certificate."""
+    from app.utils.warmup import warm_up
+    warm_up()
+
+
+def render_pool_size() -> int:
+    """Render processes to run (RENDER_POOL_SIZE, or one per CPU)."""
+    return settings.RENDER_POOL_SIZE or os.cpu_count() or 1
+
+
+def get_render_pool() -> IsolatedProcessPool:
+    """
+    Process pool shared by every batch in this process.
+
+    PDF rendering is CPU-bound pure Python, so it needs processes to use
+    more than one core. Each process keeps its own compiled-template and
+    asset caches, so a template variant is compiled and its assets loaded
+    once per process rather than once per certificate.
+
+    Each render gets PDF_TIMEOUT seconds and RENDER_MEMORY_LIMIT_MB of
+    address space; a process that hangs or dies is replaced and only that
+    certificate fails.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                size = render_pool_size()
+                _pool = IsolatedProcessPool(
+                    max_workers=size,
+                    timeout=settings.PDF_TIMEOUT,
+                    memory_limit_mb=settings.RENDER_MEMORY_LIMIT_MB,
+                    max_tasks_per_worker=settings.RENDER_MAX_TASKS_PER_WORKER,
+                    initializer=_init_render_worker,
+                    name="render",
+                )
+                logger.info(f"🏭 Started render pool with {size} processes")
+    return _pool
+
+
+def start_render_pool() -> Dict[str, Any]:
+    """
+    Start the render pool and wait for its processes to warm up.
+
+    Called at startup so the first batch does not pay for spawning and
+    warming every process. Waits at most RENDER_POOL_START_TIMEOUT seconds.
+
+    Returns:
+        Pool status: processes, whether all of them are warm, seconds taken
+    """
+    started = time.monotonic()
+    pool = get_render_pool()
+    ready = pool.wait_ready(settings.RENDER_POOL_START_TIMEOUT)
+    duration = round(time.monotonic() - started, 3)
+    if ready:
+        logger.info(f"🔥 Render pool warm in {duration}s")
+    else:
+        logger.warning(f"⚠️  Render pool still warming up after {duration}s")
+    return {'processes': pool.max_workers, 'ready': ready, 'duration': duration}
+
+
+def shutdown_render_pool():
+    """Stop the render processes (process shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def render_tuner() -> AIMDTuner:
+    """
+    Tuner of the renders kept queued in this process's pool.
+
+    Its limit is the window all batches share, so it must be fed pool-wide
+    measurements: each render is recorded with the pool's in-flight count.
+    Fed a batch's own in-flight renders, it would never see the window used
+    up while two bulk batches each hold half of it, and would not grow.
+
+    Never fewer than one per process (idle CPUs), at most
+    AUTOTUNE_RENDER_MAX_PER_PROCESS per process; starts at two.
+    """
+    size = render_pool_size()
+    return get_tuner('render', size, size * settings.AUTOTUNE_RENDER_MAX_PER_PROCESS, size * 2)
+
+
+def upload_tuner() -> AIMDTuner:
+    """Tuner of the certificate uploads to MinIO running at once in this process."""
+    return get_tuner(
+        'upload', settings.AUTOTUNE_UPLOAD_MIN, settings.AUTOTUNE_UPLOAD_MAX, settings.UPLOAD_CONCURRENCY
+    )
+
+
+def is_interactive_batch(size: int) -> bool:
+    """Batches this small are served ahead of bulk ones (RENDER_INTERACTIVE_MAX)."""
+    return size <= settings.RENDER_INTERACTIVE_MAX
+
+
+class RenderShare:
+    """
+    One batch's claim on the shared render pool.
+
+    A batch keeps at most `limit()` renders queued in the pool. Bulk batches
+    split the window (tuned by render_tuner) evenly between them,
+    so a batch that starts while a 30k batch is running gets its share on
+    the next completions instead of waiting behind all of it. Interactive
+    batches are not limited and are left out of the split; what they have
+    in flight is taken off the window the bulk batches share.
+    """
+
+    def __init__(self, batch_id: str, interactive: bool):
+        self.batch_id = batch_id
+        self.interactive = interactive
+        self.in_flight = 0
+
+    def limit(self, in_flight: int) -> int:
+        """
+        Record this batch's in-flight renders and return how many it may have.
+
+        Args:
+            in_flight: Renders this batch currently has submitted and not collected
+        """
+        window = render_tuner().limit
+        with _shares_lock:
+            self.in_flight = in_flight
+            if self.interactive:
+                return window
+            shares = list(_shares.values())
+            bulk = sum(1 for share in shares if not share.interactive)
+            interactive_load = sum(share.in_flight for share in shares if share.interactive)
+        return max(1, (window - interactive_load) // max(1, bulk))
+
+
+@contextmanager
+def render_share(batch_id: str, size: int) -> Iterator[RenderShare]:
+    """Register a batch with the render scheduler for as long as it renders."""
+    share = RenderShare(batch_id, is_interactive_batch(size))
+    with _shares_lock:
+        _shares[id(share)] = share
+        active = len(_shares)
+    if active > 1:
+        logger.info(f"⚖️ Batch {batch_id} ({size} certificates, "
+                    f"{'interactive' if share.interactive else 'bulk'}) shares the render pool with {active - 1} other(s)")
+    try:
+        yield share
+    finally:
+        with _shares_lock:
+            _shares.pop(id(share), None)
+
+
+def render_load() -> Dict[str, int]:
+    """Batches rendering in this process and their renders in flight."""
+    with _shares_lock:
+        shares = list(_shares.values())
+    return {
+        'active_batches': len(shares),
+        'in_flight': sum(share.in_flight for share in shares),
+        'pool_size': render_pool_size(),
+    }
+
+
+def batch_priority(size: int) -> int:
+    """
+    Celery priority for a generation task: 0 (first) for interactive batches,
+    growing with the order of magnitude of the batch up to 9.
+    """
+    if is_interactive_batch(size):
+        return 0
+    return min(9, len(str(size)) * 2 - 2)
+
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+
+from app.config import get_settings
+from app.services.certificate_service import (
+    CertificateService,
+    MINIO_BUCKET,
+    REDIS_BATCH_KEY,
+    archive_key,
+    manifest_key,
+)
+from app.services.template_service import STAGING_DIR, TEMPLATES_DIR
+from app.storage.template_store import BLOBS_DIR
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Only one API replica sweeps per interval
+RETENTION_LOCK_KEY = "certificate:retention_lock"
+
+
+class RetentionService:
+    """Enforces TEMP_FILES_RETENTION and SESSION_EXPIRATION.
+
+    Expires batches (certificates, archive, manifest) from MinIO with bulk
+    deletes, removes template folders no template points to any more and
+    unlinks stale Redis keys. Every pass reports how many bytes it reclaimed.
+    """
+
+    def __init__(self, certificate_service: Optional[CertificateService] = None):
+        self.certificates = certificate_service or CertificateService()
+        self.storage = self.certificates.storage
+
+    async def sweep(self) -> Dict[str, int]:
+        """Run one full retention pass."""
+        started = time.monotonic()
+        report = await self.expire_batches(time.time() - settings.TEMP_FILES_RETENTION)
+        report.update(await self.remove_orphaned_templates())
+        report['redis_keys'] += await self.unlink_stale_keys()
+        logger.info(
+            f"🧹 Retention sweep done in {time.monotonic() - started:.1f}s: "
+            f"{report['batches']} batches, {report['objects']} objects, "
+            f"{report['template_folders']} template folders, {report['redis_keys']} Redis keys, "
+            f"{report['bytes'] + report['template_bytes']} bytes reclaimed"
+        )
+        return report
+
+    async def expire_batches(self, created_before: Optional[float] = None) -> Dict[str, int]:
+        """
+        Delete every batch created before the given unix timestamp.
+
+        Args:
+            created_before: Cut-off timestamp; None deletes all batches
+
+        Returns:
+            Dict with counts of batches, objects, Redis keys and reclaimed bytes
+        """
+        cutoff = created_before if created_before is not None else float('inf')
+        report = {'batches': 0, 'objects': 0, 'bytes': 0, 'redis_keys': 0}
+
+        while True:
+            batch_ids = await self.storage.get_batches_created_before(cutoff)
+            if not batch_ids:
+                break
+
+            keys: List[str] = []
+            for batch_id in batch_ids:
+                batch_keys, batch_bytes = await self._batch_objects(batch_id)
+                keys += batch_keys
+                report['bytes'] += batch_bytes
+
+            report['objects'] += await asyncio.to_thread(self._remove_objects, keys)
+            report['redis_keys'] += await self.storage.unindex_batches(batch_ids)
+            report['batches'] += len(batch_ids)
+            logger.info(f"🗑️ Expired {len(batch_ids)} batches ({len(keys)} objects)")
+
+        return report
+
+    async def _batch_objects(self, batch_id: str) -> Tuple[List[str], int]:
+        """Object keys of a batch and their total size, from the manifest when possible."""
+        manifest = await self.certificates.get_batch_manifest(batch_id)
+        if manifest:
+            keys = [entry['key'] for entry in manifest.values()]
+            size = sum(entry.get('size', 0) for entry in manifest.values())
+        else:
+            def _list():
+                objects = self.certificates.minio_client.list_objects(
+                    MINIO_BUCKET, prefix=f"{batch_id}/", recursive=True
+                )
+                return [(obj.object_name, obj.size or 0) for obj in objects]
+
+            listed = await asyncio.to_thread(_list)
+            keys = [name for name, _ in listed]
+            size = sum(obj_size for _, obj_size in listed)
+
+        for extra in (archive_key(batch_id), manifest_key(batch_id)):
+            extra_size = await asyncio.to_thread(self._object_size, extra)
+            if extra_size is not None:
+                keys.append(extra)
+                size += extra_size
+        return keys, size
+
+    def _object_size(self, object_key: str) -> Optional[int]:
+        try:
+            return self.certificates.minio_client.stat_object(MINIO_BUCKET, object_key).size
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+                return None
+            raise
+
+    def _remove_objects(self, keys: List[str]) -> int:
+        """Bulk delete; MinIO sends up to 1000 keys per DeleteObjects request."""
+        if not keys:
+            return 0
+        errors = self.certificates.minio_client.remove_objects(
+            MINIO_BUCKET, (DeleteObject(key) for key in keys)
+        )
+        failed = 0
+        for error in errors:
+            failed += 1
+            logger.warning(f"⚠️  Error deleting {error.name}: {error.message}")
+        return len(keys) - failed
+
+    async def remove_orphaned_templates(self) -> Dict[str, int]:
+        """Delete files in TEMPLATES_DIR that no stored template references any more."""
+        report = {'template_folders': 0, 'template_bytes': 0}
+        if not os.path.isdir(TEMPLATES_DIR):
+            return report
+
+        # Must not swallow Redis errors: an empty answer would orphan everything
+        templates = await self.storage.scan_templates()
+        # The shared blob cache is reference-counted separately, and uploads
+        # being extracted live under the staging dir (swept per upload below)
+        referenced = {BLOBS_DIR, STAGING_DIR}
+        templates_root = os.path.abspath(TEMPLATES_DIR)
+        for template in templates:
+            referenced.add(template.get('id'))
+            content_path = template.get('content_path')
+            if content_path and not content_path.startswith('templates/'):
+                relative = os.path.relpath(os.path.abspath(content_path), templates_root)
+                referenced.add(relative.split(os.sep)[0])
+
+        cutoff = time.time() - settings.TEMP_FILES_RETENTION
+
+        def _stale_entries():
+            for entry in os.scandir(TEMPLATES_DIR):
+                name = entry.name
+                template_id = os.path.splitext(name)[0]
+                if name in referenced or template_id in referenced:
+                    continue
+                if entry.stat().st_mtime <= cutoff:
+                    yield entry
+            # Extraction folders of uploads that never finished (the process died)
+            staging = os.path.join(TEMPLATES_DIR, STAGING_DIR)
+            if os.path.isdir(staging):
+                for entry in os.scandir(staging):
+                    if entry.stat().st_mtime <= cutoff:
+                        yield entry
+
+        def _remove():
+            for entry in _stale_entries():
+                if entry.is_dir():
+                    size = sum(
+                        os.path.getsize(os.path.join(root, f))
+                        for root, _, files in os.walk(entry.path) for f in files
+                    )
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                report['template_folders'] += 1
+                report['template_bytes'] += size
+                logger.info(f"🗑️ Removed orphaned template files: {entry.path}")
+
+        await asyncio.to_thread(_remove)
+        return report
+
+    async def unlink_stale_keys(self) -> int:
+        """Unlink Redis keys left behind by expired batches or written without a TTL."""
+        redis = await self.certificates._get_redis()
+        stale = []
+
+        current = await redis.get(REDIS_BATCH_KEY)
+        if current and await redis.zscore("certificate:batches", current) is None:
+            stale.append(REDIS_BATCH_KEY)
+
+        keys = [key async for key in redis.scan_iter(match="batch:*", count=500)]
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in chunk:
+                    pipe.ttl(key)
+                    pipe.zscore("certificate:batches", key.split(":")[1])
+                results = await pipe.execute()
+            for key, ttl, score in zip(chunk, results[0::2], results[1::2]):
+                # No TTL and no longer indexed: written by an older version or orphaned
+                if ttl == -1 and score is None:
+                    stale.append(key)
+
+        if not stale:
+            return 0
+        return await redis.unlink(*stale)
+
+
+async def run_retention_loop(interval: Optional[int] = None):
+    """Sweep periodically; a Redis lock keeps concurrent API replicas from racing."""
+    interval = interval or settings.RETENTION_SWEEP_INTERVAL
+    token = uuid.uuid4().hex
+    while True:
+        try:
+            service = RetentionService()
+            redis = await service.certificates._get_redis()
+            if await redis.set(RETENTION_LOCK_KEY, token, nx=True, ex=interval):
+                await service.sweep()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Retention sweep failed: {e}", exc_info=True)
+        await asyncio.sleep(interval)
@@ -1,18 +1,164 @@
+import asyncio
+import hashlib
 import os
+import re
+import shutil
+import time
 import uuid
 import zipfile
 import io
 import logging
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, BinaryIO, Tuple, Union
 
+from app.config import get_settings
 from app.storage.redis_storage import RedisStorage
+from app.storage.template_store import (
+    blob_key,
+    get_template_store,
+    is_blob_key,
+    is_template_key,
+    variant_blob_key,
+)
 from app.utils.exceptions import ValidationError
+from app.utils.image_optimizer import RASTER_EXTENSIONS, optimize_image
+from app.utils.template_compiler import (
+    compiled_path_for,
+    extract_variables,
+    template_hash,
+    write_compiled,
+)
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 TEMPLATES_DIR = os.getenv('TEMPLATES_DIR', './data/templates')
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.svg')
+
+# ZIP uploads are extracted here (inside the cache dir, so blobs can be moved into place)
+STAGING_DIR = '.staging'
+ZIP_COPY_CHUNK = 1024 * 1024
+
+IMG_SRC_RE = re.compile(r'<img\s+([^>]*?)src=["\']([^"\']+)["\']([^>]*)>', re.IGNORECASE)
+
+
+def check_template_syntax(content: str):
+    """Raise ValidationError if the template does not parse."""
+    import jinja2
+
+    try:
+        extract_variables(content)
+    except jinja2.TemplateSyntaxError as e:
+        raise ValidationError(f"Template syntax error at line {e.lineno}: {e.message}")
+
+
+def upload_digest(file_hashes: Dict[str, str]) -> str:
+    """
+    Content digest of an uploaded template.
+    
+    Covers every file name and SHA-256 plus the settings that shape the
+    stored result, so two uploads with the same digest produce the same blobs.
+    """
+    digest = hashlib.sha256(f"{settings.PDF_DPI}:{settings.PDF_PAGE_SIZE}:{settings.IMAGE_JPEG_QUALITY}".encode())
+    for filename in sorted(file_hashes):
+        digest.update(filename.encode('utf-8') + b'\0')
+        digest.update(bytes.fromhex(file_hashes[filename]))
+    return digest.hexdigest()
+
+
+def _check_member_name(filename: str):
+    """Reject names that would escape the template (zip-slip) or are not plain relative paths."""
+    normalized = os.path.normpath(filename)
+    if (
+        os.path.isabs(filename)
+        or filename.startswith(('/', '\\'))
+        or normalized == '..'
+        or normalized.startswith('..' + os.sep)
+        or ':' in filename
+    ):
+        raise ValidationError(f"Unsafe path in ZIP: {filename}")
+
+
+def extract_template_zip(zip_file_obj: BinaryIO, staging_dir: str) -> Tuple[Dict[str, Dict[str, Any]], str]:
+    """
+    Stream the members of a template ZIP to disk, enforcing upload limits.
+    
+    Each member is copied in ZIP_COPY_CHUNK pieces and hashed on the way, so
+    memory stays flat whatever the archive holds. Limits apply to the ZIP
+    itself, the member count, the total uncompressed size and each member's
+    compression ratio; sizes are counted as bytes are actually inflated,
+    not taken from the (forgeable) headers.
+    
+    Args:
+        zip_file_obj: Seekable ZIP file
+        staging_dir: Empty folder to extract into
+        
+    Returns:
+        ({member name: {'path', 'sha256', 'size'}}, name of the template HTML)
+        
+    Raises:
+        ValidationError: invalid ZIP, unsafe member names, a limit exceeded or no HTML file
+    """
+    zip_file_obj.seek(0, os.SEEK_END)
+    zip_size = zip_file_obj.tell()
+    zip_file_obj.seek(0)
+    if zip_size > settings.MAX_FILE_SIZE:
+        raise ValidationError(f"ZIP is larger than {settings.MAX_FILE_SIZE} bytes")
+
+    try:
+        zip_file = zipfile.ZipFile(zip_file_obj, 'r')
+    except zipfile.BadZipFile as e:
+        raise ValidationError(f"Invalid ZIP file: {e}")
+
+    with zip_file:
+        infos = [info for info in zip_file.infolist() if not info.is_dir()]
+        logger.info(f"📄 ZIP contents: {[info.filename for info in infos]}")
+        if len(infos) > settings.TEMPLATE_ZIP_MAX_FILES:
+            raise ValidationError(f"ZIP has {len(infos)} files, the limit is {settings.TEMPLATE_ZIP_MAX_FILES}")
+
+        # Find template HTML
+        template_files = [info.filename for info in infos if info.filename.lower().endswith('.html')]
+        if not template_files:
+            raise ValidationError("No HTML file found in ZIP")
+        template_file = next((f for f in template_files if f.lower().endswith('template.html')), template_files[0])
+
+        os.makedirs(staging_dir, exist_ok=True)
+        members = {}
+        total_size = 0
+        for index, info in enumerate(infos):
+            _check_member_name(info.filename)
+            max_member_size = max(info.compress_size, 1) * settings.TEMPLATE_ZIP_MAX_RATIO
+            path = os.path.join(staging_dir, str(index))
+            digest = hashlib.sha256()
+            size = 0
+            with zip_file.open(info) as source, open(path, 'wb') as dest:
+                while True:
+                    chunk = source.read(ZIP_COPY_CHUNK)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    total_size += len(chunk)
+                    if total_size > settings.TEMPLATE_ZIP_MAX_UNCOMPRESSED:
+                        raise ValidationError(
+                            f"ZIP expands to more than {settings.TEMPLATE_ZIP_MAX_UNCOMPRESSED} bytes"
+                        )
+                    if size > max_member_size:
+                        raise ValidationError(
+                            f"{info.filename} is compressed more than {settings.TEMPLATE_ZIP_MAX_RATIO}:1"
+                        )
+                    digest.update(chunk)
+                    dest.write(chunk)
+            members[info.filename] = {'path': path, 'sha256': digest.hexdigest(), 'size': size}
+
+    logger.info(f"📦 Extracted {len(members)} files ({total_size} bytes)")
+    return members, template_file
+
+
+def blob_refs(template: Dict[str, Any]) -> List[str]:
+    """Blobs a template keeps alive: its body and its assets."""
+    return sorted(set([template['content_path']] + list(template.get('blobs') or [])))
+
 
 class TemplateService:
     """Service for managing certificate templates."""
@@ -21,25 +167,62 @@ class TemplateService:
         self.storage = RedisStorage()
         os.makedirs(TEMPLATES_DIR, exist_ok=True)
 
+    @property
+    def store(self):
+        """MinIO-backed template store (connected on first use)."""
+        return get_template_store()
+
+    def analyze_template(self, content: str, template_path: str) -> Dict[str, Any]:
+        """
+        Parse a template once at upload time.
+        
+        Extracts the variables it uses and stores a compiled artifact next to
+        it, so syntax errors surface on upload instead of during a batch.
+        
+        Args:
+            content: Template source
+            template_path: Local path the template is saved at
+            
+        Returns:
+            Metadata fields: variables, template_hash, compiled_path
+        """
+        import jinja2
+
+        try:
+            variables = extract_variables(content)
+            compiled_path = write_compiled(content, compiled_path_for(template_path))
+        except jinja2.TemplateSyntaxError as e:
+            raise ValidationError(f"Template syntax error at line {e.lineno}: {e.message}")
+
+        logger.info(f"🔍 Template variables: {variables}")
+        return {
+            'variables': variables,
+            'template_hash': template_hash(content),
+            'compiled_path': compiled_path,
+        }
+
     async def create_template(self, name: str, content: str, template_type: str = 'html') -> Dict[str, Any]:
         """Create a new template."""
         try:
             logger.info(f"✅ Creating template: {name}")
             
             template_id = str(uuid.uuid4())[:12]
-            template_path = os.path.join(TEMPLATES_DIR, f"{template_id}.html")
+            check_template_syntax(content)
             
-            # Write template locally (UTF-8 for Cyrillic)
-            with open(template_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            # Store the body content-addressed in MinIO, cached locally (UTF-8 for Cyrillic)
+            content_key = await asyncio.to_thread(self.store.put_blob, content.encode('utf-8'), '.html')
+            analysis = self.analyze_template(content, self.store.local_path(content_key))
+            await self.storage.add_blob_refs([content_key])
 
             # Store metadata in Redis
             template_metadata = {
                 'id': template_id,
                 'name': name,
                 'type': template_type,
-                'content_path': template_path,
-                'created_at': str(os.path.getctime(template_path)),
+                'content_path': content_key,
+                'blobs': [],
+                'created_at': str(time.time()),
+                **analysis,
             }
 
             await self.storage.save_template(template_id, template_metadata)
@@ -51,108 +234,136 @@ class TemplateService:
             logger.error(f"❌ Error creating template: {e}", exc_info=True)
             raise
 
-    async def upload_template_zip(self, zip_bytes: bytes, template_name: str) -> Dict[str, Any]:
+    async def upload_template_zip(self, zip_source: Union[bytes, BinaryIO], template_name: str) -> Dict[str, Any]:
         """
         Upload ZIP with HTML template and images.
-        Images are stored with absolute file:// paths for PDF API.
+        
+        Members are streamed to a staging folder with bounded buffers; the
+        whole ZIP is never held in memory. Files are stored content-addressed,
+        so uploading the same ZIP again reuses the stored blobs (and every
+        cache keyed by template hash) instead of optimizing everything again.
+        Images are referenced by absolute paths into the local blob cache.
+        
+        Args:
+            zip_source: ZIP bytes or a seekable binary file (e.g. UploadFile.file)
+            template_name: Display name
         """
+        if isinstance(zip_source, (bytes, bytearray)):
+            zip_source = io.BytesIO(zip_source)
+
+        staging_dir = os.path.join(self.store.cache_dir, STAGING_DIR, uuid.uuid4().hex)
         try:
             logger.info(f"📦 Processing template ZIP: {template_name}")
             
-            # Extract ZIP
-            zip_buffer = io.BytesIO(zip_bytes)
-            with zipfile.ZipFile(zip_buffer, 'r') as zip_file:
-                file_list = zip_file.namelist()
-                logger.info(f"📄 ZIP contents: {file_list}")
-                
-                # Find template HTML
-                template_files = [f for f in file_list if f.lower().endswith('template.html') or f.lower().endswith('.html')]
-                if not template_files:
-                    raise ValidationError("No HTML file found in ZIP")
-                
-                # Read template (UTF-8 for Cyrillic!)
-                template_file = template_files[0]
-                template_html = zip_file.read(template_file).decode('utf-8')
-                logger.info(f"✅ Read template: {template_file}")
-                
-                # Create template folder
-                template_id = str(uuid.uuid4())[:12]
-                template_folder = os.path.join(TEMPLATES_DIR, template_id)
-                os.makedirs(template_folder, exist_ok=True)
-                logger.info(f"📁 Created template folder: {template_folder}")
-                
-                # Extract all files (keep original structure)
-                image_count = 0
-                for file_info in zip_file.infolist():
-                    if file_info.is_dir():
-                        continue
-                    
-                    file_content = zip_file.read(file_info.filename)
-                    file_path = os.path.join(template_folder, file_info.filename)
-                    
-                    # Create subdirectories
-                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                    
-                    # Write file
-                    with open(file_path, 'wb') as f:
-                        f.write(file_content)
-                    
-                    # Track images
-                    if any(file_info.filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.svg']):
-                        image_count += 1
-                        logger.info(f"📸 Extracted image: {file_info.filename}")
-                
-                # Replace image paths in template with absolute file paths
-                # Change <img src="image.png"> to <img src="/app/data/templates/abc123/image.png">
-                modified_template = template_html
-                
-                # Find all image references
-                import re
-                img_pattern = r'<img\s+([^>]*?)src=["\']([^"\']+)["\']([^>]*)>'
-                
-                def replace_img_path(match):
-                    prefix = match.group(1)
-                    src = match.group(2)
-                    suffix = match.group(3)
-                    
-                    # Skip if already absolute
-                    if src.startswith(('/', 'http://', 'https://', 'data:')):
-                        return match.group(0)
-                    
-                    # Make absolute path
-                    abs_img_path = os.path.join(template_folder, src)
-                    abs_img_path = os.path.abspath(abs_img_path)
-                    
-                    logger.info(f"🔗 Image path: {src} → {abs_img_path}")
-                    return f'<img {prefix}src="{abs_img_path}"{suffix}>'
-                
-                modified_template = re.sub(img_pattern, replace_img_path, modified_template, flags=re.IGNORECASE)
-                
-                # Save modified template
-                template_path = os.path.join(template_folder, 'template.html')
-                with open(template_path, 'w', encoding='utf-8') as f:
-                    f.write(modified_template)
-                logger.info(f"✅ Saved modified template: {template_path}")
-
-                # Store metadata in Redis
-                template_metadata = {
-                    'id': template_id,
-                    'name': template_name,
-                    'type': 'html',
-                    'content_path': template_path,
-                    'has_images': image_count > 0,
-                    'image_count': image_count,
-                    'created_at': str(os.path.getctime(template_path)),
-                }
-
-                await self.storage.save_template(template_id, template_metadata)
-                
-                logger.info(f"✅ ZIP template stored: {template_id} with {image_count} images")
-                return template_metadata
+            # Extract ZIP off the event loop
+            members, template_file = await asyncio.to_thread(extract_template_zip, zip_source, staging_dir)
+            
+            # Read template (UTF-8 for Cyrillic!)
+            with open(members[template_file]['path'], 'r', encoding='utf-8') as f:
+                template_html = f.read()
+            check_template_syntax(template_html)
+            logger.info(f"✅ Read template: {template_file}")
+
+            digest = upload_digest({name: member['sha256'] for name, member in members.items()})
+            content = await self.storage.get_template_upload(digest)
+            if content and await self.storage.get_blob_refs(content['content_path']) > 0:
+                logger.info(f"♻️ Identical template already stored, reusing blobs of upload {digest[:12]}")
+            else:
+                content = await asyncio.to_thread(self._store_template_files, members, template_html)
+                await self.storage.save_template_upload(digest, content)
+            await self.storage.add_blob_refs(blob_refs(content))
+
+            # Store metadata in Redis
+            template_id = str(uuid.uuid4())[:12]
+            template_metadata = {
+                'id': template_id,
+                'name': template_name,
+                'type': 'html',
+                'upload_digest': digest,
+                'created_at': str(time.time()),
+                **content,
+            }
+
+            await self.storage.save_template(template_id, template_metadata)
+            
+            logger.info(f"✅ ZIP template stored: {template_id} with {content['image_count']} images")
+            return template_metadata
             
         except Exception as e:
             logger.error(f"❌ Error processing ZIP: {e}", exc_info=True)
             raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _store_template_files(self, members: Dict[str, Dict[str, Any]], template_html: str) -> Dict[str, Any]:
+        """
+        Store extracted ZIP members as blobs, optimize images and rewrite the template to point at them.
+        
+        Returns:
+            Template content fields: content_path, blobs, analysis and image stats
+        """
+        blobs = []
+        assets = {}
+        image_paths = {}
+        image_count = 0
+        for filename, member in members.items():
+            ext = os.path.splitext(filename)[1]
+            key = self.store.put_blob_file(member['path'], key=blob_key(member['sha256'], ext), move=True)
+            blobs.append(key)
+            local_path = self.store.local_path(key)
+            
+            # Track images
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                image_count += 1
+                image_paths[os.path.normpath(filename)] = local_path
+                logger.info(f"📸 Stored image: {filename} → {key}")
+
+            # Downsample and recompress images once, at upload, instead of in every render
+            if filename.lower().endswith(RASTER_EXTENSIONS):
+                variant_key = variant_blob_key(key, settings.PDF_DPI)
+                variant_local_path = self.store.local_path(variant_key)
+                try:
+                    assets[filename] = optimize_image(local_path, variant_local_path)
+                    self.store.put_blob_file(variant_local_path, key=variant_key)
+                    blobs.append(variant_key)
+                    image_paths[os.path.normpath(filename)] = variant_local_path
+                except Exception as e:
+                    logger.warning(f"⚠️  Keeping original image {filename}: {e}")
+
+        # Replace image paths in template with absolute paths into the blob cache, in one pass
+        # Change <img src="image.png"> to <img src="/app/data/templates/blobs/<sha>.png">
+        def replace_img_path(match):
+            prefix = match.group(1)
+            src = match.group(2)
+            suffix = match.group(3)
+            
+            # Skip if already absolute
+            if src.startswith(('/', 'http://', 'https://', 'data:')):
+                return match.group(0)
+            
+            abs_img_path = image_paths.get(os.path.normpath(src))
+            if not abs_img_path:
+                return match.group(0)
+            return f'<img {prefix}src="{abs_img_path}"{suffix}>'
+        
+        modified_template, rewritten = IMG_SRC_RE.subn(replace_img_path, template_html)
+        logger.info(f"🔗 Rewrote {rewritten} image references")
+        
+        # Identical uploads produce an identical body, so it shares compiled and render caches
+        content_key = self.store.put_blob(modified_template.encode('utf-8'), '.html')
+        analysis = self.analyze_template(modified_template, self.store.local_path(content_key))
+        logger.info(f"✅ Saved modified template: {content_key}")
+
+        return {
+            'content_path': content_key,
+            'blobs': sorted(set(blobs)),
+            'has_images': image_count > 0,
+            'image_count': image_count,
+            'assets': assets,
+            'assets_original_bytes': sum(a['original_bytes'] for a in assets.values()),
+            'assets_optimized_bytes': sum(a['optimized_bytes'] for a in assets.values()),
+            **analysis,
+        }
 
     async def get_template(self, template_id: str) -> Optional[Dict[str, Any]]:
         """Get template metadata from Redis."""
@@ -162,7 +373,9 @@ class TemplateService:
                 logger.info(f"✅ Retrieved template: {template_id}")
                 # Verify content exists
                 content_path = template.get('content_path')
-                if content_path and os.path.exists(content_path):
+                if is_template_key(content_path):
+                    logger.info(f"✅ Template stored in MinIO: {content_path}")
+                elif content_path and os.path.exists(content_path):
                     logger.info(f"✅ Template file exists: {content_path}")
                 else:
                     logger.warning(f"⚠️ Template file missing: {content_path}")
@@ -181,9 +394,83 @@ class TemplateService:
             logger.error(f"❌ Error getting all templates: {e}", exc_info=True)
             raise
 
+    async def update_template(self, template_id: str, name: str, content: str, template_type: str = 'html') -> Optional[Dict[str, Any]]:
+        """
+        Replace a template's body, keeping its ID and assets.
+        
+        Args:
+            template_id: Template to update
+            name: New display name
+            content: New template source
+            template_type: Template type
+            
+        Returns:
+            Updated metadata, or None if the template does not exist
+        """
+        try:
+            template = await self.storage.get_template(template_id)
+            if not template:
+                return None
+
+            content_path = template.get('content_path')
+            released = []
+            if is_blob_key(content_path):
+                check_template_syntax(content)
+                new_content_path = await asyncio.to_thread(self.store.put_blob, content.encode('utf-8'), '.html')
+                local_path = self.store.local_path(new_content_path)
+                analysis = self.analyze_template(content, local_path)
+                if new_content_path != content_path:
+                    await self.storage.add_blob_refs([new_content_path])
+                    released = await self.storage.release_blob_refs([content_path])
+                    content_path = new_content_path
+            elif is_template_key(content_path):
+                local_path = self.store.local_path(content_path)
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                analysis = self.analyze_template(content, local_path)
+                relative_path = content_path.split('/', 2)[-1]
+                await asyncio.to_thread(self.store.put, template_id, relative_path, content.encode('utf-8'))
+            else:
+                # Templates created before MinIO storage keep their local file
+                local_path = content_path
+                analysis = self.analyze_template(content, local_path)
+                with open(local_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            logger.info(f"✅ Updated template file: {content_path}")
+
+            updated_metadata = {
+                **template,
+                'id': template_id,
+                'name': name,
+                'type': template_type,
+                'content_path': content_path,
+                **analysis,
+                'updated_at': str(os.path.getctime(local_path)) if os.path.exists(local_path) else None,
+            }
+            # The body no longer matches the original upload
+            updated_metadata.pop('upload_digest', None)
+            await self.storage.save_template(template_id, updated_metadata)
+            if released:
+                await asyncio.to_thread(self.store.delete_blobs, released)
+            return updated_metadata
+        except Exception as e:
+            logger.error(f"❌ Error updating template: {e}", exc_info=True)
+            raise
+
     async def delete_template(self, template_id: str) -> bool:
         """Delete template."""
         try:
+            template = await self.storage.get_template(template_id)
+            content_path = template.get('content_path') if template else None
+            if is_blob_key(content_path):
+                # Blobs shared with identical templates stay until their last reference goes
+                released = await self.storage.release_blob_refs(blob_refs(template))
+                if released:
+                    await asyncio.to_thread(self.store.delete_blobs, released)
+                if content_path in released and template.get('upload_digest'):
+                    await self.storage.delete_template_upload(template['upload_digest'])
+            elif is_template_key(content_path):
+                await asyncio.to_thread(self.store.delete, template_id)
+
             # Delete files
             template_folder = os.path.join(TEMPLATES_DIR, template_id)
             if os.path.exists(template_folder):
@@ -1,13 +1,25 @@
 import io
 import logging
 import os
-from urllib.parse import urlparse
-from typing import Optional
+import queue
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse, quote
+from typing import Iterable, Iterator, Optional, Tuple
+
+import urllib3
 
 from minio import Minio
 from minio.error import S3Error
 
+from app.config import get_settings
+from app.utils.exceptions import StorageError
+
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 
 class MinIOStorage:
@@ -16,6 +28,8 @@ class MinIOStorage:
         self.access_key = os.getenv('MINIO_ACCESS_KEY', 'minioadmin')
         self.secret_key = os.getenv('MINIO_SECRET_KEY', 'minioadmin')
         self.bucket = os.getenv('MINIO_BUCKET', 'certificates')
+        self.region = settings.MINIO_REGION
+        self._public_client = None
 
         parsed = urlparse(self.url)
         # Minio client expects endpoint without schema
@@ -27,6 +41,8 @@ class MinIOStorage:
             access_key=self.access_key,
             secret_key=self.secret_key,
             secure=secure,
+            region=self.region,
+            http_client=make_http_client(),
         )
 
         # Ensure bucket exists
@@ -65,3 +81,308 @@ class MinIOStorage:
         # Return a simple HTTP URL to the object; depends on MinIO external access
         # MINIO_URL contains scheme+host; combine with bucket and object
         return f"{self.url}/{self.bucket}/{object_key}"
+
+    def object_exists(self, object_key: str) -> bool:
+        """Check whether an object exists in the bucket."""
+        try:
+            self.client.stat_object(self.bucket, object_key)
+            return True
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+                return False
+            raise
+
+    def _get_public_client(self) -> Minio:
+        """Client used to sign URLs handed out to browsers.
+
+        Presigned URLs embed the host they were signed for, so when MinIO is
+        reachable from outside under a different address (MINIO_PUBLIC_URL)
+        links must be signed against that address. The region is pinned so
+        signing never needs a network round trip.
+        """
+        if not settings.MINIO_PUBLIC_URL:
+            return self.client
+        if self._public_client is None:
+            parsed = urlparse(settings.MINIO_PUBLIC_URL)
+            self._public_client = Minio(
+                parsed.netloc or parsed.path,
+                access_key=self.access_key,
+                secret_key=self.secret_key,
+                secure=parsed.scheme == 'https',
+                region=self.region,
+            )
+        return self._public_client
+
+    @staticmethod
+    def _disposition_headers(filename: Optional[str]) -> Optional[dict]:
+        if not filename:
+            return None
+        return {'response-content-disposition': content_disposition(filename)}
+
+    def presigned_get_url(self, object_key: str, filename: Optional[str] = None, expires: Optional[int] = None) -> str:
+        """Return a time-limited GET URL for the object that clients can fetch directly.
+
+        Args:
+            object_key: object key in the bucket
+            filename: if given, MinIO answers with an attachment Content-Disposition
+            expires: link lifetime in seconds (defaults to PRESIGNED_URL_EXPIRATION)
+        """
+        expires = expires or settings.PRESIGNED_URL_EXPIRATION
+        return self._get_public_client().presigned_get_object(
+            self.bucket,
+            object_key,
+            expires=timedelta(seconds=expires),
+            response_headers=self._disposition_headers(filename),
+        )
+
+    def accel_redirect_path(self, object_key: str, filename: Optional[str] = None) -> str:
+        """Return an X-Accel-Redirect target so nginx streams the object from MinIO itself.
+
+        The URL is signed for the internal MinIO host; nginx's internal
+        ACCEL_REDIRECT_LOCATION proxies the path and query string to it unchanged.
+        """
+        url = self.client.presigned_get_object(
+            self.bucket,
+            object_key,
+            expires=timedelta(seconds=settings.PRESIGNED_URL_EXPIRATION),
+            response_headers=self._disposition_headers(filename),
+        )
+        parsed = urlparse(url)
+        location = settings.ACCEL_REDIRECT_LOCATION.rstrip('/')
+        return f"{location}{parsed.path}?{parsed.query}"
+
+
+def make_http_client(maxsize: Optional[int] = None) -> urllib3.PoolManager:
+    """HTTP pool for a Minio client, sized so parallel fetches can all keep their connections.
+
+    The Minio default keeps 10 connections per host; with more GETs in flight
+    the extra connections would be thrown away after every request.
+    """
+    maxsize = maxsize or settings.MINIO_FETCH_CONCURRENCY + 4
+    return urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=10, read=300),
+        maxsize=maxsize,
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+
+
+def _read_object(client: Minio, bucket: str, object_name: str, skip_unreadable: bool = False) -> Optional[bytes]:
+    """GET one object and hand its connection back to the pool (None if skipped)."""
+    try:
+        response = client.get_object(bucket, object_name)
+    except S3Error as e:
+        logger.error(f"❌ Error downloading {object_name}: {e}")
+        if not skip_unreadable:
+            raise
+        return None
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def fetch_objects(
+    client: Minio,
+    bucket: str,
+    object_names: Iterable[str],
+    max_in_flight: Optional[int] = None,
+    skip_unreadable: bool = False,
+) -> Iterator[Tuple[str, bytes]]:
+    """Fetch objects with up to `max_in_flight` GETs running, yielding them in input order.
+
+    Keeps a sliding window of requests so per-object round-trip latency
+    overlaps instead of adding up, while memory stays bounded by the window.
+
+    Args:
+        client: Minio client (see make_http_client for pool sizing)
+        bucket: bucket name
+        object_names: keys to fetch, in the order they should be yielded
+        max_in_flight: window size (defaults to MINIO_FETCH_CONCURRENCY)
+        skip_unreadable: log and skip objects that cannot be read instead of
+            raising their S3Error (never for archives, which must be complete)
+
+    Yields:
+        (object_name, data) tuples
+    """
+    max_in_flight = max_in_flight or settings.MINIO_FETCH_CONCURRENCY
+    names = iter(object_names)
+    window = deque()
+    executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="minio-fetch")
+    try:
+        for name in names:
+            window.append((name, executor.submit(_read_object, client, bucket, name, skip_unreadable)))
+            if len(window) >= max_in_flight:
+                break
+
+        while window:
+            name, future = window.popleft()
+            next_name = next(names, None)
+            if next_name is not None:
+                window.append((next_name, executor.submit(_read_object, client, bucket, next_name, skip_unreadable)))
+            data = future.result()
+            if data is not None:
+                yield name, data
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header value that survives non-ASCII names."""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii') or 'download'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+class _UploadPipe:
+    """Bounded byte pipe between a ZIP writer and a MinIO upload thread.
+
+    The writer side buffers into chunks and hands them over a queue; the
+    reader side is the file-like object consumed by `put_object`. `read()`
+    only returns b'' at end of stream, as multipart part slicing expects.
+    """
+
+    _EOF = object()
+
+    def __init__(self, chunk_size: int, max_chunks: int):
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._pending = memoryview(b'')
+        self._eof = False
+        self._aborted = False
+        self.failed: Optional[BaseException] = None
+
+    # Writer side (used by zipfile.ZipFile) -------------------------------
+
+    def write(self, data) -> int:
+        if self._aborted:
+            # Abandoned archive: whatever ZipFile still writes goes nowhere
+            return len(data)
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(self._EOF)
+
+    def _put(self, item):
+        # Never block forever if the upload thread died
+        while True:
+            if self.failed is not None:
+                raise StorageError(f"Archive upload failed: {self.failed}")
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    # Reader side (used by Minio.put_object) ------------------------------
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._pending and not self._eof:
+            item = self._queue.get()
+            if item is self._EOF:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                self._pending = memoryview(item)
+        if not self._pending:
+            return b''
+        if size is None or size < 0:
+            size = len(self._pending)
+        chunk = self._pending[:size].tobytes()
+        self._pending = self._pending[size:]
+        return chunk
+
+    def abort(self, exc: BaseException):
+        self._aborted = True
+        self._buffer.clear()
+        try:
+            self._queue.put_nowait(exc)
+        except queue.Full:
+            # Reader is behind; drop one chunk so the error gets through
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(exc)
+
+
+class StreamingZipUpload:
+    """Write a ZIP archive straight into a MinIO multipart upload.
+
+    Members are appended as they are produced; full parts are shipped by a
+    background thread while the caller keeps writing, so the archive is
+    never held in memory as a whole. Members are stored without compression
+    because PDFs are already compressed.
+    """
+
+    def __init__(self, client: Minio, bucket: str, object_key: str, part_size: Optional[int] = None):
+        self.client = client
+        self.bucket = bucket
+        self.object_key = object_key
+        self.part_size = part_size or settings.ARCHIVE_PART_SIZE
+        self.size = 0
+        self.count = 0
+
+        self._pipe = _UploadPipe(chunk_size=1024 * 1024, max_chunks=max(2, self.part_size // (1024 * 1024)))
+        self._zip = zipfile.ZipFile(self._pipe, 'w', zipfile.ZIP_STORED)
+        self._thread = threading.Thread(target=self._upload, name=f"zip-upload-{object_key}", daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    def _upload(self):
+        try:
+            self.client.put_object(
+                self.bucket,
+                self.object_key,
+                self._pipe,
+                length=-1,
+                part_size=self.part_size,
+                content_type='application/zip',
+            )
+        except BaseException as e:
+            self._pipe.failed = e
+
+    def add(self, filename: str, data: bytes):
+        """Append one member to the archive."""
+        self._zip.writestr(filename, data)
+        self.count += 1
+
+    def complete(self) -> int:
+        """Finish the archive and wait for the upload. Returns the archive size in bytes."""
+        if self._closed:
+            return self.size
+        self._closed = True
+        self._zip.close()
+        self._pipe.finish()
+        self._thread.join()
+        if self._pipe.failed is not None:
+            raise StorageError(f"Archive upload failed: {self._pipe.failed}")
+        self.size = self.client.stat_object(self.bucket, self.object_key).size
+        logger.info(f"✅ Uploaded archive {self.object_key}: {self.count} files, {self.size} bytes")
+        return self.size
+
+    def abort(self):
+        """Abandon the archive; the pending multipart upload is aborted."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pipe.abort(StorageError("archive aborted"))
+        self._thread.join()
+        # Close the writer now, into the aborted pipe; left to the garbage
+        # collector it would write the central directory and raise there
+        try:
+            self._zip.close()
+        except ValueError as e:
+            logger.warning(f"⚠️  Could not close aborted archive {self.object_key}: {e}")
+        logger.info(f"🗑️ Aborted archive upload: {self.object_key}")
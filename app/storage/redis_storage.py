@@ -1,11 +1,36 @@
 import redis.asyncio as redis
 import json
 import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Optional, Dict, Any, List
 
 logger = logging.getLogger(__name__)
 
+# Sorted set of participant ids scored by expiry time (+inf without a TTL), so
+# they can be counted without scanning the keyspace
+PARTICIPANTS_INDEX = "participants:index"
+
+# Drops one reference to each blob (ARGV) in the KEYS[1] hash, never below zero, so a
+# template released twice (concurrent deletes) cannot leave a negative count that a
+# later upload would bring back to zero. Returns the blobs left without references.
+_RELEASE_BLOB_REFS_LUA = """
+local released = {}
+for _, blob in ipairs(ARGV) do
+    if tonumber(redis.call('HGET', KEYS[1], blob) or '0') > 1 then
+        redis.call('HINCRBY', KEYS[1], blob, -1)
+    else
+        redis.call('HSET', KEYS[1], blob, 0)
+        table.insert(released, blob)
+    end
+end
+return released
+"""
+
 _redis_client = None
+# Client of the current redis_session(), if any; takes precedence over _redis_client
+_session_client: ContextVar[Optional[redis.Redis]] = ContextVar('redis_session_client', default=None)
 
 
 async def init_redis(url: str = "redis://redis:6379/0") -> redis.Redis:
@@ -22,13 +47,36 @@ async def init_redis(url: str = "redis://redis:6379/0") -> redis.Redis:
 
 
 async def get_redis() -> redis.Redis:
-    """Get Redis client instance."""
+    """Get Redis client instance (the redis_session() one inside a session)."""
     global _redis_client
+    session_client = _session_client.get()
+    if session_client is not None:
+        return session_client
     if _redis_client is None:
         await init_redis()
     return _redis_client
 
 
+@asynccontextmanager
+async def redis_session(url: str = "redis://redis:6379/0"):
+    """
+    Redis client owned by the running event loop, closed on exit.
+
+    A redis.asyncio client stays bound to the loop it first ran on, so the
+    process-wide client cannot be shared between asyncio.run() calls (each
+    Celery task runs its own loop) or between threads. Code that runs its
+    own loop wraps its work in this context; get_redis(), and so every
+    RedisStorage connected inside it, then uses the session's client.
+    """
+    client = redis.from_url(url, decode_responses=True)
+    token = _session_client.set(client)
+    try:
+        yield client
+    finally:
+        _session_client.reset(token)
+        await client.close()
+
+
 async def close_redis():
     """Close global Redis connection."""
     global _redis_client
@@ -115,10 +163,14 @@ class RedisStorage:
                 await self.connect()
             
             key = f"participant:{participant_id}"
-            if ttl:
-                await self.client.set(key, json.dumps(data), ex=ttl)
-            else:
-                await self.client.set(key, json.dumps(data))
+            expires_at = time.time() + ttl if ttl else float('inf')
+            async with self.client.pipeline(transaction=True) as pipe:
+                if ttl:
+                    pipe.set(key, json.dumps(data), ex=ttl)
+                else:
+                    pipe.set(key, json.dumps(data))
+                pipe.zadd(PARTICIPANTS_INDEX, {participant_id: expires_at})
+                await pipe.execute()
             logger.info(f"Saved participant: {participant_id}")
             return True
         except Exception as e:
@@ -157,6 +209,26 @@ class RedisStorage:
             logger.error(f"Error getting participants: {e}")
             return []
 
+    async def count_participants(self) -> int:
+        """
+        Number of stored participants (without loading them).
+        
+        Reads the participant index: entries whose TTL has passed are trimmed
+        first, so expired participants are not counted.
+        """
+        try:
+            if not self.client:
+                await self.connect()
+            
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.zremrangebyscore(PARTICIPANTS_INDEX, "-inf", time.time())
+                pipe.zcard(PARTICIPANTS_INDEX)
+                _, count = await pipe.execute()
+            return count
+        except Exception as e:
+            logger.error(f"Error counting participants: {e}")
+            raise
+
     async def delete_participant(self, participant_id: str) -> bool:
         """Delete participant from Redis."""
         try:
@@ -164,21 +236,27 @@ class RedisStorage:
                 await self.connect()
             
             key = f"participant:{participant_id}"
-            await self.client.delete(key)
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                pipe.zrem(PARTICIPANTS_INDEX, participant_id)
+                await pipe.execute()
             logger.info(f"Deleted participant: {participant_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting participant: {e}")
             raise
 
-    async def save_batch(self, batch_id: str, data: Dict[str, Any]) -> bool:
-        """Save batch metadata to Redis."""
+    async def save_batch(self, batch_id: str, data: Dict[str, Any], ttl: int = None) -> bool:
+        """Save batch metadata to Redis with optional TTL."""
         try:
             if not self.client:
                 await self.connect()
             
             key = f"batch:{batch_id}"
-            await self.client.set(key, json.dumps(data))
+            if ttl:
+                await self.client.set(key, json.dumps(data), ex=ttl)
+            else:
+                await self.client.set(key, json.dumps(data))
             logger.info(f"Saved batch: {batch_id}")
             return True
         except Exception as e:
@@ -200,6 +278,214 @@ class RedisStorage:
             logger.error(f"Error getting batch: {e}")
             raise
 
+    async def save_batch_manifest(self, batch_id: str, entries: Dict[str, Dict[str, Any]], ttl: int = None) -> bool:
+        """Save batch manifest (participant_id -> object info) as a Redis hash."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            key = f"batch:{batch_id}:manifest"
+            items = list(entries.items())
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.unlink(key)
+                for start in range(0, len(items), 1000):
+                    chunk = items[start:start + 1000]
+                    pipe.hset(key, mapping={pid: json.dumps(entry) for pid, entry in chunk})
+                if ttl:
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            logger.info(f"Saved manifest for batch {batch_id}: {len(items)} entries")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving batch manifest: {e}")
+            raise
+
+    async def get_batch_manifest(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        """Get the whole batch manifest; empty dict if it is not in Redis."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            data = await self.client.hgetall(f"batch:{batch_id}:manifest")
+            return {pid: json.loads(entry) for pid, entry in data.items()}
+        except Exception as e:
+            logger.error(f"Error getting batch manifest: {e}")
+            raise
+
+    async def get_manifest_entry(self, batch_id: str, participant_id: str) -> Optional[Dict[str, Any]]:
+        """Get one participant's entry from the batch manifest."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            data = await self.client.hget(f"batch:{batch_id}:manifest", participant_id)
+            if data:
+                return json.loads(data)
+            return None
+        except Exception as e:
+            logger.error(f"Error getting manifest entry: {e}")
+            raise
+
+    async def delete_batch(self, batch_id: str) -> bool:
+        """Delete batch metadata and manifest from Redis."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            await self.client.unlink(f"batch:{batch_id}", f"batch:{batch_id}:manifest")
+            logger.info(f"Deleted batch: {batch_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting batch: {e}")
+            raise
+
+    async def index_batch(self, batch_id: str, created_at: float) -> bool:
+        """Register a batch in the creation-time index used by the retention sweeper."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            await self.client.zadd("certificate:batches", {batch_id: created_at})
+            return True
+        except Exception as e:
+            logger.error(f"Error indexing batch: {e}")
+            raise
+
+    async def get_batches_created_before(self, timestamp: float, limit: int = 500) -> List[str]:
+        """Get ids of batches created before the given unix timestamp, oldest first."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            return await self.client.zrangebyscore("certificate:batches", "-inf", timestamp, start=0, num=limit)
+        except Exception as e:
+            logger.error(f"Error reading batch index: {e}")
+            raise
+
+    async def unindex_batches(self, batch_ids: List[str]) -> int:
+        """Remove batches from the index and unlink their Redis keys. Returns keys unlinked."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            if not batch_ids:
+                return 0
+            keys = []
+            for batch_id in batch_ids:
+                keys += [f"batch:{batch_id}", f"batch:{batch_id}:manifest"]
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.unlink(*keys)
+                pipe.zrem("certificate:batches", *batch_ids)
+                unlinked, _ = await pipe.execute()
+            return unlinked
+        except Exception as e:
+            logger.error(f"Error unindexing batches: {e}")
+            raise
+
+    async def scan_templates(self) -> List[Dict[str, Any]]:
+        """Get all template metadata with SCAN + MGET. Unlike get_all_templates, errors propagate."""
+        if not self.client:
+            await self.connect()
+        
+        keys = [key async for key in self.client.scan_iter(match="template:*", count=500)]
+        templates = []
+        for start in range(0, len(keys), 500):
+            for data in await self.client.mget(keys[start:start + 500]):
+                if data:
+                    templates.append(json.loads(data))
+        return templates
+
+    async def get_template_upload(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Get the stored result of an earlier upload with the same content digest."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            data = await self.client.get(f"template_blob:{digest}")
+            return json.loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Error getting template upload: {e}")
+            raise
+
+    async def save_template_upload(self, digest: str, data: Dict[str, Any]) -> bool:
+        """Remember which blobs an upload with this content digest produced."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            # Not under template:* so template listings never see it
+            await self.client.set(f"template_blob:{digest}", json.dumps(data))
+            return True
+        except Exception as e:
+            logger.error(f"Error saving template upload: {e}")
+            raise
+
+    async def delete_template_upload(self, digest: str) -> bool:
+        """Forget an upload digest."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            await self.client.unlink(f"template_blob:{digest}")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting template upload: {e}")
+            raise
+
+    async def claim_archive_build(self, batch_id: str, ttl: int) -> bool:
+        """Claim the build of a batch archive; False if another request queued it within `ttl` seconds."""
+        try:
+            if not self.client:
+                await self.connect()
+            
+            return bool(await self.client.set(f"archive_build:{batch_id}", 1, nx=True, ex=ttl))
+        except Exception as e:
+            logger.error(f"Error claiming archive build: {e}")
+            raise
+
+    async def add_blob_refs(self, keys: List[str]) -> bool:
+        """Count one more template referencing each blob."""
+        try:
+            if not self.client:
+                await self.connect()
+            if not keys:
+                return True
+            
+            async with self.client.pipeline(transaction=True) as pipe:
+                for key in keys:
+                    pipe.hincrby("template_blob_refs", key, 1)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error adding blob references: {e}")
+            raise
+
+    async def get_blob_refs(self, key: str) -> int:
+        """Number of templates referencing a blob."""
+        if not self.client:
+            await self.connect()
+        
+        return int(await self.client.hget("template_blob_refs", key) or 0)
+
+    async def release_blob_refs(self, keys: List[str]) -> List[str]:
+        """
+        Drop one reference to each blob.
+        
+        Returns:
+            Blobs no template references any more (safe to delete)
+        """
+        try:
+            if not self.client:
+                await self.connect()
+            if not keys:
+                return []
+            
+            # Zero counts stay in the hash: deleting them here could race with a new upload's HINCRBY
+            return await self.client.eval(_RELEASE_BLOB_REFS_LUA, 1, "template_blob_refs", *keys)
+        except Exception as e:
+            logger.error(f"Error releasing blob references: {e}")
+            raise
+
     async def close(self):
         """Close Redis connection."""
         if self.client:
@@ -0,0 +1,391 @@
+import glob
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+
+from app.config import get_settings
+from app.utils.exceptions import NotFoundError, StorageError
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+TEMPLATE_PREFIX = 'templates'
+
+# Content-addressed template files: templates/blobs/{sha256}{ext}
+BLOBS_DIR = 'blobs'
+# Processed image variants live next to the originals, one folder per DPI
+VARIANTS_DIR = '_optimized'
+
+# Per-template record of the ETag each cached file was downloaded at
+ETAG_INDEX = '.etags.json'
+
+
+def template_key(template_id: str, relative_path: str = 'template.html') -> str:
+    """MinIO key of a template file: templates/{template_id}/{relative_path}."""
+    return f"{TEMPLATE_PREFIX}/{template_id}/{relative_path.replace(os.sep, '/').lstrip('/')}"
+
+
+def is_template_key(content_path: Optional[str]) -> bool:
+    """Whether a stored content_path is a MinIO key (older templates hold a local path)."""
+    return isinstance(content_path, str) and content_path.startswith(f"{TEMPLATE_PREFIX}/")
+
+
+def blob_key(digest: str, ext: str = '') -> str:
+    """MinIO key of a content-addressed template file."""
+    return f"{TEMPLATE_PREFIX}/{BLOBS_DIR}/{digest}{ext.lower()}"
+
+
+def variant_blob_key(source_key: str, dpi: int) -> str:
+    """Key of the processed variant of an image blob; derived from the source, so also immutable."""
+    name = source_key.rsplit('/', 1)[-1]
+    return f"{TEMPLATE_PREFIX}/{BLOBS_DIR}/{VARIANTS_DIR}/{dpi}/{name}"
+
+
+def is_blob_key(content_path: Optional[str]) -> bool:
+    """Whether a key points at a content-addressed blob."""
+    return isinstance(content_path, str) and content_path.startswith(f"{TEMPLATE_PREFIX}/{BLOBS_DIR}/")
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TemplateStore:
+    """
+    Template bodies and assets kept in MinIO, with a read-through disk cache on each node.
+
+    The cache mirrors the bucket layout under TEMPLATES_DIR, so
+    templates/blobs/<sha>.png is cached at TEMPLATES_DIR/blobs/<sha>.png and
+    the absolute image paths written into templates at upload resolve on
+    every node. Template files are stored content-addressed (blobs), which
+    makes cached copies valid forever and lets identical uploads share them.
+
+    Templates stored per folder (templates/{id}/...) are still served; their
+    cached files are validated against the object ETags with one LIST per
+    template, at most every TEMPLATE_CACHE_REVALIDATE seconds.
+    """
+
+    def __init__(self, minio=None, cache_dir: Optional[str] = None):
+        if minio is None:
+            from app.storage.minio_storage import MinIOStorage
+            minio = MinIOStorage()
+        self.minio = minio
+        self.cache_dir = cache_dir or settings.TEMPLATES_DIR
+        self._lock = threading.Lock()
+        self._template_locks: Dict[str, threading.Lock] = {}
+        self._validated_at: Dict[str, float] = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def template_dir(self, template_id: str) -> str:
+        """Local cache folder of a template."""
+        return os.path.join(self.cache_dir, template_id)
+
+    def local_path(self, key: str) -> str:
+        """Cache location of a template object key."""
+        relative = key[len(TEMPLATE_PREFIX) + 1:]
+        root = os.path.abspath(self.cache_dir)
+        path = os.path.abspath(os.path.join(root, relative))
+        if os.path.commonpath([root, path]) != root:
+            raise StorageError(f"Template key escapes the cache directory: {key}")
+        return path
+
+    def _template_lock(self, template_id: str) -> threading.Lock:
+        with self._lock:
+            return self._template_locks.setdefault(template_id, threading.Lock())
+
+    def _load_index(self, template_id: str) -> Dict[str, str]:
+        try:
+            with open(os.path.join(self.template_dir(template_id), ETAG_INDEX), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, template_id: str, index: Dict[str, str]):
+        folder = self.template_dir(template_id)
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = os.path.join(folder, f"{ETAG_INDEX}.{uuid.uuid4().hex}")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(folder, ETAG_INDEX))
+
+    def _record(self, template_id: str, etags: Dict[str, str]):
+        with self._template_lock(template_id):
+            index = self._load_index(template_id)
+            index.update(etags)
+            self._save_index(template_id, index)
+            self._validated_at[template_id] = time.monotonic()
+
+    def put(self, template_id: str, relative_path: str, data: bytes, content_type: Optional[str] = None) -> str:
+        """
+        Store a template file in MinIO and in the local cache.
+
+        Args:
+            template_id: Template the file belongs to
+            relative_path: Path inside the template
+            data: File content
+            content_type: MIME type (guessed from the name if omitted)
+
+        Returns:
+            The object key
+        """
+        key = template_key(template_id, relative_path)
+        content_type = content_type or mimetypes.guess_type(relative_path)[0] or 'application/octet-stream'
+        result = self.minio.client.put_object(
+            self.minio.bucket, key, io.BytesIO(data), length=len(data), content_type=content_type
+        )
+
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._record(template_id, {key: result.etag})
+        logger.info(f"☁️ Stored template file: {key} ({len(data)} bytes)")
+        return key
+
+    def _cache_file(self, key: str, source_path: str, move: bool = False):
+        """Copy (or move) a file into the local cache under `key` unless it is already there."""
+        path = self.local_path(key)
+        if os.path.abspath(source_path) == path or os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if move:
+            os.replace(source_path, path)
+            return
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def put_blob(self, data: bytes, ext: str = '') -> str:
+        """
+        Store bytes content-addressed; identical content is uploaded only once.
+
+        Args:
+            data: File content
+            ext: File extension, kept so renderers can tell the MIME type
+
+        Returns:
+            The blob key
+        """
+        key = blob_key(hashlib.sha256(data).hexdigest(), ext)
+        if not self.minio.object_exists(key):
+            content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+            self.minio.client.put_object(
+                self.minio.bucket, key, io.BytesIO(data), length=len(data), content_type=content_type
+            )
+            logger.info(f"☁️ Stored blob: {key} ({len(data)} bytes)")
+
+        path = self.local_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return key
+
+    def put_blob_file(self, source_path: str, ext: str = '', key: Optional[str] = None, move: bool = False) -> str:
+        """
+        Store a file content-addressed (or under an explicit derived `key`, e.g. a variant).
+
+        Args:
+            source_path: File to store
+            ext: File extension for the key (when `key` is not given)
+            key: Key to store under; callers that already hashed the file pass blob_key(...)
+            move: Move the file into the local cache instead of copying (same filesystem)
+
+        Returns:
+            The blob key
+        """
+        key = key or blob_key(file_digest(source_path), ext)
+        if not self.minio.object_exists(key):
+            content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+            self.minio.client.fput_object(self.minio.bucket, key, source_path, content_type=content_type)
+            logger.info(f"☁️ Stored blob: {key}")
+        self._cache_file(key, source_path, move=move)
+        return key
+
+    def resolve_blob(self, key: str) -> str:
+        """
+        Local path of a blob, downloading it on first use.
+
+        Blobs never change, so a cached copy needs no revalidation.
+
+        Raises:
+            NotFoundError: if the blob does not exist
+        """
+        from minio.error import S3Error
+
+        path = self.local_path(key)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self.minio.client.fget_object(self.minio.bucket, key, tmp_path)
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+                raise NotFoundError(f"Template file not found in MinIO: {key}")
+            raise
+        os.replace(tmp_path, path)
+        return path
+
+    def fetch_template(self, template: Dict[str, Any]) -> str:
+        """
+        Make a template renderable on this node and return the local path of its body.
+
+        Handles content-addressed templates (body and asset blobs), per-template
+        folders in MinIO, and templates that only exist as a local file.
+        """
+        content_path = template.get('content_path')
+        if is_blob_key(content_path):
+            blobs = template.get('blobs') or []
+            if blobs:
+                with ThreadPoolExecutor(max_workers=min(len(blobs), settings.MINIO_FETCH_CONCURRENCY)) as executor:
+                    list(executor.map(self.resolve_blob, blobs))
+            return self.resolve_blob(content_path)
+        if is_template_key(content_path):
+            return self.resolve(content_path)
+        return content_path
+
+    def delete_blobs(self, keys: Iterable[str]) -> int:
+        """Remove blobs no template references any more, with their local copies and derived files."""
+        from minio.deleteobjects import DeleteObject
+
+        keys = list(keys)
+        if not keys:
+            return 0
+        errors = self.minio.client.remove_objects(self.minio.bucket, (DeleteObject(key) for key in keys))
+        for error in errors:
+            logger.error(f"❌ Error deleting {error.name}: {error.message}")
+
+        blobs_root = os.path.join(self.cache_dir, BLOBS_DIR)
+        for key in keys:
+            path = self.local_path(key)
+            name = os.path.basename(path)
+            derived = [os.path.splitext(path)[0] + '.jinjac']
+            derived += glob.glob(os.path.join(blobs_root, VARIANTS_DIR, '*', glob.escape(name)))
+            for local in [path] + derived:
+                if os.path.exists(local):
+                    os.remove(local)
+        logger.info(f"🗑️ Deleted {len(keys)} unreferenced template blobs")
+        return len(keys)
+
+    def materialize(self, template_id: str, force: bool = False) -> str:
+        """
+        Make the local cache of a template match MinIO.
+
+        Only files whose ETag changed since they were cached are downloaded.
+        Files derived locally (compiled templates, image variants at other
+        DPIs) are left alone.
+
+        Args:
+            template_id: Template to sync
+            force: Revalidate even if the cache was checked recently
+
+        Returns:
+            The local template folder
+        """
+        folder = self.template_dir(template_id)
+        with self._template_lock(template_id):
+            validated_at = self._validated_at.get(template_id)
+            if not force and validated_at and time.monotonic() - validated_at < settings.TEMPLATE_CACHE_REVALIDATE:
+                return folder
+
+            index = self._load_index(template_id)
+            prefix = template_key(template_id, '')
+            remote = {
+                obj.object_name: obj.etag
+                for obj in self.minio.client.list_objects(self.minio.bucket, prefix=prefix, recursive=True)
+            }
+            if not remote:
+                raise NotFoundError(f"Template not found in MinIO: {template_id}")
+
+            downloaded = 0
+            for key, etag in remote.items():
+                path = self.local_path(key)
+                if index.get(key) == etag and os.path.exists(path):
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                self.minio.client.fget_object(self.minio.bucket, key, tmp_path)
+                os.replace(tmp_path, path)
+                index[key] = etag
+                downloaded += 1
+
+            for key in [key for key in index if key not in remote]:
+                stale_path = self.local_path(key)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+                del index[key]
+
+            self._save_index(template_id, index)
+            self._validated_at[template_id] = time.monotonic()
+
+        if downloaded:
+            logger.info(f"⬇️ Cached {downloaded}/{len(remote)} files of template {template_id}")
+        return folder
+
+    def resolve(self, key: str) -> str:
+        """
+        Local path of a template object, fetching or refreshing the cache as needed.
+
+        Raises:
+            NotFoundError: if the object does not exist
+        """
+        template_id = key.split('/', 2)[1]
+        self.materialize(template_id)
+        path = self.local_path(key)
+        if not os.path.exists(path):
+            raise NotFoundError(f"Template file not found in MinIO: {key}")
+        return path
+
+    def delete(self, template_id: str) -> int:
+        """Remove a template's objects from MinIO and its local cache; returns objects removed."""
+        from minio.deleteobjects import DeleteObject
+
+        prefix = template_key(template_id, '')
+        keys = [
+            obj.object_name
+            for obj in self.minio.client.list_objects(self.minio.bucket, prefix=prefix, recursive=True)
+        ]
+        if keys:
+            errors = self.minio.client.remove_objects(self.minio.bucket, (DeleteObject(key) for key in keys))
+            for error in errors:
+                logger.error(f"❌ Error deleting {error.name}: {error.message}")
+
+        shutil.rmtree(self.template_dir(template_id), ignore_errors=True)
+        with self._lock:
+            self._validated_at.pop(template_id, None)
+        logger.info(f"🗑️ Deleted template {template_id} from MinIO ({len(keys)} objects)")
+        return len(keys)
+
+
+_store: Optional[TemplateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_template_store() -> TemplateStore:
+    """Process-wide TemplateStore (creating MinIOStorage checks the bucket, so do it once)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TemplateStore()
+    return _store
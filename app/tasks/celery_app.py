@@ -1,13 +1,54 @@
-from celery import Celery
+from typing import Optional
+
+from celery import Celery, Task
+from celery.signals import worker_init
 from app.config import get_settings
 
 settings = get_settings()
 
+
+def _find_payload(value, path: str = 'args'):
+    """Path of the first bytes value inside task arguments, if any."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return path
+    if isinstance(value, (list, tuple)):
+        for i, item in enumerate(value):
+            found = _find_payload(item, f"{path}[{i}]")
+            if found:
+                return found
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            found = _find_payload(item, f"{path}[{key!r}]")
+            if found:
+                return found
+    return None
+
+
+class ClaimCheckTask(Task):
+    """
+    Task base enforcing the claim-check convention.
+
+    Messages carry MinIO object keys and sha256 hashes, never file contents:
+    a PDF in the arguments would sit base64-encoded in the Redis broker (and
+    possibly the result backend) for every queued task. Publishing one
+    raises TypeError instead.
+    """
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        found = _find_payload(args or ()) or _find_payload(kwargs or {}, 'kwargs')
+        if found:
+            raise TypeError(
+                f"{self.name}: binary payload in {found}; store it in MinIO and pass its key and sha256"
+            )
+        return super().apply_async(args, kwargs, **options)
+
+
 # Configure Celery
 celery_app = Celery(
     "certificate_service",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND,
+    task_cls=ClaimCheckTask,
 )
 
 # Configuration
@@ -18,61 +59,197 @@ celery_app.conf.update(
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
+    # Results that are stored are read soon after; don't let them pile up in Redis
+    result_expires=settings.CELERY_RESULT_EXPIRES,
     task_time_limit=30 * 60,  # 30 minutes hard limit
     worker_max_tasks_per_child=1000,
+    # Child processes warm up renderers before reporting alive
+    worker_proc_alive_timeout=60,
+    # Each stage has its own queue so CPU-bound renders, SMTP sends and ZIP
+    # builds scale (and back up) independently; see app/tasks/worker_profiles.py
+    # Redis keeps one list per priority level; 0 is served first
+    # (see batch_priority in app/services/render_pool.py)
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
+    task_default_priority=5,
+    task_routes={
+        'generate_certificates': {'queue': settings.CELERY_RENDER_QUEUE},
+        'send_certificate_email': {'queue': settings.CELERY_EMAIL_QUEUE},
+        'send_certificate_email_from_minio': {'queue': settings.CELERY_EMAIL_QUEUE},
+        'send_certificate_emails_bulk': {'queue': settings.CELERY_EMAIL_QUEUE},
+        'build_batch_archive': {'queue': settings.CELERY_ARCHIVE_QUEUE},
+    },
 )
 
+# A send may wait EMAIL_RATE_LIMIT_TIMEOUT for a rate-limit token before SMTP
+EMAIL_TASK_TIME_LIMIT = settings.EMAIL_RATE_LIMIT_TIMEOUT + 120
+# Also how long a queued archive build keeps the same batch from being queued again
+ARCHIVE_TASK_TIME_LIMIT = 15 * 60
+
 
-# Example task for future use
-@celery_app.task(bind=True, name='send_certificate_email')
-def send_certificate_email_task(self, participant_email: str, certificate_pdf: bytes):
+@worker_init.connect
+def start_worker_render_pool(sender=None, **kwargs):
     """
-    Send certificate via email.
-    
-    This is for future implementation with async email sending.
-    For now, synchronous email sending is used directly in routes.
+    Start and warm the render pool before a render worker consumes its first batch.
+
+    Only for the thread (or solo) pool of the render profile: prefork children
+    would inherit a pool they cannot use. Renders only ever run in the pool's
+    processes, so no other worker or child warms renderers up.
+    """
+    if (
+        settings.WARMUP_ENABLED
+        and 'prefork' not in str(sender.pool_cls).lower()
+        and settings.CELERY_RENDER_QUEUE in sender.app.amqp.queues.consume_from
+    ):
+        from app.services.render_pool import start_render_pool
+        start_render_pool()
+
+
+def _send_stored_certificate(recipient_email: str, object_key: str, filename: str, sha256: Optional[str]):
+    """Redeem a certificate claim check and email it; raises if it could not be sent."""
+    from app.services.email_service import (
+        CERTIFICATE_EMAIL_BODY,
+        CERTIFICATE_EMAIL_SUBJECT,
+        EmailService,
+    )
+
+    ok = EmailService().send_email_with_certificate(
+        to_email=recipient_email,
+        subject=CERTIFICATE_EMAIL_SUBJECT,
+        body_text=CERTIFICATE_EMAIL_BODY,
+        minio_object_name=object_key,
+        filename_for_user=filename,
+        sha256=sha256,
+    )
+    if not ok:
+        raise Exception("Failed to send email via EmailService")
+
+
+# Email tasks are fire-and-forget: nobody reads their results, so none are stored
+@celery_app.task(bind=True, name='send_certificate_email', ignore_result=True,
+                 time_limit=EMAIL_TASK_TIME_LIMIT, soft_time_limit=EMAIL_TASK_TIME_LIMIT - 30)
+def send_certificate_email_task(self, recipient_email: str, minio_object_key: str, filename: str = 'certificate.pdf',
+                                sha256: Optional[str] = None):
+    """
+    Send a stored certificate via email (claim check: key and hash, not the PDF).
+
+    Same arguments, in the same order, as send_certificate_email_from_minio
+    and the (email, key, filename, sha256) email jobs.
+
+    Args:
+        recipient_email: email address to send to
+        minio_object_key: object key of the certificate in MinIO
+        filename: filename for attachment
+        sha256: manifest hash the fetched certificate must match
     """
     try:
-        # TODO: Implement email sending logic
-        return {
-            "status": "sent",
-            "email": participant_email
-        }
-    except Exception as e:
-        # Retry up to 3 times with exponential backoff
-        raise self.retry(exc=e, countdown=60, max_retries=3)
-
-
-# New task: send email with file fetched from MinIO
-@celery_app.task(bind=True, name='send_certificate_email_from_minio')
-def send_certificate_email_from_minio(self, recipient_email: str, minio_object_key: str, filename: str = 'certificate.pdf'):
+        _send_stored_certificate(recipient_email, minio_object_key, filename, sha256)
+        return {"status": "sent", "email": recipient_email}
+    except Exception as exc:
+        raise self.retry(exc=exc, countdown=60, max_retries=3)
+
+
+@celery_app.task(bind=True, name='send_certificate_email_from_minio', ignore_result=True,
+                 time_limit=EMAIL_TASK_TIME_LIMIT, soft_time_limit=EMAIL_TASK_TIME_LIMIT - 30)
+def send_certificate_email_from_minio(self, recipient_email: str, minio_object_key: str, filename: str = 'certificate.pdf',
+                                      sha256: Optional[str] = None):
     """Background task to fetch a certificate from MinIO and send it via SMTP.
 
     Args:
         recipient_email: email address to send to
         minio_object_key: object key in MinIO (e.g., 'batchid/John_123.pdf' or 'templates/..')
         filename: filename for attachment
+        sha256: expected hash of the object (from the batch manifest), checked before sending
     """
     try:
-        from app.services.email_service import EmailService
+        _send_stored_certificate(recipient_email, minio_object_key, filename, sha256)
+        return {"status": "sent", "email": recipient_email}
+    except Exception as exc:
+        # retry with exponential backoff
+        raise self.retry(exc=exc, countdown=60, max_retries=3)
+
 
-        email_service = EmailService()
+@celery_app.task(bind=True, name='send_certificate_emails_bulk', ignore_result=True, time_limit=60 * 60)
+def send_certificate_emails_bulk(self, jobs: list):
+    """Send many certificate emails concurrently from one worker via the async bulk mailer.
 
-        subject = "Your certificate"
-        body = "Hello,\n\nPlease find your certificate attached.\n\nBest regards"
+    Args:
+        jobs: [recipient_email, minio_object_key, filename, sha256] claim checks
+
+    Only the jobs that failed are retried.
+    """
+    import asyncio
+    from app.services.bulk_mailer import BulkMailer
 
-        ok = email_service.send_email_with_certificate(
-            to_email=recipient_email,
-            subject=subject,
-            body_text=body,
-            minio_object_name=minio_object_key,
-            filename_for_user=filename,
+    result = asyncio.run(BulkMailer().send_all(jobs))
+    if result['failed_jobs']:
+        raise self.retry(
+            args=(result['failed_jobs'],),
+            exc=Exception(f"{result['failed']} of {len(jobs)} emails failed"),
+            countdown=60,
+            max_retries=3,
         )
+    return {"status": "sent", "sent": result['sent']}
 
-        if not ok:
-            raise Exception("Failed to send email via EmailService")
 
-        return {"status": "sent", "email": recipient_email}
+@celery_app.task(bind=True, name='generate_certificates', time_limit=30 * 60, soft_time_limit=29 * 60)
+def generate_certificates_task(self, template_id: str, event_name: str, event_location: str, issue_date: str,
+                               build_archive: Optional[bool] = None, template_variants: Optional[dict] = None,
+                               send_email: bool = False, admission_ticket: Optional[dict] = None,
+                               fused_email: bool = False):
+    """Generate a batch in a render worker (the API only enqueues it).
+
+    The result is the generation summary, not the certificates: those are in
+    MinIO under the batch id. The admission ticket taken when the batch was
+    queued is released however the generation ends. With send_email the
+    batch is emailed as it renders (fused_email) or queued for the email
+    workers once stored.
+    """
+    import asyncio
+    import time
+    from app.services.certificate_service import CertificateService
+    from app.storage.redis_storage import redis_session
+
+    async def _generate():
+        async with redis_session():
+            return await _generate_batch()
+
+    async def _generate_batch():
+        service = CertificateService()
+        started = time.perf_counter()
+        rendered = 0
+        try:
+            result = await service.generate_certificates(
+                template_id=template_id,
+                event_name=event_name,
+                event_location=event_location,
+                issue_date=issue_date,
+                build_archive=build_archive,
+                template_variants=template_variants,
+                fused_email=send_email and fused_email,
+            )
+            rendered = result.get('count', 0)
+        finally:
+            await service.release_generation(admission_ticket, rendered, time.perf_counter() - started)
+        if send_email and not fused_email and result.get('batch_id'):
+            result['emails_queued'] = await service.queue_certificate_emails(result['batch_id'])
+        return result
+
+    return asyncio.run(_generate())
+
+
+@celery_app.task(bind=True, name='build_batch_archive', time_limit=ARCHIVE_TASK_TIME_LIMIT)
+def build_batch_archive_task(self, batch_id: str):
+    """Build (or reuse) the ZIP of a batch in MinIO; returns its object key."""
+    from app.services.certificate_service import CertificateService
+    from app.utils.exceptions import NotFoundError
+
+    try:
+        return CertificateService().ensure_batch_archive(batch_id)
+    except NotFoundError:
+        raise
     except Exception as exc:
-        # retry with exponential backoff
-        raise self.retry(exc=exc, countdown=60, max_retries=3)
\ No newline at end of file
+        raise self.retry(exc=exc, countdown=30, max_retries=2)
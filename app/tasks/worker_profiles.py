@@ -0,0 +1,78 @@
+"""
+Celery worker profiles, one per pipeline stage.
+
+Usage:
+    python -m app.tasks.worker_profiles render|email|archive [extra celery worker options]
+
+Options given after the profile name are passed on to `celery worker` and
+override the profile (e.g. `--concurrency=32`).
+"""
+import sys
+from typing import Any, Dict, List
+
+from app.config import get_settings
+
+settings = get_settings()
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # generate_certificates spreads each batch over RENDER_POOL_SIZE render
+    # processes (one per CPU); prefork children are daemonic and cannot start
+    # that pool themselves. Two threads let a small batch run while a large
+    # one is in progress, the render pool being split fairly between them.
+    # Prefetch 1 so batches are not reserved ahead of their priority.
+    'render': {
+        'queues': [settings.CELERY_RENDER_QUEUE],
+        'pool': 'threads',
+        'concurrency': 2,
+        'prefetch_multiplier': 1,
+    },
+    # Sends wait on the network and the rate limiter, not the CPU; threads
+    # share one process's SMTP session pool.
+    'email': {
+        'queues': [settings.CELERY_EMAIL_QUEUE],
+        'pool': 'threads',
+        'concurrency': 16,
+        'prefetch_multiplier': 4,
+    },
+    # ZIP builds stream objects from MinIO and back; a few processes, recycled
+    # regularly since each build handles a whole batch.
+    'archive': {
+        'queues': [settings.CELERY_ARCHIVE_QUEUE],
+        'pool': 'prefork',
+        'concurrency': 2,
+        'prefetch_multiplier': 1,
+        'max_tasks_per_child': 50,
+    },
+}
+
+
+def worker_argv(profile: str, extra: List[str] = ()) -> List[str]:
+    """`celery worker` arguments for a profile."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown worker profile '{profile}', expected one of {sorted(PROFILES)}")
+    options = PROFILES[profile]
+    argv = [
+        'worker',
+        '--loglevel=info',
+        f"--hostname={profile}@%h",
+        f"--queues={','.join(options['queues'])}",
+        f"--pool={options['pool']}",
+        f"--concurrency={options['concurrency']}",
+        f"--prefetch-multiplier={options['prefetch_multiplier']}",
+    ]
+    if options.get('max_tasks_per_child'):
+        argv.append(f"--max-tasks-per-child={options['max_tasks_per_child']}")
+    return argv + list(extra)
+
+
+def main(argv: List[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in PROFILES:
+        raise SystemExit(f"usage: python -m app.tasks.worker_profiles {{{'|'.join(PROFILES)}}} [celery options]")
+
+    from app.tasks.celery_app import celery_app
+    celery_app.worker_main(worker_argv(argv[0], argv[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from app.config import get_settings
+from app.storage.template_store import BLOBS_DIR
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_hits = metrics.counter("asset_cache_hits_total", "Renderer asset cache hits")
+_misses = metrics.counter("asset_cache_misses_total", "Renderer asset cache misses")
+_evictions = metrics.counter("asset_cache_evictions_total", "Renderer asset cache evictions")
+_hit_ratio = metrics.gauge("asset_cache_hit_ratio", "Renderer asset cache hit ratio since start")
+_cached_bytes = metrics.gauge("asset_cache_bytes", "Bytes held by the renderer asset cache")
+
+# Fonts with Cyrillic coverage, in order of preference (fonts-dejavu / fonts-liberation in the image)
+FONT_FAMILIES = {
+    'DejaVuSans': {
+        'normal': ['/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'],
+        'bold': ['/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'],
+        'italic': ['/usr/share/fonts/truetype/dejavu/DejaVuSans-Oblique.ttf'],
+        'boldItalic': ['/usr/share/fonts/truetype/dejavu/DejaVuSans-BoldOblique.ttf'],
+    },
+    'LiberationSans': {
+        'normal': ['/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf'],
+        'bold': ['/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf'],
+        'italic': ['/usr/share/fonts/truetype/liberation/LiberationSans-Italic.ttf'],
+        'boldItalic': ['/usr/share/fonts/truetype/liberation/LiberationSans-BoldItalic.ttf'],
+    },
+}
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values."""
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                _misses.inc(cache=self.name)
+                self._update_ratio()
+                return None
+            self._items.move_to_end(key)
+            _hits.inc(cache=self.name)
+            self._update_ratio()
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+                _evictions.inc(cache=self.name)
+            _cached_bytes.set(self.size, cache=self.name)
+
+    def _update_ratio(self):
+        hits = _hits.get(cache=self.name)
+        total = hits + _misses.get(cache=self.name)
+        _hit_ratio.set(hits / total if total else 0.0, cache=self.name)
+
+
+# One cache per worker process, shared by every renderer in it
+_assets = LRUCache("assets", settings.ASSET_CACHE_MAX_BYTES)
+_fonts_lock = threading.Lock()
+_registered_fonts: Optional[dict] = None
+_image_cache_installed = False
+
+
+def asset_key(path: str) -> Hashable:
+    """
+    Cache identity of a template file.
+
+    Content-addressed blobs (and their derived variants) never change, so
+    their name under the blob store is enough. Any other file is identified
+    by path, mtime and size, so an edited file gets a new key and the old
+    entry simply ages out of the LRU.
+    """
+    path = os.path.abspath(path)
+    relative = os.path.relpath(path, os.path.join(os.path.abspath(settings.TEMPLATES_DIR), BLOBS_DIR))
+    if not relative.startswith('..'):
+        return ('blob', relative)
+    stat = os.stat(path)
+    return ('file', path, stat.st_mtime_ns, stat.st_size)
+
+
+def _local_path(uri: str) -> Optional[str]:
+    """Filesystem path for a file:// URI or absolute path, None for anything remote."""
+    if uri.startswith('file://'):
+        return unquote(urlparse(uri).path)
+    if os.path.isabs(uri):
+        return uri
+    return None
+
+
+def _cached(kind: str, path: str, load: Callable[[bytes], Tuple[Any, int]]) -> Any:
+    """Look up a derived value of a file (see asset_key)."""
+    key = (kind, asset_key(path))
+    value = _assets.get(key)
+    if value is None:
+        with open(path, 'rb') as f:
+            value, size = load(f.read())
+        _assets.put(key, value, size)
+    return value
+
+
+def load_asset_bytes(path: str) -> bytes:
+    """Raw bytes of a template asset."""
+    return _cached('bytes', path, lambda data: (data, len(data)))
+
+
+def xhtml2pdf_link_callback(uri: str, rel: Optional[str] = None) -> str:
+    """
+    link_callback for pisa.CreatePDF: local images are passed as plain paths,
+    which is what the decoded-image cache (install_image_cache) is keyed on.
+    """
+    path = _local_path(uri)
+    if path and os.path.isfile(path) and (mimetypes.guess_type(path)[0] or '').startswith('image/'):
+        return path
+    return uri
+
+
+def install_image_cache():
+    """
+    Make xhtml2pdf reuse decoded template images within this process.
+
+    xhtml2pdf decodes every <img> twice per document (once to size it, once
+    to draw it) and converts it to raw pixels again for each PDF. Its
+    PmlImage.getImage is wrapped so local images return a cached reader,
+    which keeps the decoded image and, after the first draw, its pixel data.
+    Render processes run one document at a time, so readers are never used
+    concurrently. Idempotent.
+    """
+    global _image_cache_installed
+    if _image_cache_installed:
+        return
+    try:
+        from xhtml2pdf.xhtml2pdf_reportlab import PmlImage
+    except ImportError:
+        return
+
+    original = PmlImage.getImage
+
+    def getImage(image):
+        path = _local_path(image.src or '')
+        if not path or not os.path.isfile(path):
+            return original(image)
+        key = ('image', asset_key(path))
+        reader = _assets.get(key)
+        if reader is None:
+            reader = original(image)
+            # The reader names its PDF image after the unread rest of its buffer the
+            # first time it is asked, then after its id. Two PNGs whose decoder stopped
+            # before the same trailing chunk got the same name (and the second was drawn
+            # as the first); settle it now so every cached image keeps a name of its own.
+            str(reader)
+            width, height = reader.getSize()
+            # Decoded RGB(A) pixels, which getRGBData keeps on the reader
+            _assets.put(key, reader, width * height * 4)
+        return reader
+
+    PmlImage.getImage = getImage
+    _image_cache_installed = True
+
+
+def cairosvg_url_fetcher(url: str, resource_type: Optional[str] = None) -> dict:
+    """url_fetcher for cairosvg serving local files from the cache."""
+    path = _local_path(url)
+    if path and os.path.isfile(path):
+        return {'string': load_asset_bytes(path), 'mime_type': mimetypes.guess_type(path)[0]}
+    from cairosvg.url import fetch
+    return fetch(url, resource_type)
+
+
+def register_fonts() -> dict:
+    """
+    Register Cyrillic-capable TTF fonts with reportlab once per process.
+
+    The families are also added to xhtml2pdf's font table, so CSS like
+    `font-family: DejaVuSans` resolves without @font-face parsing per render.
+
+    Returns:
+        Mapping of family name to the registered reportlab font names
+    """
+    global _registered_fonts
+    if _registered_fonts is not None:
+        return _registered_fonts
+
+    with _fonts_lock:
+        if _registered_fonts is not None:
+            return _registered_fonts
+
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.lib.fonts import addMapping
+        from xhtml2pdf import default as xhtml2pdf_default
+
+        registered = {}
+        for family, styles in FONT_FAMILIES.items():
+            names = {}
+            for style, candidates in styles.items():
+                path = next((p for p in candidates if os.path.exists(p)), None)
+                if not path:
+                    continue
+                font_name = family if style == 'normal' else f"{family}-{style}"
+                pdfmetrics.registerFont(TTFont(font_name, path))
+                names[style] = font_name
+            if 'normal' not in names:
+                continue
+            for (bold, italic), style in {(0, 0): 'normal', (1, 0): 'bold', (0, 1): 'italic', (1, 1): 'boldItalic'}.items():
+                addMapping(family, bold, italic, names.get(style, names['normal']))
+            for alias in (family.lower(), family.lower().replace('sans', ' sans')):
+                xhtml2pdf_default.DEFAULT_FONT[alias] = family
+            registered[family] = names
+            logger.info(f"🔤 Registered font family {family}: {sorted(names.values())}")
+
+        _registered_fonts = registered
+        return registered
+
@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.config import get_settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_limit_gauge = metrics.gauge("autotune_limit", "Concurrency chosen by the autotuner per stage")
+_throughput_gauge = metrics.gauge("autotune_throughput", "Operations per second in the last autotuner window")
+_latency_gauge = metrics.gauge("autotune_latency_seconds", "Mean operation latency in the last autotuner window")
+_adjustments = metrics.counter("autotune_adjustments_total", "Autotuner concurrency changes")
+
+
+class AIMDTuner:
+    """
+    Additive-increase / multiplicative-decrease concurrency controller.
+
+    Callers report each finished operation with record(). Every
+    `sample_size` operations the tuner compares the window's throughput
+    and mean latency with the best seen so far:
+
+    - errors, or latency above `latency_tolerance` x the lowest mean latency
+      seen without a throughput gain to show for it: the extra concurrency
+      only queues, so the limit is halved (never below `minimum`);
+    - otherwise, if the stage actually used its whole limit during the
+      window, the limit grows by one (never above `maximum`); a stage held
+      back elsewhere (e.g. uploads waiting on renders) keeps its limit.
+
+    The reference latency and throughput slowly drift towards recent
+    values, so a tuner that has moved on to a heavier template is not
+    judged against a trivial one.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        minimum: int,
+        maximum: int,
+        initial: Optional[int] = None,
+        sample_size: Optional[int] = None,
+        latency_tolerance: float = 1.5,
+    ):
+        self.stage = stage
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self._limit = min(self.maximum, max(self.minimum, initial or self.minimum))
+        self.sample_size = sample_size or settings.AUTOTUNE_SAMPLE_SIZE
+        self.latency_tolerance = latency_tolerance
+        self._lock = threading.Lock()
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._peak_in_use = 0
+        self._window_started = time.monotonic()
+        self._best_throughput = 0.0
+        self._base_latency: Optional[float] = None
+        _limit_gauge.set(self._limit, stage=stage)
+
+    @property
+    def limit(self) -> int:
+        """Concurrency to use now."""
+        return self._limit
+
+    def record(self, latency: float, error: bool = False, in_use: Optional[int] = None):
+        """
+        Report one finished operation.
+
+        Args:
+            latency: Seconds from submission to completion
+            error: The operation failed
+            in_use: Operations that were running alongside it, itself included
+                (None counts as the full limit)
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._peak_in_use = max(self._peak_in_use, self._limit if in_use is None else in_use)
+            if error:
+                self._errors += 1
+            if len(self._latencies) >= self.sample_size:
+                self._adjust()
+
+    def _adjust(self):
+        now = time.monotonic()
+        elapsed = max(now - self._window_started, 1e-6)
+        throughput = len(self._latencies) / elapsed
+        latency = sum(self._latencies) / len(self._latencies)
+        errors = self._errors
+        saturated = self._peak_in_use >= self._limit
+        self._latencies = []
+        self._errors = 0
+        self._peak_in_use = 0
+        self._window_started = now
+
+        if self._base_latency is None:
+            self._base_latency = latency
+        else:
+            self._base_latency = min(latency, self._base_latency * 1.02)
+        improved = throughput > self._best_throughput * 1.05
+        self._best_throughput = max(throughput, self._best_throughput * 0.98)
+
+        old = self._limit
+        congested = latency > self._base_latency * self.latency_tolerance and not improved
+        if errors or congested:
+            self._limit = max(self.minimum, self._limit // 2)
+            reason = f"{errors} errors" if errors else f"latency {latency:.3f}s > {self.latency_tolerance}x {self._base_latency:.3f}s"
+        elif saturated:
+            self._limit = min(self.maximum, self._limit + 1)
+            reason = "throughput ok"
+        else:
+            reason = "limit not reached"
+
+        _throughput_gauge.set(throughput, stage=self.stage)
+        _latency_gauge.set(latency, stage=self.stage)
+        _limit_gauge.set(self._limit, stage=self.stage)
+        if self._limit != old:
+            _adjustments.inc(stage=self.stage, direction='up' if self._limit > old else 'down')
+            logger.info(
+                f"🎛️ Autotune {self.stage}: {old} -> {self._limit} "
+                f"({throughput:.1f}/s, {latency * 1000:.0f} ms, {reason})"
+            )
+
+
+_tuners: Dict[str, AIMDTuner] = {}
+_tuners_lock = threading.Lock()
+
+
+def get_tuner(stage: str, minimum: int, maximum: int, initial: Optional[int] = None) -> AIMDTuner:
+    """
+    Process-wide tuner of a stage, created with these bounds on first use.
+
+    With AUTOTUNE_ENABLED off the tuner is pinned at `initial`.
+    """
+    with _tuners_lock:
+        tuner = _tuners.get(stage)
+        if tuner is None:
+            if not settings.AUTOTUNE_ENABLED:
+                pinned = initial or minimum
+                minimum = maximum = pinned
+            tuner = _tuners[stage] = AIMDTuner(stage, minimum, maximum, initial)
+        return tuner
@@ -27,3 +27,10 @@ class StorageError(ApplicationError):
     """Error with storage operations."""
     pass
 
+
+class OverloadedError(ApplicationError):
+    """Not enough capacity to accept the work now; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -2,7 +2,6 @@ import csv
 import io
 import logging
 from typing import List, Dict, Any
-import openpyxl
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +42,8 @@ def parse_xlsx(file_content: bytes) -> List[Dict[str, Any]]:
     Returns:
         List of dictionaries with parsed data
     """
+    import openpyxl
+
     try:
         # Load workbook from bytes
         wb = openpyxl.load_workbook(io.BytesIO(file_content))
@@ -0,0 +1,125 @@
+import logging
+import os
+import re
+import shutil
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+from app.storage.template_store import VARIANTS_DIR
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Page sizes in inches (portrait)
+PAGE_SIZES = {
+    'A3': (11.69, 16.54),
+    'A4': (8.27, 11.69),
+    'A5': (5.83, 8.27),
+    'LETTER': (8.5, 11.0),
+}
+
+# Formats worth re-encoding; SVG is vector and left alone
+RASTER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+# img src pointing at a variant: (src=")(template folder)/_optimized/<dpi>/(relative path)(")
+_VARIANT_SRC_RE = re.compile(
+    r'(src=["\'])([^"\']+?)/' + VARIANTS_DIR + r'/\d+/([^"\']+)(["\'])',
+    re.IGNORECASE,
+)
+
+
+def max_pixels(dpi: Optional[int] = None, page_size: Optional[str] = None) -> int:
+    """Longest image side that still carries detail on the page at the given DPI."""
+    dpi = dpi or settings.PDF_DPI
+    width, height = PAGE_SIZES.get((page_size or settings.PDF_PAGE_SIZE).upper(), PAGE_SIZES['A4'])
+    return int(max(width, height) * dpi)
+
+
+def variant_path(template_folder: str, relative_path: str, dpi: Optional[int] = None) -> str:
+    """Where the processed variant of a template image is cached."""
+    return os.path.join(template_folder, VARIANTS_DIR, str(dpi or settings.PDF_DPI), relative_path)
+
+
+def optimize_image(source_path: str, dest_path: str, dpi: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Downsample an image to what the page can show at `dpi` and recompress it.
+
+    The original is copied unchanged if processing would not make it smaller.
+
+    Args:
+        source_path: Uploaded image
+        dest_path: Where to write the processed variant
+        dpi: Target resolution (defaults to PDF_DPI)
+
+    Returns:
+        Dict with original_bytes, optimized_bytes, width and height
+    """
+    from PIL import Image, ImageOps
+
+    limit = max_pixels(dpi)
+    original_bytes = os.path.getsize(source_path)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+    with Image.open(source_path) as image:
+        image_format = image.format
+        resized = max(image.size) > limit
+        # Bake EXIF rotation in; the PDF renderers ignore it
+        rotated = image.getexif().get(0x0112, 1) != 1
+        if rotated:
+            image = ImageOps.exif_transpose(image)
+        if resized:
+            image.thumbnail((limit, limit), Image.LANCZOS)
+
+        if image_format == 'JPEG':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            image.save(dest_path, 'JPEG', quality=settings.IMAGE_JPEG_QUALITY, optimize=True)
+        elif image_format == 'PNG':
+            image.save(dest_path, 'PNG', optimize=True)
+        else:
+            image.save(dest_path, image_format)
+        width, height = image.size
+
+    optimized_bytes = os.path.getsize(dest_path)
+    if not resized and not rotated and optimized_bytes >= original_bytes:
+        shutil.copyfile(source_path, dest_path)
+        optimized_bytes = original_bytes
+
+    logger.info(f"🖼️ Optimized {os.path.basename(source_path)}: {original_bytes} → {optimized_bytes} bytes ({width}x{height})")
+    return {
+        'original_bytes': original_bytes,
+        'optimized_bytes': optimized_bytes,
+        'width': width,
+        'height': height,
+    }
+
+
+def get_optimized_image(template_folder: str, relative_path: str, dpi: Optional[int] = None) -> str:
+    """
+    Path of the processed variant for a template image, creating it on first use.
+
+    Falls back to the original file if it cannot be processed.
+    """
+    source = os.path.join(template_folder, relative_path)
+    dest = variant_path(template_folder, relative_path, dpi)
+    try:
+        if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(source):
+            return dest
+        optimize_image(source, dest, dpi)
+        return dest
+    except Exception as e:
+        logger.warning(f"⚠️  Could not optimize {source}, using original: {e}")
+        return source
+
+
+def retarget_image_variants(html: str, dpi: int) -> str:
+    """
+    Point a template's image srcs at the variants for another DPI (e.g. previews).
+
+    Variants are created from the originals on first use and reused afterwards.
+    """
+    def _replace(match):
+        path = get_optimized_image(match.group(2), match.group(3), dpi)
+        return f"{match.group(1)}{os.path.abspath(path)}{match.group(4)}"
+
+    return _VARIANT_SRC_RE.sub(_replace, html)
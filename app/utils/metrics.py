@@ -0,0 +1,121 @@
+import threading
+from typing import Dict, Tuple
+
+_lock = threading.Lock()
+_metrics: Dict[str, "Metric"] = {}
+
+# name -> (kind, help text, {labels: value}), as produced by snapshot()
+Snapshot = Dict[str, Tuple[str, str, Dict[Tuple[Tuple[str, str], ...], float]]]
+
+# Latest snapshot of each live child process (render and preview pools), by child name
+_children: Dict[str, Snapshot] = {}
+# Counters of children that have exited, so totals do not drop when a process is replaced
+_retired: Snapshot = {}
+
+
+class Metric:
+    """In-process counter or gauge with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, kind: str):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[self._key(labels)] = float(value)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> str:
+        with _lock:
+            items = list(self._values.items())
+        return _render(self.name, self.help_text, self.kind, items)
+
+
+def _render(name: str, help_text: str, kind: str, items) -> str:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for key, value in items:
+        label_str = ",".join(f'{k}="{v}"' for k, v in key)
+        lines.append(f"{name}{{{label_str}}} {value:g}" if label_str else f"{name} {value:g}")
+    return "\n".join(lines)
+
+
+def _get_or_create(name: str, help_text: str, kind: str) -> Metric:
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = Metric(name, help_text, kind)
+        return metric
+
+
+def counter(name: str, help_text: str) -> Metric:
+    """Get or register a monotonically increasing counter."""
+    return _get_or_create(name, help_text, "counter")
+
+
+def gauge(name: str, help_text: str) -> Metric:
+    """Get or register a gauge."""
+    return _get_or_create(name, help_text, "gauge")
+
+
+def snapshot() -> Snapshot:
+    """Values of this process's metrics, for a child process to report to its parent."""
+    with _lock:
+        return {
+            name: (metric.kind, metric.help_text, dict(metric._values))
+            for name, metric in _metrics.items() if metric._values
+        }
+
+
+def update_child(child: str, values: Snapshot):
+    """Record the latest snapshot() of a child process."""
+    with _lock:
+        _children[child] = values
+
+
+def retire_child(child: str):
+    """Forget an exited child, keeping its counters in the totals."""
+    with _lock:
+        values = _children.pop(child, None) or {}
+        for name, (kind, help_text, series) in values.items():
+            if kind != "counter":
+                continue
+            totals = _retired.setdefault(name, (kind, help_text, {}))[2]
+            for key, value in series.items():
+                totals[key] = totals.get(key, 0.0) + value
+
+
+def render_metrics() -> str:
+    """
+    All metrics of this process and its child processes in Prometheus exposition format.
+
+    Children's counters are added to this process's (including those of
+    children already replaced); their gauges are reported per process with
+    a `process` label, since e.g. a hit ratio cannot be summed.
+    """
+    with _lock:
+        combined = {name: (m.kind, m.help_text, dict(m._values)) for name, m in _metrics.items()}
+        sources = [(None, _retired)] + list(_children.items())
+        for child, values in sources:
+            for name, (kind, help_text, series) in values.items():
+                totals = combined.setdefault(name, (kind, help_text, {}))[2]
+                for key, value in series.items():
+                    if kind != "counter":
+                        key = tuple(sorted(key + (("process", child),)))
+                    totals[key] = totals.get(key, 0.0) + value
+    return "\n".join(
+        _render(name, help_text, kind, list(series.items()))
+        for name, (kind, help_text, series) in combined.items()
+    ) + "\n"
@@ -1,36 +1,34 @@
 import logging
-from typing import Dict, Any
-from jinja2 import Template
+from typing import Dict, Any, Optional
 from io import BytesIO
 from string import Template as StringTemplate
-import cairosvg
-import requests
 import os
 
+from app.utils.asset_cache import cairosvg_url_fetcher, install_image_cache, register_fonts, xhtml2pdf_link_callback
+from app.utils.image_optimizer import retarget_image_variants
+from app.utils.template_compiler import get_compiled_template
+
 logger = logging.getLogger(__name__)
 
 
-def generate_pdf_from_html(template_html: str, variables: Dict[str, Any]) -> bytes:
+def generate_pdf_from_html(template_html: str, variables: Dict[str, Any], compiled_path: Optional[str] = None) -> bytes:
     """Generate PDF from HTML using PDFEndpoint API with all flags."""
     try:
-        # Render template with Jinja2
-        template = Template(template_html)
+        # Render template with Jinja2 (compiled once per distinct template body)
+        template = get_compiled_template(template_html, compiled_path)
         rendered_html = template.render(**variables)
         
         logger.info(f"📝 Rendered HTML: {len(rendered_html)} chars")
         
         # Ensure UTF-8 meta tag
-        if '<meta charset' not in rendered_html:
-            rendered_html = rendered_html.replace(
-                '<head>',
-                '<head><meta charset="UTF-8"><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">'
-            ) if '<head>' in rendered_html else f'<head><meta charset="UTF-8"><meta http-equiv="Content-Type" content="text/html; charset=UTF-8"></head>{rendered_html}'
+        rendered_html = ensure_utf8_meta(rendered_html)
         
         # Try PDF API with all flags
         pdf_api_key = os.getenv('PDF_API_KEY', '')
         if pdf_api_key:
             try:
                 logger.info("📡 Using PDFEndpoint API with all flags...")
+                import requests
                 
                 payload = {
                     "html": rendered_html,
@@ -69,20 +67,7 @@ def generate_pdf_from_html(template_html: str, variables: Dict[str, Any]) -> byt
         
         # Fallback: xhtml2pdf
         logger.info("Using xhtml2pdf for PDF generation")
-        from xhtml2pdf import pisa
-        
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(
-            BytesIO(rendered_html.encode('utf-8')),
-            pdf_buffer,
-            encoding='UTF-8'
-        )
-        
-        if pisa_status.err:
-            raise Exception(f"xhtml2pdf error: {pisa_status.err}")
-        
-        pdf_buffer.seek(0)
-        pdf_bytes = pdf_buffer.getvalue()
+        pdf_bytes = render_html_with_xhtml2pdf(rendered_html)
         
         logger.info(f"✅ PDF generated with xhtml2pdf: {len(pdf_bytes)} bytes")
         return pdf_bytes
@@ -92,6 +77,37 @@ def generate_pdf_from_html(template_html: str, variables: Dict[str, Any]) -> byt
         raise
 
 
+def ensure_utf8_meta(rendered_html: str) -> str:
+    """Add a UTF-8 charset declaration so Cyrillic text survives the PDF conversion."""
+    if '<meta charset' in rendered_html:
+        return rendered_html
+    meta = '<meta charset="UTF-8"><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">'
+    if '<head>' in rendered_html:
+        return rendered_html.replace('<head>', f'<head>{meta}')
+    return f'<head>{meta}</head>{rendered_html}'
+
+
+def render_html_with_xhtml2pdf(rendered_html: str) -> bytes:
+    """Convert already-rendered HTML to PDF locally with xhtml2pdf."""
+    from xhtml2pdf import pisa
+
+    register_fonts()
+    install_image_cache()
+
+    pdf_buffer = BytesIO()
+    pisa_status = pisa.CreatePDF(
+        BytesIO(rendered_html.encode('utf-8')),
+        pdf_buffer,
+        encoding='UTF-8',
+        link_callback=xhtml2pdf_link_callback
+    )
+
+    if pisa_status.err:
+        raise Exception(f"xhtml2pdf error: {pisa_status.err}")
+
+    return pdf_buffer.getvalue()
+
+
 def generate_pdf_from_html_with_css(template_html: str, variables: Dict[str, Any], css: str = None) -> bytes:
     """Generate PDF with optional CSS."""
     try:
@@ -117,6 +133,8 @@ def create_certificate(svg_template_path: str, data: dict, output_pdf_path: str)
         data (dict): Dictionary with keys matching SVG placeholders, e.g. {'name': 'John Doe', 'date': '2025-11-29'}
         output_pdf_path (str): Path where the generated PDF will be saved
     """
+    import cairosvg
+
     try:
         # Read the SVG template
         with open(svg_template_path, 'r', encoding='utf-8') as f:
@@ -127,11 +145,65 @@ def create_certificate(svg_template_path: str, data: dict, output_pdf_path: str)
         filled_svg = template.substitute(data)
 
         # Convert filled SVG to PDF using CairoSVG
-        cairosvg.svg2pdf(bytestring=filled_svg.encode('utf-8'), write_to=output_pdf_path)
+        cairosvg.svg2pdf(
+            bytestring=filled_svg.encode('utf-8'),
+            write_to=output_pdf_path,
+            url_fetcher=cairosvg_url_fetcher
+        )
         logger.info(f"✅ Created certificate PDF from SVG: {output_pdf_path}")
     except KeyError as ke:
         logger.error(f"Missing placeholder for SVG template: {ke}")
         raise
     except Exception as e:
         logger.exception(f"Failed to create certificate from SVG: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+def render_preview(template_source: str, variables: Dict[str, Any], output_format: str, dpi: int, is_svg: bool = False) -> bytes:
+    """
+    Render one certificate at preview resolution (runs in the preview pool).
+
+    HTML templates are rendered locally with xhtml2pdf, never through the
+    PDF API, using image variants at `dpi`; a PNG is their first page
+    rasterised with pypdfium2. SVG templates go through cairosvg.
+
+    Args:
+        template_source: Template body (Jinja HTML or SVG with ${placeholders})
+        variables: Participant variables
+        output_format: 'pdf' or 'png'
+        dpi: Preview resolution
+        is_svg: Whether the template is SVG
+
+    Returns:
+        Document bytes
+    """
+    if is_svg:
+        import cairosvg
+
+        filled_svg = StringTemplate(template_source).safe_substitute(variables).encode('utf-8')
+        convert = cairosvg.svg2png if output_format == 'png' else cairosvg.svg2pdf
+        return convert(bytestring=filled_svg, dpi=dpi, url_fetcher=cairosvg_url_fetcher)
+
+    template = get_compiled_template(retarget_image_variants(template_source, dpi))
+    pdf_content = render_html_with_xhtml2pdf(ensure_utf8_meta(template.render(**variables)))
+    if output_format == 'png':
+        return rasterize_first_page(pdf_content, dpi)
+    return pdf_content
+
+
+def rasterize_first_page(pdf_content: bytes, dpi: int) -> bytes:
+    """Render the first page of a PDF to PNG at `dpi` (needs pypdfium2)."""
+    import pypdfium2 as pdfium
+
+    document = pdfium.PdfDocument(pdf_content)
+    try:
+        page = document[0]
+        try:
+            bitmap = page.render(scale=dpi / 72)
+            buffer = BytesIO()
+            bitmap.to_pil().save(buffer, format='PNG', optimize=True)
+        finally:
+            page.close()
+    finally:
+        document.close()
+    return buffer.getvalue()
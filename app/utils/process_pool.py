@@ -0,0 +1,304 @@
+import collections
+import logging
+import multiprocessing
+import pickle
+import threading
+import time
+from concurrent.futures import Executor, Future
+from multiprocessing.connection import wait
+from typing import Callable, Deque, Optional, Tuple
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+_killed = metrics.counter("render_workers_killed_total", "Render processes killed and replaced")
+_timeouts = metrics.counter("render_timeouts_total", "Renders stopped for exceeding their time limit")
+
+
+class WorkerCrashedError(RuntimeError):
+    """The process running a task died before returning a result."""
+
+
+def _limit_memory(memory_limit_mb: int):
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, initializer: Optional[Callable], memory_limit_mb: int):
+    """
+    Process body: report ready, then run tasks from `conn` one at a time and
+    send back (ok, value, retire, metrics). Every message carries this
+    process's metrics so the parent can export them.
+    """
+    if initializer is not None:
+        try:
+            initializer()
+        except Exception as e:
+            logger.error(f"❌ Worker initializer failed: {e}", exc_info=True)
+    # After the initializer, so warm-up imports don't count against the task ceiling
+    if memory_limit_mb:
+        _limit_memory(memory_limit_mb)
+    conn.send(metrics.snapshot())
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        fn, args = task
+        retire = False
+        try:
+            response = (True, fn(*args), False, metrics.snapshot())
+        except MemoryError:
+            # The heap may be in any state now; answer and make way for a fresh process
+            retire = True
+            response = (False, MemoryError(f"render exceeded the {memory_limit_mb} MB memory limit"), True, {})
+        except BaseException as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(f"{type(e).__name__}: {e}")
+            response = (False, e, False, metrics.snapshot())
+        try:
+            conn.send(response)
+        except Exception as e:
+            conn.send((False, RuntimeError(f"Unpicklable result: {e}"), False, {}))
+        if retire:
+            return
+
+
+class _Worker:
+    def __init__(self, ctx, initializer, memory_limit_mb: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, initializer, memory_limit_mb), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        # Set once the process has run its initializer; task deadlines start after warm-up
+        self.ready = False
+        self.future: Optional[Future] = None
+        self.deadline = 0.0
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class IsolatedProcessPool(Executor):
+    """
+    Process pool where every task has a hard deadline and a memory ceiling.
+
+    Unlike ProcessPoolExecutor, a process that hangs past `timeout` or dies
+    (killed by the OOM killer, segfault in a C extension) fails only its own
+    task: it is killed and replaced while the other processes carry on.
+    Each process runs one task at a time under an RLIMIT_AS of
+    `memory_limit_mb`; a MemoryError fails the task and recycles the process.
+    Processes are also recycled after `max_tasks_per_worker` tasks.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        timeout: float,
+        memory_limit_mb: int = 0,
+        max_tasks_per_worker: int = 0,
+        initializer: Optional[Callable] = None,
+        name: str = "pool",
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.initializer = initializer
+        self.name = name
+        self._ctx = multiprocessing.get_context('spawn')
+        self._pending: Deque[Tuple[Future, Callable, tuple]] = collections.deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition()
+        self._shutdown = False
+        self._wake_reader, self._wake_writer = self._ctx.Pipe(duplex=False)
+        self._workers = [self._spawn() for _ in range(max_workers)]
+        self._manager = threading.Thread(target=self._run, name=f"{name}-manager", daemon=True)
+        self._manager.start()
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, self.initializer, self.memory_limit_mb)
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(None)
+        except Exception:
+            pass
+
+    def _metrics_name(self, worker: _Worker) -> str:
+        return f"{self.name}:{worker.process.pid}"
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every process has run its initializer.
+
+        Returns:
+            False if some were still starting after `timeout` seconds
+        """
+        with self._ready:
+            return self._ready.wait_for(lambda: all(w.ready for w in self._workers), timeout)
+
+    @property
+    def in_flight(self) -> int:
+        """Tasks submitted and not finished yet: queued plus running."""
+        with self._lock:
+            queued = len(self._pending)
+        return queued + sum(1 for w in self._workers if w.future is not None)
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        if kwargs:
+            raise TypeError("IsolatedProcessPool.submit takes positional arguments only")
+        future: Future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._pending.append((future, fn, args))
+        self._wake()
+        return future
+
+    def _replace(self, index: int, reason: str):
+        worker = self._workers[index]
+        worker.kill()
+        metrics.retire_child(self._metrics_name(worker))
+        if not self._shutdown:
+            self._workers[index] = self._spawn()
+            logger.info(f"♻️ {self.name}: replaced process {worker.process.pid} ({reason})")
+
+    def _dispatch(self):
+        for worker in list(self._workers):
+            if worker.future is not None or not worker.ready:
+                continue
+            if not worker.process.is_alive():
+                index = self._workers.index(worker)
+                _killed.inc(pool=self.name, reason='crashed')
+                self._replace(index, f"died while idle (exit code {worker.process.exitcode})")
+                worker = self._workers[index]
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    future, fn, args = self._pending.popleft()
+                if future.set_running_or_notify_cancel():
+                    break
+            worker.future = future
+            worker.deadline = time.monotonic() + self.timeout
+            worker.tasks += 1
+            try:
+                worker.conn.send((fn, args))
+            except Exception as e:
+                worker.future = None
+                future.set_exception(e)
+
+    def _started(self, index: int):
+        worker = self._workers[index]
+        try:
+            metrics.update_child(self._metrics_name(worker), worker.conn.recv())
+            with self._ready:
+                worker.ready = True
+                self._ready.notify_all()
+        except (EOFError, OSError):
+            _killed.inc(pool=self.name, reason='crashed')
+            self._replace(index, f"died while starting (exit code {worker.process.exitcode})")
+
+    def _collect(self, index: int):
+        worker = self._workers[index]
+        future = worker.future
+        try:
+            ok, value, retire, snapshot = worker.conn.recv()
+        except (EOFError, OSError):
+            code = worker.process.exitcode
+            worker.process.join(1)
+            code = worker.process.exitcode if code is None else code
+            _killed.inc(pool=self.name, reason='crashed')
+            self._replace(index, f"died with exit code {code}")
+            if future is not None:
+                future.set_exception(WorkerCrashedError(f"Render process died (exit code {code})"))
+            return
+
+        worker.future = None
+        if snapshot:
+            metrics.update_child(self._metrics_name(worker), snapshot)
+        if future is not None:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        if retire:
+            _killed.inc(pool=self.name, reason='memory')
+            self._replace(index, "memory limit")
+        elif self.max_tasks_per_worker and worker.tasks >= self.max_tasks_per_worker:
+            self._replace(index, f"{worker.tasks} tasks")
+
+    def _expire(self, now: float):
+        for index, worker in enumerate(self._workers):
+            if worker.future is not None and now >= worker.deadline:
+                future = worker.future
+                worker.future = None
+                _timeouts.inc(pool=self.name)
+                _killed.inc(pool=self.name, reason='timeout')
+                self._replace(index, f"task exceeded {self.timeout}s")
+                future.set_exception(TimeoutError(f"Render took longer than {self.timeout}s"))
+
+    def _run(self):
+        while not self._shutdown:
+            try:
+                self._dispatch()
+                busy = [w for w in self._workers if w.future is not None]
+                starting = [w for w in self._workers if not w.ready]
+                timeout = None
+                if busy:
+                    timeout = max(0.0, min(w.deadline for w in busy) - time.monotonic())
+                ready = wait([self._wake_reader] + [w.conn for w in busy + starting], timeout)
+                if self._wake_reader in ready:
+                    while self._wake_reader.poll():
+                        self._wake_reader.recv()
+                for index, worker in enumerate(list(self._workers)):
+                    if worker.conn not in ready:
+                        continue
+                    if not worker.ready:
+                        self._started(index)
+                    elif worker.future is not None:
+                        self._collect(index)
+                self._expire(time.monotonic())
+            except Exception as e:
+                logger.error(f"❌ {self.name} manager error: {e}", exc_info=True)
+                time.sleep(0.1)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            self._shutdown = True
+            pending = list(self._pending)
+            self._pending.clear()
+        for future, _, _ in pending:
+            if cancel_futures:
+                future.cancel()
+            else:
+                future.set_exception(RuntimeError("pool shut down"))
+        self._wake()
+        if wait:
+            self._manager.join(5)
+        for worker in self._workers:
+            if worker.future is not None and not worker.future.done():
+                worker.future.set_exception(RuntimeError("pool shut down"))
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+            worker.kill()
+            metrics.retire_child(self._metrics_name(worker))
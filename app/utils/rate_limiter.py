@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Refill and take in one round trip. Time comes from the Redis server so
+# workers with skewed clocks still share one consistent bucket.
+# Returns the seconds to wait before the request can succeed (0 = granted).
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+_sync_client = None
+_client_lock = threading.Lock()
+
+
+def get_sync_redis():
+    """Blocking Redis client for Celery workers (the API uses redis.asyncio)."""
+    global _sync_client
+    if _sync_client is None:
+        with _client_lock:
+            if _sync_client is None:
+                import redis
+                _sync_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_client
+
+
+class RedisTokenBucket:
+    """
+    Token bucket shared by every process that uses the same Redis key.
+
+    Tokens refill continuously at `rate_per_minute`; up to `capacity` can be
+    spent in a burst. Used to keep all Celery workers together under the
+    SMTP provider's sending limit.
+    """
+
+    def __init__(self, key: str, rate_per_minute: float, capacity: Optional[float] = None, client=None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.key = key
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate)
+        self.client = client or get_sync_redis()
+        self._script = self.client.register_script(_TOKEN_BUCKET_LUA)
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens if available.
+
+        Returns:
+            0 if granted, otherwise the seconds until enough tokens will have refilled
+        """
+        return float(self._script(keys=[self.key], args=[self.rate, self.capacity, tokens]))
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Block until tokens are granted.
+
+        Args:
+            tokens: Tokens to take
+            timeout: Give up after this many seconds (None waits indefinitely)
+
+        Returns:
+            True if granted, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            logger.debug(f"⏳ Rate limit {self.key}: waiting {wait:.2f}s")
+            # Other workers compete for the same refill, so re-check after the wait
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """acquire() for event loops: the Redis call runs in a thread, waits are asyncio sleeps."""
+        import asyncio
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+_email_limiter: Optional[RedisTokenBucket] = None
+
+
+def email_rate_limiter() -> RedisTokenBucket:
+    """Process-wide limiter enforcing EMAIL_RATE_LIMIT across all workers."""
+    global _email_limiter
+    if _email_limiter is None:
+        _email_limiter = RedisTokenBucket(
+            "ratelimit:email",
+            settings.EMAIL_RATE_LIMIT,
+            capacity=settings.EMAIL_RATE_BURST,
+        )
+    return _email_limiter
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
+
+logger = logging.getLogger(__name__)
+
+# Jinja is imported on first use so processes that never render skip it
+_env: Optional["Environment"] = None
+_strict_env: Optional["Environment"] = None
+
+_cache_lock = threading.Lock()
+_compiled_cache: "OrderedDict[str, Template]" = OrderedDict()
+_COMPILED_CACHE_SIZE = 64
+# A preflight producing more than this many characters is a runaway template
+PREFLIGHT_MAX_OUTPUT = 10 * 1024 * 1024
+
+
+def _get_env(strict: bool = False) -> "Environment":
+    """
+    Shared Jinja environments: the render one (same defaults as jinja2.Template)
+    and a sandboxed StrictUndefined one for preflight, whose range() is capped.
+    """
+    global _env, _strict_env
+    if _env is None:
+        from jinja2 import Environment, StrictUndefined
+        from jinja2.sandbox import SandboxedEnvironment
+        _strict_env = SandboxedEnvironment(undefined=StrictUndefined)
+        _env = Environment()
+    return _strict_env if strict else _env
+
+
+def _artifact_tag() -> bytes:
+    """Compiled artifacts are only valid for the interpreter and Jinja version that wrote them."""
+    import jinja2
+    return f"jinjac:{sys.implementation.cache_tag}:{jinja2.__version__}:".encode('ascii')
+
+
+def template_hash(source: str) -> str:
+    """Content hash identifying a template body."""
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def extract_variables(source: str) -> List[str]:
+    """
+    Find the variables a template expects from its context.
+
+    Args:
+        source: Jinja template source
+
+    Returns:
+        Sorted list of undeclared variable names
+
+    Raises:
+        jinja2.TemplateSyntaxError: if the template does not parse
+    """
+    from jinja2 import meta
+    return sorted(meta.find_undeclared_variables(_get_env().parse(source)))
+
+
+def compiled_path_for(template_path: str) -> str:
+    """Location of the compiled artifact stored next to a template file."""
+    return os.path.splitext(template_path)[0] + '.jinjac'
+
+
+def write_compiled(source: str, path: str) -> str:
+    """
+    Compile a template to Python bytecode and store it on disk.
+
+    Args:
+        source: Jinja template source
+        path: Where to write the artifact
+
+    Returns:
+        The artifact path
+    """
+    code = _get_env().compile(source)
+    # Write-then-rename: identical templates share one artifact and may be written concurrently
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_artifact_tag() + template_hash(source).encode('ascii') + b'\n')
+        marshal.dump(code, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _load_compiled(path: str, source_hash: str) -> Optional["Template"]:
+    """Load a compiled artifact if it matches this interpreter and template body."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            if header != _artifact_tag() + source_hash.encode('ascii') + b'\n':
+                return None
+            code = marshal.load(f)
+        env = _get_env()
+        return env.template_class.from_code(env, code, env.make_globals(None))
+    except (OSError, ValueError, EOFError, TypeError) as e:
+        logger.debug(f"Compiled template unusable at {path}: {e}")
+        return None
+
+
+def get_compiled_template(source: str, compiled_path: Optional[str] = None) -> "Template":
+    """
+    Get a ready-to-render template, compiling each distinct body once per process.
+
+    Args:
+        source: Jinja template source
+        compiled_path: Optional artifact written at upload time, used instead of compiling
+
+    Returns:
+        jinja2.Template
+    """
+    source_hash = template_hash(source)
+    with _cache_lock:
+        template = _compiled_cache.get(source_hash)
+        if template is not None:
+            _compiled_cache.move_to_end(source_hash)
+            return template
+
+    template = None
+    if compiled_path:
+        template = _load_compiled(compiled_path, source_hash)
+    if template is None:
+        template = _get_env().from_string(source)
+
+    with _cache_lock:
+        _compiled_cache[source_hash] = template
+        while len(_compiled_cache) > _COMPILED_CACHE_SIZE:
+            _compiled_cache.popitem(last=False)
+    return template
+
+
+def preflight_render(source: str, variables: Dict[str, Any]) -> int:
+    """
+    Render once with StrictUndefined so missing variables fail immediately.
+
+    The render is sandboxed (range() is capped) and stops once it has produced
+    PREFLIGHT_MAX_OUTPUT characters. It has no time limit of its own: run it in
+    the render pool, which kills it after PDF_TIMEOUT.
+
+    Returns:
+        Length of the rendered document
+
+    Raises:
+        jinja2.UndefinedError: if the template uses a variable not in `variables`
+        jinja2.exceptions.SecurityError: if it uses attributes the sandbox forbids
+        OverflowError: if it calls range() with too many items
+        ValueError: if it renders more than PREFLIGHT_MAX_OUTPUT characters
+    """
+    length = 0
+    for chunk in _get_env(strict=True).from_string(source).generate(**variables):
+        length += len(chunk)
+        if length > PREFLIGHT_MAX_OUTPUT:
+            raise ValueError(f"Template renders more than {PREFLIGHT_MAX_OUTPUT} characters")
+    return length
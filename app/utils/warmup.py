@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_status: Dict[str, Any] = {'state': 'pending', 'duration': None, 'errors': []}
+
+# Small enough to be instant, but touches Jinja, fonts, CSS, tables and text layout
+_DUMMY_TEMPLATE = """<html><head><meta charset="UTF-8"><style>
+body { font-family: DejaVuSans; } td { padding: 4px; }
+</style></head><body>
+<h1>{{ participant_name }}</h1><table><tr><td>{{ event_name }}</td><td>{{ issue_date }}</td></tr></table>
+</body></html>"""
+
+
+def warm_up() -> Dict[str, Any]:
+    """
+    Load renderers and render one dummy certificate so the first real one is not slow.
+
+    Pre-imports xhtml2pdf, reportlab and cairosvg, registers fonts and warms
+    the Jinja environment. Runs once per process; later calls return the
+    recorded status.
+
+    Returns:
+        Warm-up status dict
+    """
+    with _lock:
+        if _status['state'] != 'pending':
+            return dict(_status)
+        _status['state'] = 'running'
+
+    started = time.monotonic()
+    errors = []
+
+    def _step(name, func):
+        try:
+            func()
+        except Exception as e:
+            # A missing optional renderer must not keep the process unready
+            logger.warning(f"⚠️  Warm-up step '{name}' failed: {e}")
+            errors.append(f"{name}: {e}")
+
+    def _import_renderers():
+        import reportlab.pdfgen.canvas  # noqa: F401
+        from xhtml2pdf import pisa  # noqa: F401
+
+    def _import_svg():
+        import cairosvg  # noqa: F401
+
+    def _render_dummy():
+        from app.utils.pdf_generator import render_html_with_xhtml2pdf
+        from app.utils.template_compiler import get_compiled_template
+
+        html = get_compiled_template(_DUMMY_TEMPLATE).render(
+            participant_name='Иван Иванов', event_name='Warm-up', issue_date='2024-01-01'
+        )
+        render_html_with_xhtml2pdf(html)
+
+    def _register_fonts():
+        from app.utils.asset_cache import register_fonts
+        register_fonts()
+
+    _step('import_renderers', _import_renderers)
+    _step('import_svg', _import_svg)
+    _step('register_fonts', _register_fonts)
+    _step('render_dummy', _render_dummy)
+
+    with _lock:
+        _status.update(state='ready', duration=round(time.monotonic() - started, 3), errors=errors)
+    logger.info(f"🔥 Renderer warm-up finished in {_status['duration']}s ({len(errors)} errors)")
+    return dict(_status)
+
+
+def mark_ready(**details):
+    """
+    Declare the process ready to serve (/ready answers 200 from now on).
+
+    Args:
+        details: Added to the warm-up status, e.g. the render pool's start-up
+    """
+    with _lock:
+        if _status['state'] == 'pending':
+            _status['state'] = 'skipped'
+        _status.update(details)
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def warmup_status() -> Dict[str, Any]:
+    with _lock:
+        return dict(_status)
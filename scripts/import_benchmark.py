@@ -0,0 +1,98 @@
+"""
+Measure how long importing the API takes, using `python -X importtime`.
+
+Usage:
+    python scripts/import_benchmark.py [--module app.main] [--repeat 5] [--top 15]
+
+Exits with status 1 if any of the heavy subsystems that should load on demand
+(renderers, spreadsheet parser, object storage client, HTTP client) got imported.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+HEAVY_MODULES = (
+    'cairosvg',
+    'xhtml2pdf',
+    'reportlab',
+    'openpyxl',
+    'minio',
+    'requests',
+    'jinja2',
+    'PIL',
+)
+
+LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once(module: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Import `module` in a fresh interpreter; returns (self_us, cumulative_us) per top-level entry."""
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"❌ Importing {module} failed")
+
+    self_times: Dict[str, int] = {}
+    cumulative: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        self_times[name] = int(self_us)
+        cumulative[name] = int(cumulative_us)
+    return self_times, cumulative
+
+
+def heavy_imported(modules: List[str]) -> List[str]:
+    """Heavy packages (or their submodules) present in an import trace."""
+    return sorted({
+        heavy for heavy in HEAVY_MODULES
+        for name in modules
+        if name == heavy or name.startswith(heavy + '.')
+    })
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', default='app.main', help='Module to import (default: app.main)')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to average over')
+    parser.add_argument('--top', type=int, default=15, help='How many of the slowest modules to list')
+    args = parser.parse_args()
+
+    totals = []
+    self_times: Dict[str, int] = {}
+    cumulative: Dict[str, int] = {}
+    for _ in range(args.repeat):
+        self_times, cumulative = run_once(args.module)
+        totals.append(cumulative.get(args.module, 0))
+
+    print(f"⏱️  import {args.module}: median {statistics.median(totals) / 1000:.1f} ms "
+          f"(min {min(totals) / 1000:.1f} ms, max {max(totals) / 1000:.1f} ms, {args.repeat} runs)")
+
+    print(f"\nSlowest {args.top} modules by self time (last run):")
+    for name, us in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    heavy = heavy_imported(list(cumulative))
+    if heavy:
+        print(f"\n❌ Heavy modules imported eagerly: {', '.join(heavy)}")
+        return 1
+    print("\n✅ No heavy modules imported eagerly")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Compare sending certificate emails over a new SMTP connection per message
+against the pooled sessions of EmailService, using a local aiosmtpd sink.
+
+Usage:
+    python scripts/smtp_benchmark.py [--messages 300] [--threads 4] [--latency 0.02]
+
+--latency delays every connection greeting and AUTH exchange to mimic the
+round trips (and TLS handshake) of a remote provider; the sink itself is
+local, so without it only the protocol overhead is measured. Requires the
+aiosmtpd dev dependency.
+"""
+import argparse
+import logging
+import os
+import smtplib
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiosmtpd.controller import Controller  # noqa: E402
+from aiosmtpd.smtp import SMTP, AuthResult  # noqa: E402
+
+from app.services.email_service import SMTPConnectionPool  # noqa: E402
+
+# aiosmtpd logs a warning about its own deprecated attribute on every AUTH
+logging.getLogger('mail.log').setLevel(logging.ERROR)
+
+HOST = '127.0.0.1'
+USER = 'bench'
+PASSWORD = 'bench'
+
+
+class SinkHandler:
+    """Accepts and discards every message."""
+
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return '250 OK'
+
+
+class SlowHandshakeSMTP(SMTP):
+    """aiosmtpd server that pays `latency` on connect and on AUTH."""
+
+    latency = 0.0
+
+    async def _sleep(self):
+        if self.latency:
+            import asyncio
+            await asyncio.sleep(self.latency)
+
+    async def smtp_EHLO(self, hostname):
+        await self._sleep()
+        return await super().smtp_EHLO(hostname)
+
+    async def smtp_AUTH(self, arg):
+        await self._sleep()
+        return await super().smtp_AUTH(arg)
+
+
+class SinkController(Controller):
+    def factory(self):
+        return SlowHandshakeSMTP(
+            self.handler,
+            auth_require_tls=False,
+            authenticator=lambda *args: AuthResult(success=True),
+        )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def build_message(index: int, attachment: bytes) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = 'noreply@example.com'
+    msg['To'] = f'participant{index}@example.com'
+    msg['Subject'] = 'Certificate'
+    msg.attach(MIMEText('Your certificate is attached.', 'plain', 'utf-8'))
+    part = MIMEApplication(attachment, _subtype='pdf')
+    part.add_header('Content-Disposition', 'attachment', filename='certificate.pdf')
+    msg.attach(part)
+    return msg
+
+
+def send_with_new_connection(port: int, msg) -> None:
+    with smtplib.SMTP(HOST, port, timeout=30) as server:
+        server.login(USER, PASSWORD)
+        server.send_message(msg)
+
+
+def run(label: str, send, messages: list, threads: int) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, messages))
+    elapsed = time.perf_counter() - started
+    rate = len(messages) / elapsed
+    print(f"{label:<28} {len(messages):>6} msgs  {elapsed:>7.2f}s  {rate:>8.1f} msgs/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=4, help='concurrent senders (and pool size)')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to EHLO and AUTH')
+    parser.add_argument('--max-sends', type=int, default=100, help='messages before a pooled session is recycled')
+    parser.add_argument('--attachment-kb', type=int, default=200)
+    args = parser.parse_args()
+
+    SlowHandshakeSMTP.latency = args.latency
+    handler = SinkHandler()
+    port = free_port()
+    controller = SinkController(handler, hostname=HOST, port=port)
+    controller.start()
+
+    attachment = os.urandom(args.attachment_kb * 1024)
+    messages = [build_message(i, attachment) for i in range(args.messages)]
+
+    try:
+        baseline = run("new connection per message", lambda msg: send_with_new_connection(port, msg),
+                       messages, args.threads)
+        pool = SMTPConnectionPool(
+            HOST, port, use_tls=False, user=USER, password=PASSWORD,
+            size=args.threads, max_sends=args.max_sends,
+        )
+        pooled = run("pooled sessions", pool.send_message, messages, args.threads)
+        pool.close()
+    finally:
+        controller.stop()
+
+    print(f"\nSpeedup: {pooled / baseline:.2f}x  (sink received {handler.received} messages)")
+    if handler.received != 2 * args.messages:
+        raise SystemExit("❌ Some messages were not delivered")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services import admission
+from app.utils.exceptions import OverloadedError
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(admission, 'get_sync_redis', lambda: client)
+    monkeypatch.setattr(admission, '_get_broker_redis', lambda: client)
+    monkeypatch.setattr(admission, 'render_load', lambda: {'active_batches': 0, 'in_flight': 0, 'pool_size': 2})
+    monkeypatch.setattr(admission.settings, 'ADMISSION_ENABLED', True)
+    monkeypatch.setattr(admission.settings, 'ADMISSION_MAX_BACKLOG', 1000)
+    monkeypatch.setattr(admission.settings, 'ADMISSION_MAX_ACTIVE_BATCHES', 2)
+    monkeypatch.setattr(admission.settings, 'ADMISSION_MAX_QUEUED_BATCHES', 3)
+    monkeypatch.setattr(admission.settings, 'RENDER_INTERACTIVE_MAX', 50)
+    return client
+
+
+def test_tickets_hold_backlog_until_released(redis_client):
+    first = admission.admit(600)
+    second = admission.admit(300)
+    assert first['id'] and second['id'] and first['id'] != second['id']
+    assert admission.backlog() == 900
+
+    admission.release(first)
+    assert admission.backlog() == 300
+    # Releasing twice does not give capacity back twice
+    admission.release(first)
+    assert admission.backlog() == 300
+    admission.release(second)
+    assert admission.backlog() == 0
+
+
+def test_rejects_batches_over_the_backlog(redis_client):
+    admission.admit(800)
+    with pytest.raises(OverloadedError) as raised:
+        admission.admit(300)
+    # 100 certificates over the limit at the default rate
+    assert raised.value.retry_after == 10
+    assert admission.backlog() == 800
+
+
+def test_oversized_batch_is_admitted_on_an_empty_backlog(redis_client):
+    ticket = admission.admit(5000)
+    assert ticket['id']
+    assert admission.backlog() == 5000
+
+
+def test_interactive_batches_are_always_admitted(redis_client):
+    admission.admit(1000)
+    ticket = admission.admit(10)
+    assert ticket['id']
+    assert admission.backlog() == 1010
+
+
+def test_rejects_when_too_many_batches_generate(redis_client, monkeypatch):
+    monkeypatch.setattr(admission, 'render_load', lambda: {'active_batches': 2, 'in_flight': 8, 'pool_size': 2})
+    with pytest.raises(OverloadedError):
+        admission.admit(100)
+    # Background batches are limited by the render queue instead
+    assert admission.admit(100, background=True)['id']
+
+
+def test_rejects_background_batches_when_the_queue_is_full(redis_client):
+    redis_client.rpush('render', 'a')
+    redis_client.rpush('render:3', 'b', 'c')
+    assert admission.render_queue_depth() == 3
+    with pytest.raises(OverloadedError):
+        admission.admit(100, background=True)
+    assert admission.backlog() == 0
+
+
+def test_release_feeds_the_render_rate(redis_client):
+    admission.release(admission.admit(100), rendered=100, elapsed=10.0)
+    assert admission.render_rate() == pytest.approx(10.0)
+    admission.release(admission.admit(100), rendered=100, elapsed=5.0)
+    assert admission.render_rate() == pytest.approx(0.7 * 10.0 + 0.3 * 20.0)
+
+
+def test_release_ignores_tickets_without_id(redis_client):
+    admission.release(None)
+    admission.release({'id': None, 'size': 100})
+    assert admission.backlog() == 0
+
+
+def test_admits_without_ticket_when_redis_is_down(redis_client, monkeypatch):
+    def _down():
+        raise ConnectionError("redis is down")
+    monkeypatch.setattr(admission, 'get_sync_redis', _down)
+    ticket = admission.admit(100)
+    assert ticket == {'id': None, 'size': 100}
+    admission.release(ticket)
+
+
+def test_disabled_admission_hands_out_empty_tickets(redis_client, monkeypatch):
+    monkeypatch.setattr(admission.settings, 'ADMISSION_ENABLED', False)
+    assert admission.admit(10 ** 6) == {'id': None, 'size': 10 ** 6}
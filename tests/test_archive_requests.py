@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from minio.error import S3Error
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services.certificate_service import CertificateService, archive_key
+from app.storage.redis_storage import RedisStorage
+from app.tasks import celery_app
+
+
+class _FakeMinio:
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+
+    def stat_object(self, bucket, key):
+        if key not in self.keys:
+            raise S3Error(None, 'NoSuchKey', 'missing', key, 'request', 'host')
+        return SimpleNamespace(size=1)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    queued = []
+    monkeypatch.setattr(
+        celery_app.build_batch_archive_task, 'apply_async',
+        lambda args: queued.append(args) or SimpleNamespace(id=f"task-{len(queued)}"),
+    )
+    service = CertificateService.__new__(CertificateService)
+    service.storage = RedisStorage()
+    service.storage.client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    service.minio_client = _FakeMinio()
+    service.queued = queued
+    return service
+
+
+def test_prebuilt_archive_from_the_batch_record(service):
+    asyncio.run(service.storage.save_batch('b1', {'id': 'b1', 'archive_key': 'archives/b1.zip'}))
+    assert asyncio.run(service.request_batch_archive('b1')) == 'archives/b1.zip'
+    assert service.queued == []
+
+
+def test_archive_already_in_minio(service):
+    service.minio_client.keys.add(archive_key('b1'))
+    assert asyncio.run(service.request_batch_archive('b1')) == archive_key('b1')
+    assert service.queued == []
+
+
+def test_missing_archive_is_queued_once(service):
+    assert asyncio.run(service.request_batch_archive('b1')) is None
+    assert asyncio.run(service.request_batch_archive('b1')) is None
+    assert service.queued == [('b1',)]
+    # Ready once the archive worker has stored it
+    service.minio_client.keys.add(archive_key('b1'))
+    assert asyncio.run(service.request_batch_archive('b1')) == archive_key('b1')
@@ -0,0 +1,85 @@
+import pytest
+
+from app.services import render_pool
+from app.services.render_pool import RenderShare
+from app.utils.autotune import AIMDTuner
+
+
+def _window(tuner: AIMDTuner, latency: float = 0.1, error: bool = False, in_use=None):
+    """Record one full sample window."""
+    for _ in range(tuner.sample_size):
+        tuner.record(latency, error=error, in_use=in_use)
+
+
+def test_grows_by_one_when_limit_is_used():
+    tuner = AIMDTuner('test', minimum=1, maximum=10, initial=4, sample_size=5)
+    _window(tuner, in_use=4)
+    assert tuner.limit == 5
+    _window(tuner, in_use=5)
+    assert tuner.limit == 6
+
+
+def test_holds_when_limit_is_not_reached():
+    tuner = AIMDTuner('test', minimum=1, maximum=10, initial=4, sample_size=5)
+    _window(tuner, in_use=3)
+    assert tuner.limit == 4
+
+
+def test_halves_on_errors():
+    tuner = AIMDTuner('test', minimum=1, maximum=10, initial=8, sample_size=5)
+    tuner.record(0.1, error=True, in_use=8)
+    _window(tuner, in_use=8)
+    assert tuner.limit == 4
+
+
+def test_halves_when_latency_rises_without_throughput_gain():
+    tuner = AIMDTuner('test', minimum=1, maximum=10, initial=8, sample_size=5)
+    _window(tuner, latency=0.1, in_use=8)
+    assert tuner.limit == 9
+    # Ten times the latency with no throughput gain to show for it
+    tuner._best_throughput = float('inf')
+    _window(tuner, latency=1.0, in_use=9)
+    assert tuner.limit == 4
+
+
+def test_stays_within_bounds():
+    tuner = AIMDTuner('test', minimum=2, maximum=3, initial=3, sample_size=5)
+    _window(tuner, in_use=3)
+    assert tuner.limit == 3
+    _window(tuner, error=True)
+    assert tuner.limit == 2
+    _window(tuner, error=True)
+    assert tuner.limit == 2
+
+
+@pytest.fixture
+def shared_window(monkeypatch):
+    tuner = AIMDTuner('render-test', minimum=1, maximum=16, initial=8, sample_size=4)
+    monkeypatch.setattr(render_pool, 'render_tuner', lambda: tuner)
+    first, second = RenderShare('a', interactive=False), RenderShare('b', interactive=False)
+    monkeypatch.setitem(render_pool._shares, id(first), first)
+    monkeypatch.setitem(render_pool._shares, id(second), second)
+    return tuner, first, second
+
+
+def test_bulk_batches_split_the_window(shared_window):
+    tuner, first, second = shared_window
+    assert first.limit(0) == 4
+    assert second.limit(0) == 4
+
+
+def test_window_grows_when_fed_pool_wide_in_flight(shared_window):
+    # Both batches hold their whole share: the pool has the full window in flight
+    tuner, first, second = shared_window
+    first.limit(4)
+    second.limit(4)
+    _window(tuner, in_use=first.in_flight + second.in_flight)
+    assert tuner.limit == 9
+
+
+def test_window_never_grows_from_one_share(shared_window):
+    # What the tuner would see if each batch reported only its own renders
+    tuner, first, second = shared_window
+    _window(tuner, in_use=first.limit(4))
+    _window(tuner, in_use=second.limit(4))
+    assert tuner.limit == 8
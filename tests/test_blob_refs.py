@@ -0,0 +1,113 @@
+import asyncio
+import os
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services import template_service
+from app.services.template_service import TemplateService
+from app.storage.redis_storage import RedisStorage
+from app.storage.template_store import TemplateStore, blob_key
+
+BODY = blob_key('a' * 64, '.html')
+LOGO = blob_key('b' * 64, '.png')
+STAMP = blob_key('c' * 64, '.png')
+
+
+class _FakeMinio:
+    bucket = 'certificates'
+
+    def __init__(self):
+        self.client = self
+        self.removed = []
+
+    def remove_objects(self, bucket, objects):
+        self.removed += [obj.name for obj in objects]
+        return []
+
+
+def _run(test):
+    """Run an async test body against a fresh in-memory Redis."""
+    async def _main():
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        try:
+            return await test(client)
+        finally:
+            await client.aclose()
+    return asyncio.run(_main())
+
+
+def _storage(client) -> RedisStorage:
+    storage = RedisStorage()
+    storage.client = client
+    return storage
+
+
+def test_release_returns_blobs_only_at_zero():
+    async def _test(client):
+        storage = _storage(client)
+        await storage.add_blob_refs([BODY, LOGO])
+        await storage.add_blob_refs([BODY])
+
+        assert await storage.release_blob_refs([BODY, LOGO]) == [LOGO]
+        assert await storage.get_blob_refs(BODY) == 1
+        assert await storage.release_blob_refs([BODY]) == [BODY]
+        assert await storage.get_blob_refs(BODY) == 0
+        assert await storage.release_blob_refs([]) == []
+    _run(_test)
+
+
+def test_double_release_does_not_go_negative():
+    async def _test(client):
+        storage = _storage(client)
+        await storage.add_blob_refs([LOGO])
+        assert await storage.release_blob_refs([LOGO]) == [LOGO]
+        # A second delete of the same template releases it again
+        assert await storage.release_blob_refs([LOGO]) == [LOGO]
+        assert await storage.get_blob_refs(LOGO) == 0
+        # So the next template to use the blob really holds a reference
+        await storage.add_blob_refs([LOGO])
+        assert await storage.get_blob_refs(LOGO) == 1
+    _run(_test)
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    store = TemplateStore(minio=_FakeMinio(), cache_dir=str(tmp_path))
+    monkeypatch.setattr(template_service, 'get_template_store', lambda: store)
+    monkeypatch.setattr(template_service, 'TEMPLATES_DIR', str(tmp_path))
+    for key in (BODY, LOGO, STAMP):
+        path = store.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+    return TemplateService(), store
+
+
+def test_delete_template_keeps_shared_blobs(service):
+    service, store = service
+
+    async def _test(client):
+        service.storage.client = client
+        first = {'id': 'first', 'content_path': BODY, 'blobs': [LOGO, STAMP], 'upload_digest': 'd1'}
+        second = {'id': 'second', 'content_path': BODY, 'blobs': [LOGO], 'upload_digest': 'd1'}
+        for template in (first, second):
+            await service.storage.save_template(template['id'], template)
+            await service.storage.add_blob_refs(template_service.blob_refs(template))
+        await service.storage.save_template_upload('d1', {'content_path': BODY})
+
+        # Only the stamp was unique to the first template
+        assert await service.delete_template('first')
+        assert store.minio.removed == [STAMP]
+        assert not os.path.exists(store.local_path(STAMP))
+        assert os.path.exists(store.local_path(LOGO))
+        assert await service.storage.get_template('first') is None
+        assert await service.storage.get_template_upload('d1') is not None
+
+        # The last reference takes the remaining blobs and the dedupe entry with it
+        assert await service.delete_template('second')
+        assert sorted(store.minio.removed) == sorted([STAMP, BODY, LOGO])
+        assert not os.path.exists(store.local_path(BODY))
+        assert await service.storage.get_template_upload('d1') is None
+    _run(_test)
@@ -0,0 +1,30 @@
+import io
+
+import pytest
+
+pytest.importorskip("pypdfium2")
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app.utils.pdf_generator import rasterize_first_page
+
+
+def _pdf(pages: int) -> bytes:
+    buffer = io.BytesIO()
+    document = canvas.Canvas(buffer, pagesize=A4)
+    for number in range(pages):
+        document.drawString(72, 720, f"Page {number + 1}")
+        document.showPage()
+    document.save()
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("dpi", [72, 144])
+def test_first_page_is_rasterised_at_dpi(dpi):
+    png = rasterize_first_page(_pdf(pages=2), dpi)
+    image = Image.open(io.BytesIO(png))
+    assert image.format == 'PNG'
+    # Page size in points scaled to pixels, give or take rounding
+    for pixels, points in zip(image.size, A4):
+        assert abs(pixels - points * dpi / 72) <= 1
@@ -0,0 +1,112 @@
+import os
+import time
+
+import pytest
+
+from app.utils.process_pool import IsolatedProcessPool, WorkerCrashedError
+
+
+def _pid(delay: float = 0.0) -> int:
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _fail():
+    raise ValueError("bad template")
+
+
+def _crash():
+    os._exit(3)
+
+
+def _allocate(mb: int) -> int:
+    return len(bytearray(mb * 1024 * 1024))
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def _make(**kwargs):
+        options = {'max_workers': 1, 'timeout': 5, 'name': 'test'}
+        options.update(kwargs)
+        pool = IsolatedProcessPool(**options)
+        pools.append(pool)
+        assert pool.wait_ready(30)
+        return pool
+
+    yield _make
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+def test_runs_tasks_and_propagates_errors(make_pool):
+    pool = make_pool()
+    assert pool.submit(_pid).result(10) != os.getpid()
+    with pytest.raises(ValueError, match="bad template"):
+        pool.submit(_fail).result(10)
+    # The process survives an ordinary exception
+    assert pool.submit(_pid).result(10) == pool.submit(_pid).result(10)
+
+
+def test_timeout_kills_only_the_stuck_task(make_pool):
+    pool = make_pool(max_workers=2, timeout=1)
+    stuck = pool.submit(_pid, 30)
+    quick = pool.submit(_pid, 0.2)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        stuck.result(10)
+    assert time.monotonic() - started < 5
+    assert quick.result(10)
+    # The killed process is replaced and the pool keeps serving
+    assert pool.wait_ready(30)
+    futures = [pool.submit(_pid, 0.3) for _ in range(2)]
+    assert len({future.result(10) for future in futures}) == 2
+
+
+def test_crashed_process_is_replaced(make_pool):
+    pool = make_pool()
+    before = pool.submit(_pid).result(10)
+    with pytest.raises(WorkerCrashedError):
+        pool.submit(_crash).result(10)
+    assert pool.wait_ready(30)
+    after = pool.submit(_pid).result(10)
+    assert after != before
+
+
+def test_processes_are_recycled_after_max_tasks(make_pool):
+    pool = make_pool(max_tasks_per_worker=2)
+    pids = [pool.submit(_pid).result(10) for _ in range(4)]
+    assert pids[0] == pids[1]
+    assert pids[2] == pids[3]
+    assert pids[1] != pids[2]
+
+
+def test_memory_limit_fails_the_task_and_recycles(make_pool):
+    pool = make_pool(memory_limit_mb=1024)
+    before = pool.submit(_pid).result(10)
+    with pytest.raises(MemoryError):
+        pool.submit(_allocate, 2048).result(10)
+    assert pool.wait_ready(30)
+    assert pool.submit(_allocate, 16).result(10) == 16 * 1024 * 1024
+    assert pool.submit(_pid).result(10) != before
+
+
+def test_in_flight_counts_queued_and_running(make_pool):
+    pool = make_pool()
+    futures = [pool.submit(_pid, 0.5) for _ in range(3)]
+    assert pool.in_flight == 3
+    for future in futures:
+        future.result(10)
+    assert pool.in_flight == 0
+
+
+def test_shutdown_fails_pending_tasks(make_pool):
+    pool = make_pool()
+    running = pool.submit(_pid, 0.5)
+    queued = pool.submit(_pid)
+    pool.shutdown(wait=True, cancel_futures=True)
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        pool.submit(_pid)
+    assert running.done()
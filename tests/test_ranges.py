@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from minio.error import S3Error
+
+from app.api.v1.endpoints.certificates import _parse_range, _ranged_object_response, _serve_object
+from app.utils.exceptions import NotFoundError
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-19", (10, 19)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=99-99", (99, 99)),
+    # An end past the object is clamped
+    ("bytes=50-500", (50, 99)),
+    # Suffix ranges: the last N bytes, or all of them
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert _parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "items=0-10",
+    # Multiple ranges are not supported: the whole object is sent
+    "bytes=0-10,20-30",
+    "bytes=a-b",
+    "bytes=-",
+    # Invalid spec (last before first): ignored, as RFC 7233 asks
+    "bytes=20-10",
+])
+def test_ignored_ranges(header):
+    assert _parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=100-", 100),
+    ("bytes=150-200", 100),
+    ("bytes=-0", 100),
+    ("bytes=0-", 0),
+])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(HTTPException) as raised:
+        _parse_range(header, size)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+class _FakeObject:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.closed = False
+
+    def stream(self, amt):
+        for start in range(0, len(self.data), amt):
+            yield self.data[start:start + amt]
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        pass
+
+
+class _FakeClient:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def stat_object(self, bucket, key):
+        if key not in self.objects:
+            raise S3Error(None, 'NoSuchKey', 'missing', key, 'request', 'host')
+        return SimpleNamespace(size=len(self.objects[key]), etag='abc')
+
+    def get_object(self, bucket, key, offset=0, length=0):
+        data = self.objects[key]
+        return _FakeObject(data[offset:offset + length] if length else data[offset:])
+
+
+def _respond(range_header, key='batch/cert.pdf'):
+    minio = SimpleNamespace(client=_FakeClient({'batch/cert.pdf': bytes(range(256)) * 4}), bucket='certificates')
+
+    async def _run():
+        response = await _ranged_object_response(minio, key, 'cert.pdf', 'application/pdf', range_header)
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        return response, body
+
+    return asyncio.run(_run())
+
+
+def test_object_response_without_range():
+    response, body = _respond(None)
+    assert response.status_code == 200
+    assert response.headers['content-length'] == '1024'
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert body == bytes(range(256)) * 4
+
+
+def test_object_response_with_range():
+    response, body = _respond('bytes=256-511')
+    assert response.status_code == 206
+    assert response.headers['content-range'] == 'bytes 256-511/1024'
+    assert response.headers['content-length'] == '256'
+    assert body == bytes(range(256))
+
+
+def test_object_response_missing_object():
+    with pytest.raises(NotFoundError):
+        _respond(None, key='batch/missing.pdf')
+
+
+def test_serve_object_streams_in_stream_mode():
+    minio = SimpleNamespace(client=_FakeClient({'batch/cert.pdf': b'%PDF'}), bucket='certificates')
+    request = SimpleNamespace(headers={'range': 'bytes=1-2'})
+    response = asyncio.run(_serve_object(minio, 'batch/cert.pdf', 'cert.pdf', 'application/pdf', request, 'stream'))
+    assert response.status_code == 206
+
+
+def test_serve_object_checks_existence_before_signing():
+    minio = SimpleNamespace(object_exists=lambda key: False)
+    request = SimpleNamespace(headers={})
+    with pytest.raises(NotFoundError):
+        asyncio.run(_serve_object(
+            minio, 'batch/missing.pdf', 'missing.pdf', 'application/pdf', request, 'presigned', check_exists=True
+        ))
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import retention_service
+from app.services.retention_service import RetentionService
+from app.services.template_service import STAGING_DIR
+from app.storage.template_store import BLOBS_DIR
+
+
+class _FakeStorage:
+    def __init__(self, templates):
+        self.templates = templates
+
+    async def scan_templates(self):
+        return self.templates
+
+
+def _make(path, age: float = 0.0):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'template.html'), 'w') as f:
+        f.write('<p></p>')
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+
+
+@pytest.fixture
+def templates_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention_service, 'TEMPLATES_DIR', str(tmp_path))
+    monkeypatch.setattr(retention_service.settings, 'TEMP_FILES_RETENTION', 3600)
+    return tmp_path
+
+
+def _sweep(templates=()):
+    service = RetentionService(SimpleNamespace(storage=_FakeStorage(list(templates))))
+    return asyncio.run(service.remove_orphaned_templates())
+
+
+def test_only_stale_unreferenced_folders_are_removed(templates_dir):
+    _make(templates_dir / 'kept', age=7200)
+    _make(templates_dir / 'orphan', age=7200)
+    _make(templates_dir / 'recent')
+    _make(templates_dir / BLOBS_DIR, age=7200)
+
+    report = _sweep([{'id': 'kept'}])
+
+    assert report['template_folders'] == 1
+    assert sorted(os.listdir(templates_dir)) == sorted(['kept', 'recent', BLOBS_DIR])
+
+
+def test_staging_dir_survives_and_only_abandoned_uploads_go(templates_dir):
+    staging = templates_dir / STAGING_DIR
+    _make(staging / 'abandoned', age=7200)
+    _make(staging / 'extracting')
+    stamp = time.time() - 7200
+    os.utime(staging, (stamp, stamp))
+
+    report = _sweep()
+
+    assert report['template_folders'] == 1
+    assert os.listdir(staging) == ['extracting']
@@ -0,0 +1,122 @@
+import io
+import os
+import threading
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from minio.error import S3Error
+
+from app.storage.minio_storage import StreamingZipUpload, fetch_objects
+from app.utils.exceptions import StorageError
+
+
+class _FakeMinio:
+    """Stores put_object streams, read in part_size slices as Minio does."""
+
+    def __init__(self, fail_after: int = 0):
+        self.objects = {}
+        self.parts = []
+        self.fail_after = fail_after
+        self.aborted = threading.Event()
+
+    def put_object(self, bucket, key, data, length, part_size, content_type):
+        body = bytearray()
+        try:
+            while True:
+                part = data.read(part_size)
+                if not part:
+                    break
+                body += part
+                self.parts.append(len(part))
+                if self.fail_after and len(self.parts) >= self.fail_after:
+                    raise ConnectionError("MinIO went away")
+        except StorageError:
+            self.aborted.set()
+            raise
+        self.objects[(bucket, key)] = bytes(body)
+
+    def stat_object(self, bucket, key):
+        return SimpleNamespace(size=len(self.objects[(bucket, key)]))
+
+    def get_object(self, bucket, key):
+        if (bucket, key) not in self.objects:
+            raise S3Error(None, 'NoSuchKey', 'Object does not exist', key, None, None)
+        body = io.BytesIO(self.objects[(bucket, key)])
+        return SimpleNamespace(read=body.read, close=body.close, release_conn=lambda: None)
+
+
+def _members(count: int = 6, size: int = 700 * 1024):
+    return {f"cert_{i}.pdf": os.urandom(size) for i in range(count)}
+
+
+def test_round_trip():
+    client = _FakeMinio()
+    members = _members()
+    archive = StreamingZipUpload(client, 'certificates', 'batch/certificates.zip', part_size=2 * 1024 * 1024)
+    for name, data in members.items():
+        archive.add(name, data)
+    size = archive.complete()
+
+    body = client.objects[('certificates', 'batch/certificates.zip')]
+    assert size == len(body)
+    assert archive.count == len(members)
+    # Shipped in several parts while members were still being added
+    assert len(client.parts) > 1
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert zf.testzip() is None
+        assert {name: zf.read(name) for name in zf.namelist()} == members
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+
+
+def test_empty_archive_is_valid():
+    client = _FakeMinio()
+    archive = StreamingZipUpload(client, 'certificates', 'empty.zip', part_size=2 * 1024 * 1024)
+    archive.complete()
+    with zipfile.ZipFile(io.BytesIO(client.objects[('certificates', 'empty.zip')])) as zf:
+        assert zf.namelist() == []
+
+
+def test_complete_is_idempotent():
+    client = _FakeMinio()
+    archive = StreamingZipUpload(client, 'certificates', 'a.zip', part_size=2 * 1024 * 1024)
+    archive.add('a.pdf', b'%PDF-1.4')
+    assert archive.complete() == archive.complete()
+
+
+def test_abort_cancels_the_upload():
+    client = _FakeMinio()
+    archive = StreamingZipUpload(client, 'certificates', 'a.zip', part_size=2 * 1024 * 1024)
+    archive.add('a.pdf', os.urandom(1024 * 1024))
+    archive.abort()
+    assert client.aborted.is_set()
+    assert ('certificates', 'a.zip') not in client.objects
+
+
+def test_upload_failure_surfaces_as_storage_error():
+    client = _FakeMinio(fail_after=1)
+    archive = StreamingZipUpload(client, 'certificates', 'a.zip', part_size=2 * 1024 * 1024)
+    with pytest.raises(StorageError):
+        for name, data in _members(count=20).items():
+            archive.add(name, data)
+        archive.complete()
+    # As generate_certificates does when the archive stage fails
+    archive.abort()
+    assert ('certificates', 'a.zip') not in client.objects
+
+
+def test_fetch_objects_raises_on_unreadable_object():
+    client = _FakeMinio()
+    client.objects[('certificates', 'b/1.pdf')] = b'one'
+    with pytest.raises(S3Error):
+        list(fetch_objects(client, 'certificates', ['b/1.pdf', 'b/2.pdf'], max_in_flight=2))
+
+
+def test_fetch_objects_can_skip_unreadable_objects():
+    client = _FakeMinio()
+    client.objects[('certificates', 'b/1.pdf')] = b'one'
+    client.objects[('certificates', 'b/3.pdf')] = b'three'
+    fetched = list(fetch_objects(
+        client, 'certificates', ['b/1.pdf', 'b/2.pdf', 'b/3.pdf'], max_in_flight=2, skip_unreadable=True
+    ))
+    assert fetched == [('b/1.pdf', b'one'), ('b/3.pdf', b'three')]